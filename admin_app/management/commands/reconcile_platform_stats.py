@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from admin_app import rollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the platform statistics rollup from scratch and report drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drift, leave the stored counters unchanged')
+
+    def handle(self, *args, **options):
+        drift = rollup.reconcile(apply=not options['dry_run'])
+
+        for scope, key, period, stored, expected in drift:
+            scope_label = 'global' if scope == rollup.GLOBAL else f'clinic {scope}'
+            self.stdout.write(
+                f'{scope_label:>12} {key:<32} {period or "all time":<10} '
+                f'stored {stored:>8} expected {expected:>8} ({expected - stored:+d})'
+            )
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Platform statistics are consistent'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} counters have drifted'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Corrected {len(drift)} drifted counters'))
@@ -25,3 +25,23 @@ class AuditLog(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.action} - {self.timestamp}"
+
+
+class PlatformStat(models.Model):
+    """
+    One counter of the platform statistics rollup (see admin_app/rollup.py).
+    scope is 0 for platform-wide counters or a clinic id; period is '' for
+    all-time counters or a 'YYYY-MM-DD' day bucket.
+    """
+    scope = models.PositiveIntegerField(default=0)
+    key = models.CharField(max_length=64)
+    period = models.CharField(max_length=10, blank=True, default='')
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key', 'period'], name='unique_platform_stat'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}:{self.period or 'all'} = {self.value}"
@@ -0,0 +1,340 @@
+"""
+Incrementally maintained platform statistics.
+
+The admin dashboard reads its figures from PlatformStat rows instead of
+counting the underlying tables. Each tracked row contributes +1 to a set
+of counters. The set depends on the row's fields, e.g. an approved clinic
+counts towards clinics.total and clinics.approved. Counters exist
+platform-wide (scope 0) and, for models that belong to a clinic, per
+clinic (scope = clinic id).
+
+Signal handlers keep the counters current. post_init copies the counted
+fields of a loaded instance (nothing else, as it runs for every row read);
+post_save and post_delete apply the difference in counters with F()
+increments, so a save that changes no counted field costs no queries.
+Instances loaded with deferred counted fields are snapshot from the
+stored row in pre_save or pre_delete instead. Models whose counted fields
+never change after insert (health metrics, diseases) have no post_init
+hook: their rows are counted when created, and snapshot in pre_delete when
+deleted. Code that bypasses signals (bulk_create, QuerySet.update) must
+call record_created() or bump() itself.
+The reconcile_platform_stats command rebuilds everything from scratch and
+reports any drift. Counters written before the first rebuild (e.g. right
+after deploying onto existing data) only hold changes since then, so
+is_built() tells whether the rollup can be read; only reconcile sets the
+marker row it checks.
+
+Time-windowed figures such as "metrics recorded in the last 30 days" are
+kept in day buckets and summed on read. Medication adherence has its own
+daily rollup (patient/adherence.py) and is read from there.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+from types import SimpleNamespace
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from clinic.models import ClinicProfile, Disease
+from emergency.models import EmergencyAccess
+from patient import adherence
+from patient.models import (
+    Appointment, CounsellingSession, HealthMetric, Notification,
+    PatientProfile, Prescription, TelemedicineSession,
+)
+
+from .models import PlatformStat
+
+GLOBAL = 0
+
+# condition(instance) -> bool, or None to count every row. period(instance)
+# -> date/datetime for day-bucketed counters, summed over the last
+# ``window`` days on read (0: today and later).
+Stat = namedtuple('Stat', ['name', 'condition', 'period', 'window'], defaults=[None, None, None])
+
+# name: group in the dashboard namespace; fields: what the counters read;
+# clinic(instance) -> clinic id for per-clinic counters; mutable: whether
+# fields can change after insert, so saves need a before/after diff
+Tracked = namedtuple('Tracked', ['name', 'model', 'fields', 'stats', 'clinic', 'mutable'], defaults=[True])
+
+TRACKED = [
+    Tracked('clinics', ClinicProfile, ['is_approved', 'is_active'], [
+        Stat('total'),
+        Stat('approved', lambda o: o.is_approved),
+        Stat('pending', lambda o: not o.is_approved),
+        Stat('active', lambda o: o.is_active),
+        Stat('inactive', lambda o: not o.is_active),
+    ], None),
+    Tracked('patients', PatientProfile, ['is_active', 'current_clinic_id'], [
+        Stat('total'),
+        Stat('active', lambda o: o.is_active),
+        Stat('inactive', lambda o: not o.is_active),
+    ], lambda o: o.current_clinic_id),
+    Tracked('appointments', Appointment, ['status', 'appointment_date', 'clinic_id'], [
+        Stat('total'),
+        Stat('upcoming', lambda o: o.status in ('scheduled', 'confirmed'), lambda o: o.appointment_date, 0),
+        Stat('completed', lambda o: o.status == 'completed'),
+    ], lambda o: o.clinic_id),
+    Tracked('counselling_sessions', CounsellingSession, ['status', 'clinic_id'], [
+        Stat('total'),
+        Stat('active', lambda o: o.status in ('scheduled', 'in_progress')),
+    ], lambda o: o.clinic_id),
+    Tracked('prescriptions', Prescription, ['is_active', 'clinic_id'], [
+        Stat('total'),
+        Stat('active', lambda o: o.is_active),
+    ], lambda o: o.clinic_id),
+    Tracked('telemedicine_sessions', TelemedicineSession, ['status', 'clinic_id'], [
+        Stat('total'),
+        Stat('completed', lambda o: o.status == 'completed'),
+    ], lambda o: o.clinic_id),
+    Tracked('health_metrics', HealthMetric, ['recorded_at'], [
+        Stat('total'),
+        Stat('recent', None, lambda o: o.recorded_at, 30),
+    ], None, False),
+    Tracked('notifications', Notification, ['is_read', 'scheduled_at', 'delivered_at'], [
+        Stat('total'),
+        # Scheduled notifications count once they are delivered
+        Stat('unread', lambda o: not o.is_read and (o.scheduled_at is None or o.delivered_at is not None)),
+    ], None),
+    Tracked('emergencies', EmergencyAccess, ['created_at', 'clinic_id'], [
+        Stat('total'),
+        Stat('recent', None, lambda o: o.created_at, 7),
+    ], lambda o: o.clinic_id),
+    Tracked('diseases', Disease, [], [
+        Stat('total'),
+    ], None, False),
+]
+
+TRACKED_BY_MODEL = {tracked.model: tracked for tracked in TRACKED}
+
+SNAPSHOT_ATTR = '_platform_stat_keys'
+
+# Marker row written by reconcile(); never bumped
+BUILT_KEY = 'rollup.built'
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        value = timezone.localdate(value) if timezone.is_aware(value) else value.date()
+    return value.isoformat()
+
+
+def contributions(instance, tracked=None):
+    """The (scope, key, period) counters a model instance counts towards"""
+    tracked = tracked or TRACKED_BY_MODEL[type(instance)]
+    clinic_id = tracked.clinic(instance) if tracked.clinic else None
+    keys = set()
+    for stat in tracked.stats:
+        if stat.condition and not stat.condition(instance):
+            continue
+        period = ''
+        if stat.period:
+            value = stat.period(instance)
+            if value is None:
+                continue
+            period = _day(value)
+        key = f'{tracked.name}.{stat.name}'
+        keys.add((GLOBAL, key, period))
+        if clinic_id:
+            keys.add((clinic_id, key, period))
+    return frozenset(keys)
+
+
+def _values(instance, tracked):
+    return tuple(getattr(instance, field) for field in tracked.fields)
+
+
+def _loaded(instance, tracked):
+    return all(field in instance.__dict__ for field in tracked.fields)
+
+
+def snapshot(instance):
+    """Remember the counted field values of a loaded instance, unless some of them were deferred"""
+    tracked = TRACKED_BY_MODEL[type(instance)]
+    values = _values(instance, tracked) if instance.pk is not None and _loaded(instance, tracked) else None
+    setattr(instance, SNAPSHOT_ATTR, values)
+
+
+def snapshot_stored(instance):
+    """
+    Before a save or delete: remember the stored values when post_init could
+    not (deferred fields, or a model without the hook). This must run before
+    the row is written, as post_save and post_delete only see the new state.
+    """
+    tracked = TRACKED_BY_MODEL[type(instance)]
+    if instance.pk is None or getattr(instance, SNAPSHOT_ATTR, None) is not None:
+        return
+    if not tracked.mutable and _loaded(instance, tracked):
+        values = _values(instance, tracked)
+    else:
+        row = type(instance)._default_manager.filter(pk=instance.pk).values_list('pk', *tracked.fields).first()
+        values = row[1:] if row is not None else None
+    setattr(instance, SNAPSHOT_ATTR, values)
+
+
+def previous_keys(instance):
+    """The counters an instance contributed to before this save or delete; none for a row not stored yet"""
+    tracked = TRACKED_BY_MODEL[type(instance)]
+    values = getattr(instance, SNAPSHOT_ATTR, None)
+    if values is None:
+        return frozenset()
+    return contributions(SimpleNamespace(**dict(zip(tracked.fields, values))), tracked)
+
+
+def bump(deltas):
+    """
+    Apply {(scope, key, period): delta} to the stored counters: one query
+    to find the existing rows, one to update them and one to insert the
+    missing ones.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+
+    lookup = reduce(or_, (Q(scope=s, key=k, period=p) for s, k, p in deltas))
+    existing = list(PlatformStat.objects.filter(lookup))
+    for stat in existing:
+        stat.value = F('value') + deltas.pop((stat.scope, stat.key, stat.period))
+    if existing:
+        PlatformStat.objects.bulk_update(existing, ['value'])
+
+    if deltas:
+        try:
+            with transaction.atomic():
+                PlatformStat.objects.bulk_create([
+                    PlatformStat(scope=s, key=k, period=p, value=v) for (s, k, p), v in deltas.items()
+                ])
+        except IntegrityError:
+            # A concurrent writer created some of the rows first
+            for (s, k, p), v in deltas.items():
+                stat, _ = PlatformStat.objects.get_or_create(scope=s, key=k, period=p)
+                PlatformStat.objects.filter(pk=stat.pk).update(value=F('value') + v)
+
+
+def record_created(instances):
+    """Count instances inserted without signals, e.g. by bulk_create"""
+    deltas = Counter()
+    for instance in instances:
+        tracked = TRACKED_BY_MODEL[type(instance)]
+        deltas.update(contributions(instance, tracked))
+        setattr(instance, SNAPSHOT_ATTR, _values(instance, tracked))
+    bump(deltas)
+
+
+def record_values(model, counted):
+    """
+    Count rows inserted without model instances. counted holds
+    (attributes, number of rows) pairs, where attributes is an object with
+    the fields the model's counters read (see TRACKED).
+    """
+    tracked = TRACKED_BY_MODEL[model]
+    deltas = Counter()
+    for values, rows in counted:
+        for key in contributions(values, tracked):
+            deltas[key] += rows
+    bump(deltas)
+
+
+def adjust(name, stat, delta, scope=GLOBAL, period=''):
+    """Shift one counter, for updates made with QuerySet.update()"""
+    bump({(scope, f'{name}.{stat}', period): delta})
+
+
+def record_change(instance, old_keys):
+    tracked = TRACKED_BY_MODEL[type(instance)]
+    new_keys = contributions(instance, tracked)
+    deltas = Counter()
+    deltas.update(new_keys - old_keys)
+    deltas.subtract(old_keys - new_keys)
+    bump(deltas)
+    setattr(instance, SNAPSHOT_ATTR, _values(instance, tracked))
+
+
+def record_deleted(instance):
+    bump({key: -1 for key in previous_keys(instance)})
+
+
+def _period_filter(today):
+    """Q selecting the rows read for the dashboard: all-time counters plus the day buckets in each window"""
+    condition = Q(period='')
+    for tracked in TRACKED:
+        for stat in tracked.stats:
+            if stat.period:
+                start = today - timedelta(days=stat.window)
+                condition |= Q(key=f'{tracked.name}.{stat.name}', period__gte=start.isoformat())
+    return condition
+
+
+def read(scope=GLOBAL, today=None):
+    """
+    Dashboard figures for a scope in the shape of admin_app.stats.collect(),
+    from one query over a few rows, plus one for adherence platform-wide.
+    """
+    today = today or timezone.localdate()
+    rows = PlatformStat.objects.filter(_period_filter(today), scope=scope).values_list('key', 'value')
+    values = Counter()
+    for key, value in rows:
+        values[key] += value
+
+    stats = SimpleNamespace(**{
+        tracked.name: SimpleNamespace(**{
+            stat.name: values[f'{tracked.name}.{stat.name}'] for stat in tracked.stats
+        })
+        for tracked in TRACKED
+    })
+    # Intakes are not counted per clinic
+    if scope == GLOBAL:
+        stats.medication_intakes = SimpleNamespace(**adherence.platform_totals(today))
+    else:
+        stats.medication_intakes = SimpleNamespace(total=0, taken=0)
+    intakes = stats.medication_intakes
+    stats.adherence_rate = round(intakes.taken / intakes.total * 100, 1) if intakes.total else 0
+    stats.total_users = stats.patients.total + stats.clinics.total
+    return stats
+
+
+def expected_counts():
+    """Count every tracked row from scratch: {(scope, key, period): value}"""
+    counts = Counter()
+    for tracked in TRACKED:
+        fields = [field.removesuffix('_id') for field in tracked.fields]
+        queryset = tracked.model._default_manager.only('pk', *fields)
+        for instance in queryset.iterator(chunk_size=2000):
+            counts.update(contributions(instance, tracked))
+    return counts
+
+
+def is_built():
+    """Whether reconcile() has built the rollup, so its counters are complete"""
+    return PlatformStat.objects.filter(scope=GLOBAL, key=BUILT_KEY).exists()
+
+
+def reconcile(apply=True):
+    """
+    Compare the stored counters with a full recount. Returns the drift as
+    [(scope, key, period, stored, expected)]; with apply the stored
+    counters are replaced by the recount.
+    """
+    expected = expected_counts()
+    stored = {
+        (stat.scope, stat.key, stat.period): stat.value
+        for stat in PlatformStat.objects.exclude(scope=GLOBAL, key=BUILT_KEY)
+    }
+    drift = sorted(
+        (scope, key, period, stored.get((scope, key, period), 0), expected.get((scope, key, period), 0))
+        for scope, key, period in set(stored) | set(expected)
+        if stored.get((scope, key, period), 0) != expected.get((scope, key, period), 0)
+    )
+
+    if apply:
+        with transaction.atomic():
+            PlatformStat.objects.all().delete()
+            PlatformStat.objects.bulk_create(
+                [PlatformStat(scope=s, key=k, period=p, value=v) for (s, k, p), v in expected.items() if v]
+                + [PlatformStat(scope=GLOBAL, key=BUILT_KEY, value=1)],
+                batch_size=500
+            )
+    return drift
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+
+from . import rollup
+
+
+def snapshot_platform_stats(sender, instance, **kwargs):
+    rollup.snapshot(instance)
+
+
+def snapshot_stored_platform_stats(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rollup.snapshot_stored(instance)
+
+
+def update_platform_stats(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        rollup.record_change(instance, frozenset())
+    elif rollup.TRACKED_BY_MODEL[sender].mutable:
+        rollup.record_change(instance, rollup.previous_keys(instance))
+
+
+def remove_from_platform_stats(sender, instance, **kwargs):
+    rollup.record_deleted(instance)
+
+
+for tracked in rollup.TRACKED:
+    if tracked.mutable:
+        post_init.connect(snapshot_platform_stats, sender=tracked.model)
+        # Only reads the row when post_init found deferred fields
+        pre_save.connect(snapshot_stored_platform_stats, sender=tracked.model)
+    pre_delete.connect(snapshot_stored_platform_stats, sender=tracked.model)
+    post_save.connect(update_platform_stats, sender=tracked.model)
+    post_delete.connect(remove_from_platform_stats, sender=tracked.model)
@@ -0,0 +1,107 @@
+"""
+Platform-wide counts for the admin dashboard.
+
+Every table is counted in a single query: each figure is a COUNT with a
+FILTER clause (conditional aggregation), so adding a figure for a table
+does not add a query. Medication adherence is summed from the platform-wide
+DailyAdherence rows, one per day. collect() returns the figures grouped by table, e.g.
+``stats.clinics.approved``.
+"""
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from clinic.models import ClinicProfile, Disease
+from emergency.models import EmergencyAccess
+from patient import adherence
+from patient.models import (
+    Appointment, CounsellingSession, DailyAdherence, HealthMetric, Notification,
+    PatientProfile, Prescription, TelemedicineSession,
+)
+
+
+def table_counts(queryset, **conditions):
+    """
+    Count the rows of queryset matching each named condition in one query.
+    A condition of None counts every row; an aggregate is used as it is.
+    Returns a SimpleNamespace.
+    """
+    counts = queryset.aggregate(**{
+        name: Count('pk', filter=condition) if condition is None or isinstance(condition, Q) else condition
+        for name, condition in conditions.items()
+    })
+    return SimpleNamespace(**counts)
+
+
+def stat_definitions(now):
+    """(name, queryset, conditions) for every table shown on the dashboard"""
+    thirty_days_ago = now - timedelta(days=30)
+    return [
+        ('clinics', ClinicProfile.objects.all(), {
+            'total': None,
+            'approved': Q(is_approved=True),
+            'pending': Q(is_approved=False),
+            'active': Q(is_active=True),
+            'inactive': Q(is_active=False),
+        }),
+        ('patients', PatientProfile.objects.all(), {
+            'total': None,
+            'active': Q(is_active=True),
+            'inactive': Q(is_active=False),
+        }),
+        ('appointments', Appointment.objects.all(), {
+            'total': None,
+            'upcoming': Q(appointment_date__gte=now, status__in=['scheduled', 'confirmed']),
+            'completed': Q(status='completed'),
+        }),
+        ('counselling_sessions', CounsellingSession.objects.all(), {
+            'total': None,
+            'active': Q(status__in=['scheduled', 'in_progress']),
+        }),
+        ('prescriptions', Prescription.objects.all(), {
+            'total': None,
+            'active': Q(is_active=True),
+        }),
+        ('telemedicine_sessions', TelemedicineSession.objects.all(), {
+            'total': None,
+            'completed': Q(status='completed'),
+        }),
+        ('health_metrics', HealthMetric.objects.all(), {
+            'total': None,
+            'recent': Q(recorded_at__gte=thirty_days_ago),
+        }),
+        # Medication adherence over the last 30 days
+        ('medication_intakes', DailyAdherence.objects.filter(
+            patient__isnull=True, date__range=adherence.window(timezone.localdate(now))), {
+            'total': Coalesce(Sum('scheduled'), 0),
+            'taken': Coalesce(Sum('taken'), 0),
+        }),
+        ('notifications', Notification.objects.all(), {
+            'total': None,
+            'unread': Q(Notification.DELIVERED, is_read=False),
+        }),
+        ('emergencies', EmergencyAccess.objects.all(), {
+            'total': None,
+            'recent': Q(created_at__gte=now - timedelta(days=7)),
+        }),
+        ('diseases', Disease.objects.all(), {
+            'total': None,
+        }),
+    ]
+
+
+def collect(now=None):
+    """Dashboard figures, one query per table"""
+    now = now or timezone.now()
+    stats = SimpleNamespace(**{
+        name: table_counts(queryset, **conditions)
+        for name, queryset, conditions in stat_definitions(now)
+    })
+
+    intakes = stats.medication_intakes
+    stats.adherence_rate = round(intakes.taken / intakes.total * 100, 1) if intakes.total else 0
+    stats.total_users = stats.patients.total + stats.clinics.total
+    return stats
@@ -1,3 +1,196 @@
+from datetime import time, timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from admin_app import rollup, stats
+from admin_app.models import PlatformStat
+from clinic.models import ClinicProfile
+from patient.models import (
+    Appointment, HealthMetric, MedicationIntake, MedicationReminder, Notification, PatientProfile, Prescription,
+)
+
+
+class PlatformStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()  # Dashboard blocks
+        self.admin = User.objects.create_user(username='admin', password='TestPass123!', is_staff=True)
+        clinics = []
+        for i, approved in enumerate([True, True, False]):
+            user = User.objects.create_user(username=f'clinic{i}', password='TestPass123!')
+            clinics.append(ClinicProfile.objects.create(
+                user=user,
+                name=f'Clinic {i}',
+                address='Test Street',
+                phone_number='+1234567890',
+                location='Delhi',
+                is_approved=approved,
+                is_active=i != 1
+            ))
+        user = User.objects.create_user(username='patient', password='TestPass123!')
+        self.clinics = clinics
+        self.patient = patient = PatientProfile.objects.create(
+            user=user,
+            date_of_birth='1990-01-01',
+            phone_number='+1234567890',
+            address='Test Street',
+            current_location='Delhi',
+            current_clinic=clinics[0]
+        )
+
+        now = timezone.now()
+        for status, days in [('scheduled', 3), ('confirmed', -3), ('completed', -10)]:
+            Appointment.objects.create(patient=patient, clinic=clinics[0],
+                                       appointment_date=now + timedelta(days=days), status=status)
+
+        prescription = Prescription.objects.create(patient=patient, clinic=clinics[0], doctor=self.admin,
+                                                   diagnosis='Test')
+        reminder = MedicationReminder.objects.create(prescription=prescription, medication_name='Drug',
+                                                     dosage='1 tablet', frequency='three times daily',
+                                                     start_date=now.date())
+        for hour, taken in [(8, True), (14, True), (20, False)]:
+            MedicationIntake.objects.create(reminder=reminder, intake_time=time(hour), has_taken=taken)
+        MedicationIntake.objects.create(reminder=reminder, intake_time=time(8), has_taken=False,
+                                        intake_date=now.date() - timedelta(days=40))
+
+        for read in [True, False, False]:
+            Notification.objects.create(patient=patient, notification_type='general', title='Hi',
+                                        message='Hello', is_read=read)
+
+    def as_dict(self, namespace):
+        return {k: self.as_dict(v) if isinstance(v, SimpleNamespace) else v for k, v in vars(namespace).items()}
+
+    def assertRollupMatchesAggregates(self):
+        self.assertEqual(self.as_dict(rollup.read()), self.as_dict(stats.collect()))
+
+    def test_collect_uses_one_query_per_table(self):
+        """Test every dashboard figure comes from one aggregate per table"""
+        with self.assertNumQueries(len(stats.stat_definitions(timezone.now()))):
+            result = stats.collect()
+
+        self.assertEqual(vars(result.clinics), {'total': 3, 'approved': 2, 'pending': 1, 'active': 2, 'inactive': 1})
+        self.assertEqual(result.total_users, 4)
+        self.assertEqual(vars(result.appointments), {'total': 3, 'upcoming': 1, 'completed': 1})
+        self.assertEqual(result.prescriptions.active, 1)
+        self.assertEqual(vars(result.medication_intakes), {'total': 3, 'taken': 2})
+        self.assertEqual(result.adherence_rate, 66.7)
+        self.assertEqual(vars(result.notifications), {'total': 3, 'unread': 2})
+        self.assertEqual(result.diseases.total, 0)
+
+    def test_dashboard_renders_stats(self):
+        """Test the admin dashboard shows the aggregated counts"""
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_app:admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['approved_clinics'], 2)
+        self.assertEqual(response.context['unread_notifications'], 2)
+        self.assertEqual(response.context['adherence_rate'], 66.7)
+
+    def test_rollup_follows_saves_and_deletes(self):
+        """Test the rollup tracks creates, updates and deletes"""
+        self.assertRollupMatchesAggregates()
+
+        clinic = self.clinics[2]
+        clinic.is_approved = True
+        clinic.save()
+        Notification.objects.filter(is_read=True).delete()
+        for appointment in Appointment.objects.filter(status='scheduled'):
+            appointment.status = 'completed'
+            appointment.save()
+        self.assertRollupMatchesAggregates()
+
+        # Saves that change no counted field cost no rollup queries
+        notification = Notification.objects.first()
+        with self.assertNumQueries(1):
+            notification.title = 'Renamed'
+            notification.save(update_fields=['title'])
+
+        self.patient.delete()  # Cascades to appointments, intakes and notifications
+        self.assertRollupMatchesAggregates()
+
+    def test_rollup_follows_saves_of_deferred_instances(self):
+        """Test instances loaded without their counted fields still diff against the stored row"""
+        notification = Notification.objects.defer('is_read').filter(is_read=False).first()
+        notification.is_read = True
+        notification.save()
+        clinic = ClinicProfile.objects.only('pk', 'user').get(pk=self.clinics[2].pk)
+        clinic.is_approved = True
+        clinic.save()
+        self.assertRollupMatchesAggregates()
+
+        Appointment.objects.defer('status', 'appointment_date').filter(status='scheduled').delete()
+        self.assertRollupMatchesAggregates()
+
+    def test_creation_only_models_take_no_snapshot_on_load(self):
+        """Test health metrics are counted on create and delete without a snapshot of every row read"""
+        now = timezone.now()
+        for days in [1, 40]:
+            HealthMetric.objects.create(patient=self.patient, metric_type='weight', value=70, unit='kg',
+                                        recorded_at=now - timedelta(days=days))
+        self.assertRollupMatchesAggregates()
+
+        metrics = list(HealthMetric.objects.all())
+        self.assertFalse(any(hasattr(metric, rollup.SNAPSHOT_ATTR) for metric in metrics))
+        with self.assertNumQueries(1):
+            metrics[0].value = 71
+            metrics[0].save()
+
+        HealthMetric.objects.filter(recorded_at__gte=now - timedelta(days=7)).delete()
+        self.assertEqual(vars(rollup.read().health_metrics), {'total': 1, 'recent': 0})
+        self.assertRollupMatchesAggregates()
+
+    def test_rollup_read_is_one_query_per_scope(self):
+        """Test dashboard figures are read from a handful of rows"""
+        with self.assertNumQueries(1):
+            clinic_stats = rollup.read(scope=self.clinics[0].id)
+        self.assertEqual(vars(clinic_stats.appointments), {'total': 3, 'upcoming': 1, 'completed': 1})
+        self.assertEqual(clinic_stats.patients.total, 1)
+        self.assertLess(PlatformStat.objects.filter(scope=rollup.GLOBAL).count(), 40)
+
+    def test_bulk_mark_read_adjusts_unread_count(self):
+        """Test the QuerySet.update path bumps the counter explicitly"""
+        self.patient.user.groups.create(name='Patient')
+        self.client.force_login(self.patient.user)
+        self.client.get(reverse('patient:mark_all_notifications_read'))
+        self.assertEqual(rollup.read().notifications.unread, 0)
+        self.assertRollupMatchesAggregates()
+
+    def test_dashboard_aggregates_until_the_rollup_is_built(self):
+        """Test counters bumped before the first reconcile are not mistaken for a built rollup"""
+        self.client.force_login(self.admin)
+        # As if deployed onto existing data: only later saves were counted
+        PlatformStat.objects.filter(scope=rollup.GLOBAL, key='clinics.approved').update(value=0)
+        self.assertFalse(rollup.is_built())
+        response = self.client.get(reverse('admin_app:admin_dashboard'))
+        self.assertEqual(response.context['approved_clinics'], 2)
+
+        rollup.reconcile()
+        self.assertTrue(rollup.is_built())
+        self.assertEqual(rollup.reconcile(apply=False), [])
+        cache.clear()
+        with mock.patch.object(stats, 'collect') as collect:
+            response = self.client.get(reverse('admin_app:admin_dashboard'))
+        collect.assert_not_called()
+        self.assertEqual(response.context['approved_clinics'], 2)
+        self.assertRollupMatchesAggregates()
+
+    def test_reconcile_reports_and_fixes_drift(self):
+        """Test the reconcile command rebuilds the rollup"""
+        out = StringIO()
+        call_command('reconcile_platform_stats', '--dry-run', stdout=out)
+        self.assertIn('consistent', out.getvalue())
 
-# Create your tests here.
+        PlatformStat.objects.filter(scope=rollup.GLOBAL, key='clinics.approved').update(value=10)
+        PlatformStat.objects.filter(scope=rollup.GLOBAL, key='notifications.total').delete()
+        out = StringIO()
+        call_command('reconcile_platform_stats', stdout=out)
+        self.assertIn('clinics.approved', out.getvalue())
+        self.assertIn('Corrected 2 drifted counters', out.getvalue())
+        self.assertRollupMatchesAggregates()
@@ -10,131 +10,84 @@ from django.utils import timezone
 # Models
 from admin_app.models import AuditLog
 from clinic.models import ClinicProfile, Disease
-from emergency.models import EmergencyAccess
-from patient.models import (
-    MedicationIntake, PatientProfile, Appointment, CounsellingSession, 
-    Prescription, MedicationReminder, TelemedicineSession,
-    HealthMetric, Notification
-)
+from patient.models import PatientProfile
 
 # Utils
+from admin_app import rollup, stats as platform_stats
+from core import dashboard_cache, geocode_queue
 from safar_saathi.utils import is_admin
 
 logger = logging.getLogger(__name__)
 
 
+def current_platform_stats():
+    # Counts come from the incrementally maintained rollup; until it has
+    # been built (reconcile_platform_stats) they are aggregated directly
+    if rollup.is_built():
+        return rollup.read()
+    return platform_stats.collect()
+
+
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
     try:
-        # Basic counts
-        total_patients = PatientProfile.objects.count()
-        total_clinics = ClinicProfile.objects.count()
-        total_users = total_patients + total_clinics
-        total_emergencies = EmergencyAccess.objects.count()
-        
-        # Clinic status
-        approved_clinics = ClinicProfile.objects.filter(is_approved=True).count()
-        pending_clinics = ClinicProfile.objects.filter(is_approved=False).count()
-        active_clinics = ClinicProfile.objects.filter(is_active=True).count()
-        inactive_clinics = ClinicProfile.objects.filter(is_active=False).count()
-        
-        # Patient status
-        active_patients = PatientProfile.objects.filter(is_active=True).count()
-        inactive_patients = PatientProfile.objects.filter(is_active=False).count()
-        
-        # Healthcare metrics
-        total_appointments = Appointment.objects.count()
-        upcoming_appointments = Appointment.objects.filter(
-            appointment_date__gte=timezone.now(),
-            status__in=['scheduled', 'confirmed']
-        ).count()
-        completed_appointments = Appointment.objects.filter(status='completed').count()
-        
-        total_counselling_sessions = CounsellingSession.objects.count()
-        active_counselling_sessions = CounsellingSession.objects.filter(
-            status__in=['scheduled', 'in_progress']
-        ).count()
-        
-        total_prescriptions = Prescription.objects.count()
-        active_prescriptions = Prescription.objects.filter(is_active=True).count()
-        
-        total_telemedicine_sessions = TelemedicineSession.objects.count()
-        completed_telemedicine_sessions = TelemedicineSession.objects.filter(status='completed').count()
-        
-        # Health metrics
-        total_health_metrics = HealthMetric.objects.count()
-        recent_health_metrics = HealthMetric.objects.filter(
-            recorded_at__gte=timezone.now() - timezone.timedelta(days=30)
-        ).count()
-        
-        # Medication adherence (last 30 days)
-        thirty_days_ago = timezone.now() - timezone.timedelta(days=30)
-        medication_logs = MedicationIntake.objects.filter(intake_date__gte=thirty_days_ago)
-        total_doses = medication_logs.count()
-        taken_doses = medication_logs.filter(has_taken=True).count()
-        adherence_rate = (taken_doses / total_doses * 100) if total_doses > 0 else 0
-        
-        # Notifications
-        total_notifications = Notification.objects.count()
-        unread_notifications = Notification.objects.filter(is_read=False).count()
-        
-        # Diseases
-        total_diseases = Disease.objects.count()
-        
+        stats = dashboard_cache.get_block('admin.stats', dashboard_cache.GLOBAL, current_platform_stats)
+
         # Recent activity
-        clinics = ClinicProfile.objects.all()[:5]  # Recent clinics
-        audit_logs = AuditLog.objects.all()[:10]  # Last 10 logs
-        
-        # System health indicators
-        recent_emergencies = EmergencyAccess.objects.filter(
-            created_at__gte=timezone.now() - timezone.timedelta(days=7)
-        ).count()
-        
+        clinics = dashboard_cache.get_block(
+            'admin.recent_clinics', dashboard_cache.GLOBAL,
+            lambda: list(ClinicProfile.objects.all()[:5]))  # Recent clinics
+        audit_logs = dashboard_cache.get_block(
+            'admin.audit_logs', dashboard_cache.GLOBAL,
+            lambda: list(AuditLog.objects.select_related('user')[:10]))  # Last 10 logs
+
         context = {
+            'stats': stats,
+
             # Basic counts
-            'total_users': total_users,
-            'total_patients': total_patients,
-            'total_clinics': total_clinics,
-            'total_emergencies': total_emergencies,
-            
+            'total_users': stats.total_users,
+            'total_patients': stats.patients.total,
+            'total_clinics': stats.clinics.total,
+            'total_emergencies': stats.emergencies.total,
+
             # Clinic metrics
-            'approved_clinics': approved_clinics,
-            'pending_clinics': pending_clinics,
-            'active_clinics': active_clinics,
-            'inactive_clinics': inactive_clinics,
-            
+            'approved_clinics': stats.clinics.approved,
+            'pending_clinics': stats.clinics.pending,
+            'active_clinics': stats.clinics.active,
+            'inactive_clinics': stats.clinics.inactive,
+
             # Patient metrics
-            'active_patients': active_patients,
-            'inactive_patients': inactive_patients,
-            
+            'active_patients': stats.patients.active,
+            'inactive_patients': stats.patients.inactive,
+
             # Healthcare services
-            'total_appointments': total_appointments,
-            'upcoming_appointments': upcoming_appointments,
-            'completed_appointments': completed_appointments,
-            
-            'total_counselling_sessions': total_counselling_sessions,
-            'active_counselling_sessions': active_counselling_sessions,
-            
-            'total_prescriptions': total_prescriptions,
-            'active_prescriptions': active_prescriptions,
-            
-            'total_telemedicine_sessions': total_telemedicine_sessions,
-            'completed_telemedicine_sessions': completed_telemedicine_sessions,
-            
+            'total_appointments': stats.appointments.total,
+            'upcoming_appointments': stats.appointments.upcoming,
+            'completed_appointments': stats.appointments.completed,
+
+            'total_counselling_sessions': stats.counselling_sessions.total,
+            'active_counselling_sessions': stats.counselling_sessions.active,
+
+            'total_prescriptions': stats.prescriptions.total,
+            'active_prescriptions': stats.prescriptions.active,
+
+            'total_telemedicine_sessions': stats.telemedicine_sessions.total,
+            'completed_telemedicine_sessions': stats.telemedicine_sessions.completed,
+
             # Health monitoring
-            'total_health_metrics': total_health_metrics,
-            'recent_health_metrics': recent_health_metrics,
-            'adherence_rate': round(adherence_rate, 1),
-            
+            'total_health_metrics': stats.health_metrics.total,
+            'recent_health_metrics': stats.health_metrics.recent,
+            'adherence_rate': stats.adherence_rate,
+
             # Communication
-            'total_notifications': total_notifications,
-            'unread_notifications': unread_notifications,
-            
+            'total_notifications': stats.notifications.total,
+            'unread_notifications': stats.notifications.unread,
+
             # System data
-            'total_diseases': total_diseases,
-            'recent_emergencies': recent_emergencies,
-            
+            'total_diseases': stats.diseases.total,
+            'recent_emergencies': stats.emergencies.recent,
+
             # Lists
             'clinics': clinics,
             'audit_logs': audit_logs,
@@ -363,7 +316,7 @@ def edit_patient(request, patient_id):
             patient.current_clinic = get_object_or_404(ClinicProfile, id=clinic_id)
         else:
             patient.current_clinic = None
-        patient.save()
+        patient.save(update_fields=['current_clinic'])
         AuditLog.objects.create(user=request.user, action='update', details=f'Updated patient {patient.user.username}')
         messages.success(request, f'Patient {patient.user.username} updated.')
         return redirect('admin_app:patient_management')
@@ -381,9 +334,13 @@ def edit_clinic(request, clinic_id):
     clinic = get_object_or_404(ClinicProfile, id=clinic_id)
     if request.method == 'POST':
         clinic.name = request.POST.get('name')
-        clinic.address = request.POST.get('address')
-        clinic.diseases_treated = request.POST.get('diseases_treated')
+        address = request.POST.get('address')
+        if address != clinic.address:
+            geocode_queue.mark_pending(clinic)
+        clinic.address = address
         clinic.save()
+        if 'diseases_treated' in request.POST:
+            clinic.diseases_treated.set(request.POST.getlist('diseases_treated'))
         AuditLog.objects.create(user=request.user, action='update', details=f'Updated clinic {clinic.name}')
         messages.success(request, f'Clinic {clinic.name} updated.')
         return redirect('admin_app:clinic_management')
@@ -405,7 +362,7 @@ def deactivate_patient(request, patient_id):
                 return redirect('admin_app:user_management')
 
             patient.is_active = False
-            patient.save()
+            patient.save(update_fields=['is_active'])
 
             AuditLog.objects.create(
                 user=request.user,
@@ -439,7 +396,7 @@ def activate_patient(request, patient_id):
                 return redirect('admin_app:user_management')
 
             patient.is_active = True
-            patient.save()
+            patient.save(update_fields=['is_active'])
 
             AuditLog.objects.create(
                 user=request.user,
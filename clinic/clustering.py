@@ -0,0 +1,98 @@
+"""
+Zoom-aware grid clustering for clinic map markers.
+
+Points are projected to Web Mercator pixels at every zoom level and bucketed
+into square cells of CLUSTER_RADIUS_PX. A cell holding several clinics
+becomes one cluster marker at the centroid of its members. Because the grid
+at zoom z+1 subdivides the grid at zoom z, clusters split as the map zooms
+in. From MAX_CLUSTER_ZOOM onwards every clinic is shown on its own.
+
+The whole hierarchy is built in one vectorised pass per zoom and can be
+pickled into the cache, so panning and zooming the same search only slices
+precomputed arrays.
+"""
+import numpy as np
+
+TILE_SIZE = 256
+CLUSTER_RADIUS_PX = 60
+MAX_CLUSTER_ZOOM = 16
+
+# Web Mercator is undefined at the poles
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def mercator_pixels(lats, lngs, zoom):
+    """Project coordinates to global pixel coordinates at a zoom level"""
+    world = TILE_SIZE * 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    x = (lngs + 180.0) / 360.0 * world
+    sin_lat = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * world
+    return x, y
+
+
+class ClusterIndex:
+    """
+    Precomputed clusters for a fixed set of points.
+
+    ``rows`` is a list of per-point payloads (anything picklable) returned
+    unchanged for unclustered points.
+    """
+
+    def __init__(self, lats, lngs, rows, max_zoom=MAX_CLUSTER_ZOOM):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.rows = list(rows)
+        self.max_zoom = max_zoom
+        # zoom -> (centroid lats, centroid lngs, counts, first member index)
+        self.levels = {}
+        if self.rows:
+            for zoom in range(max_zoom):
+                self.levels[zoom] = self._cluster(zoom)
+
+    def _cluster(self, zoom):
+        x, y = mercator_pixels(self.lats, self.lngs, zoom)
+        cells_per_row = int(np.ceil(TILE_SIZE * 2 ** zoom / CLUSTER_RADIUS_PX)) + 1
+        cells = (np.floor(y / CLUSTER_RADIUS_PX).astype(np.int64) * cells_per_row
+                 + np.floor(x / CLUSTER_RADIUS_PX).astype(np.int64))
+        _, first, labels, counts = np.unique(cells, return_index=True, return_inverse=True, return_counts=True)
+        centroid_lats = np.bincount(labels, weights=self.lats) / counts
+        centroid_lngs = np.bincount(labels, weights=self.lngs) / counts
+        return centroid_lats, centroid_lngs, counts, first
+
+    @property
+    def bounds(self):
+        """[[min_lat, min_lng], [max_lat, max_lng]] of all points, or None"""
+        if not self.rows:
+            return None
+        return [[float(self.lats.min()), float(self.lngs.min())],
+                [float(self.lats.max()), float(self.lngs.max())]]
+
+    def query(self, zoom, bbox=None):
+        """
+        Return (clusters, rows) visible at a zoom level. Clusters are
+        [lat, lng, count] lists; rows are the payloads of points shown
+        individually. bbox is an optional (min_lat, min_lng, max_lat, max_lng).
+        """
+        zoom = max(int(zoom), 0)
+        if zoom >= self.max_zoom or not self.rows:
+            lats, lngs = self.lats, self.lngs
+            counts = np.ones(len(self.rows), dtype=np.int64)
+            first = np.arange(len(self.rows))
+        else:
+            lats, lngs, counts, first = self.levels[zoom]
+
+        visible = np.ones(len(counts), dtype=bool)
+        if bbox is not None:
+            min_lat, min_lng, max_lat, max_lng = bbox
+            visible = (lats >= min_lat) & (lats <= max_lat) & (lngs >= min_lng) & (lngs <= max_lng)
+
+        clusters = []
+        rows = []
+        for i in np.flatnonzero(visible):
+            if counts[i] == 1:
+                rows.append(self.rows[first[i]])
+            else:
+                clusters.append([round(float(lats[i]), 5), round(float(lngs[i]), 5), int(counts[i])])
+        return clusters, rows
@@ -0,0 +1,92 @@
+"""
+Packed disease sets for clinic relevance filtering.
+
+Each clinic stores the diseases it treats as a bitmask in
+ClinicProfile.disease_mask: bit ``n`` is set when the clinic treats the
+Disease with id ``n``. The mask is kept as little-endian bytes so it is not
+limited to 64 disease ids. Signals keep it in sync with the diseases_treated
+relation, so matching a patient against any number of clinics is one
+bitwise AND per clinic and no queries.
+
+A clinic with an empty mask has not narrowed its specialities and is
+relevant to every patient.
+"""
+from collections import defaultdict
+
+from .models import ClinicProfile, Disease
+
+
+def to_bytes(mask):
+    return mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+
+def from_bytes(value):
+    return int.from_bytes(bytes(value or b''), 'little')
+
+
+def mask_for(disease_ids):
+    """Bitmask with a bit set for each disease id"""
+    mask = 0
+    for disease_id in disease_ids:
+        mask |= 1 << disease_id
+    return mask
+
+
+def patient_mask(disease_names):
+    """
+    Bitmask of the Disease rows matching a patient's disease names.
+    Names are matched case-insensitively; unknown names are ignored.
+    """
+    wanted = {name.strip().lower() for name in disease_names if name}
+    if not wanted:
+        return 0
+    return mask_for(
+        disease_id for disease_id, name in Disease.objects.values_list('id', 'name')
+        if name.lower() in wanted
+    )
+
+
+def is_relevant(clinic, mask):
+    """Whether a clinic treats any disease in mask (or has no speciality)"""
+    clinic_mask = from_bytes(clinic.disease_mask)
+    return not clinic_mask or bool(clinic_mask & mask)
+
+
+def refresh(clinic_ids):
+    """
+    Recompute the stored masks of the given clinics from diseases_treated.
+    Returns {clinic id: stored mask bytes}.
+    """
+    clinic_ids = set(clinic_ids)
+    if not clinic_ids:
+        return {}
+    through = ClinicProfile.diseases_treated.through
+    diseases = defaultdict(list)
+    for clinic_id, disease_id in through.objects.filter(
+        clinicprofile_id__in=clinic_ids
+    ).values_list('clinicprofile_id', 'disease_id'):
+        diseases[clinic_id].append(disease_id)
+
+    masks = {clinic_id: to_bytes(mask_for(diseases[clinic_id])) for clinic_id in clinic_ids}
+    by_mask = defaultdict(list)
+    for clinic_id, value in masks.items():
+        by_mask[value].append(clinic_id)
+    # update() rather than save() so the clinic post_save handlers do not run
+    for value, ids in by_mask.items():
+        ClinicProfile.objects.filter(id__in=ids).update(disease_mask=value)
+    return masks
+
+
+def clinics_treating(disease):
+    """Ids of the clinics linked to a disease"""
+    return list(
+        ClinicProfile.diseases_treated.through.objects.filter(disease=disease)
+        .values_list('clinicprofile_id', flat=True)
+    )
+
+
+def rebuild():
+    """Recompute every clinic's mask. Returns the number of clinics."""
+    clinic_ids = list(ClinicProfile.objects.values_list('id', flat=True))
+    refresh(clinic_ids)
+    return len(clinic_ids)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from clinic import disease_mask, spatial
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the spatial index over clinic coordinates and the clinic disease masks'
+
+    def handle(self, *args, **options):
+        masked = disease_mask.rebuild()
+        self.stdout.write(f'Recomputed disease masks for {masked} clinics')
+
+        if not spatial.rtree_enabled():
+            self.stdout.write(self.style.WARNING('Spatial index is only used on SQLite; nothing to rebuild'))
+            return
+
+        indexed = spatial.rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully indexed {indexed} clinics')
+        )
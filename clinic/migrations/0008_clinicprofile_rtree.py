@@ -0,0 +1,34 @@
+from django.db import migrations
+
+RTREE_TABLE = 'clinic_clinicprofile_rtree'
+
+
+def create_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {RTREE_TABLE} '
+        f'USING rtree(id, min_lat, max_lat, min_lng, max_lng)'
+    )
+    schema_editor.execute(
+        f'INSERT INTO {RTREE_TABLE} (id, min_lat, max_lat, min_lng, max_lng) '
+        f'SELECT id, latitude, latitude, longitude, longitude FROM clinic_clinicprofile '
+        f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+    )
+
+
+def drop_rtree(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {RTREE_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0007_disease_remove_clinicprofile_diseases_treated_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rtree, drop_rtree),
+    ]
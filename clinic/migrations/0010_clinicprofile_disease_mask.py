@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:53
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def populate_disease_masks(apps, schema_editor):
+    ClinicProfile = apps.get_model('clinic', 'ClinicProfile')
+    masks = defaultdict(int)
+    for clinic_id, disease_id in ClinicProfile.diseases_treated.through.objects.values_list(
+            'clinicprofile_id', 'disease_id'):
+        masks[clinic_id] |= 1 << disease_id
+    for clinic_id, mask in masks.items():
+        ClinicProfile.objects.filter(pk=clinic_id).update(
+            disease_mask=mask.to_bytes((mask.bit_length() + 7) // 8, 'little'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0009_clinicprofile_geocode_attempts_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinicprofile',
+            name='disease_mask',
+            field=models.BinaryField(default=b'', help_text='Bitmask of diseases_treated ids, see clinic.disease_mask'),
+        ),
+        migrations.RunPython(populate_disease_masks, migrations.RunPython.noop),
+    ]
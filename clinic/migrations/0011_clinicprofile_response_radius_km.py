@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:57
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0010_clinicprofile_disease_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinicprofile',
+            name='response_radius_km',
+            field=models.PositiveIntegerField(default=50, help_text='Emergency alerts within this distance are shown to the clinic', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(500)]),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 
 
@@ -18,6 +19,11 @@ class Disease(models.Model):
 
 
 class ClinicProfile(models.Model):
+    GEOCODE_STATUS_CHOICES = [
+        ('pending', 'Pending Geocode'),
+        ('geocoded', 'Geocoded'),
+        ('failed', 'Geocode Failed'),
+    ]
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     address = models.TextField()
@@ -25,10 +31,25 @@ class ClinicProfile(models.Model):
     location = models.CharField(max_length=100)  # City/State
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    geocode_status = models.CharField(max_length=10, choices=GEOCODE_STATUS_CHOICES, default='pending',
+                                      help_text="Filled in by the geocode_pending worker")
+    geocode_attempts = models.PositiveSmallIntegerField(default=0)
+    geocode_retry_at = models.DateTimeField(null=True, blank=True)
     diseases_treated = models.ManyToManyField(Disease, blank=True, help_text="Diseases treated by this clinic")
+    disease_mask = models.BinaryField(default=b'', editable=False,
+                                      help_text="Bitmask of diseases_treated ids, see clinic.disease_mask")
     is_approved = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True, help_text="Whether this clinic is active")
+    response_radius_km = models.PositiveIntegerField(
+        default=50, validators=[MinValueValidator(1), MaxValueValidator(500)],
+        help_text="Emergency alerts within this distance are shown to the clinic"
+    )
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['geocode_status', 'geocode_retry_at']),
+        ]
+
     def __str__(self):
         return self.name
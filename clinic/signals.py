@@ -0,0 +1,45 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import ClinicProfile, Disease
+from . import disease_mask, spatial
+
+
+@receiver(post_save, sender=ClinicProfile)
+def sync_clinic_spatial_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    spatial.index_clinic(instance)
+
+
+@receiver(post_delete, sender=ClinicProfile)
+def remove_clinic_from_spatial_index(sender, instance, **kwargs):
+    spatial.unindex_clinic(instance.pk)
+
+
+@receiver(m2m_changed, sender=ClinicProfile.diseases_treated.through)
+def sync_clinic_disease_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.disease_mask = disease_mask.refresh([instance.pk])[instance.pk]
+        return
+
+    # disease.clinicprofile_set changes: pk_set holds clinic ids, except on
+    # clear where the affected clinics have to be looked up beforehand
+    if action == 'pre_clear':
+        instance._mask_clinic_ids = disease_mask.clinics_treating(instance)
+    elif action == 'post_clear':
+        disease_mask.refresh(getattr(instance, '_mask_clinic_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        disease_mask.refresh(pk_set or [])
+
+
+@receiver(pre_delete, sender=Disease)
+def collect_disease_clinics(sender, instance, **kwargs):
+    # The cascade removes the through rows without sending m2m_changed
+    instance._mask_clinic_ids = disease_mask.clinics_treating(instance)
+
+
+@receiver(post_delete, sender=Disease)
+def drop_disease_from_masks(sender, instance, **kwargs):
+    disease_mask.refresh(getattr(instance, '_mask_clinic_ids', []))
@@ -0,0 +1,161 @@
+"""
+Spatial index over ClinicProfile coordinates.
+
+On SQLite the index is an R*Tree virtual table that mirrors every clinic with
+a latitude/longitude. It is kept in sync by the signal handlers in
+clinic/signals.py. Radius and nearest-neighbour queries first ask the index
+for the clinics inside a bounding box, so only those candidates are loaded
+and measured, in one vectorised pass (see safar_saathi/distance.py). Other
+database backends fall back to a bounding-box filter on the
+latitude/longitude columns.
+"""
+import math
+
+import numpy as np
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from safar_saathi.distance import within_radius
+
+from .models import ClinicProfile
+
+RTREE_TABLE = 'clinic_clinicprofile_rtree'
+
+KM_PER_DEGREE_LAT = 111.32
+
+
+def rtree_enabled():
+    """The R*Tree virtual table only exists on SQLite (see migration 0008)"""
+    return connection.vendor == 'sqlite'
+
+
+def bounding_boxes(lat, lng, radius_km):
+    """
+    Return the (min_lat, max_lat, min_lng, max_lng) boxes that enclose a
+    circle of radius_km around (lat, lng). A circle crossing the
+    antimeridian is split into two boxes.
+    """
+    delta_lat = radius_km / KM_PER_DEGREE_LAT
+    min_lat = max(lat - delta_lat, -90.0)
+    max_lat = min(lat + delta_lat, 90.0)
+
+    # Longitude degrees shrink towards the poles; use the widest latitude
+    # inside the box so the circle is always fully covered.
+    widest = max(abs(min_lat), abs(max_lat))
+    cos_lat = math.cos(math.radians(widest))
+    if widest >= 90.0 or cos_lat <= 1e-9:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    delta_lng = radius_km / (KM_PER_DEGREE_LAT * cos_lat)
+    if delta_lng >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+
+    min_lng = lng - delta_lng
+    max_lng = lng + delta_lng
+    if min_lng < -180.0:
+        return [(min_lat, max_lat, min_lng + 360.0, 180.0),
+                (min_lat, max_lat, -180.0, max_lng)]
+    if max_lng > 180.0:
+        return [(min_lat, max_lat, min_lng, 180.0),
+                (min_lat, max_lat, -180.0, max_lng - 360.0)]
+    return [(min_lat, max_lat, min_lng, max_lng)]
+
+
+def index_clinic(clinic):
+    """Insert, move or drop a clinic's entry to match its current coordinates"""
+    if not rtree_enabled():
+        return
+    with connection.cursor() as cursor:
+        if clinic.latitude is None or clinic.longitude is None:
+            cursor.execute(f'DELETE FROM {RTREE_TABLE} WHERE id = %s', [clinic.pk])
+        else:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {RTREE_TABLE} '
+                f'(id, min_lat, max_lat, min_lng, max_lng) VALUES (%s, %s, %s, %s, %s)',
+                [clinic.pk, clinic.latitude, clinic.latitude, clinic.longitude, clinic.longitude]
+            )
+
+
+def unindex_clinic(clinic_id):
+    if not rtree_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {RTREE_TABLE} WHERE id = %s', [clinic_id])
+
+
+def rebuild_index():
+    """Repopulate the index from the clinic table. Returns the number of entries."""
+    if not rtree_enabled():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {RTREE_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {RTREE_TABLE} (id, min_lat, max_lat, min_lng, max_lng) '
+            f'SELECT id, latitude, latitude, longitude, longitude FROM {ClinicProfile._meta.db_table} '
+            f'WHERE latitude IS NOT NULL AND longitude IS NOT NULL'
+        )
+        return cursor.rowcount
+
+
+def candidates_in_radius(lat, lng, radius_km, queryset=None):
+    """
+    Narrow a ClinicProfile queryset to the clinics inside the bounding box of
+    the search circle. Candidates still need an exact distance check.
+    """
+    if queryset is None:
+        queryset = ClinicProfile.objects.all()
+    queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+    boxes = bounding_boxes(lat, lng, radius_km)
+
+    if rtree_enabled():
+        where = ' OR '.join(
+            '(min_lat <= %s AND max_lat >= %s AND min_lng <= %s AND max_lng >= %s)'
+            for _ in boxes
+        )
+        params = []
+        for min_lat, max_lat, min_lng, max_lng in boxes:
+            params.extend([max_lat, min_lat, max_lng, min_lng])
+        return queryset.filter(id__in=RawSQL(f'SELECT id FROM {RTREE_TABLE} WHERE {where}', params))
+
+    condition = Q()
+    for min_lat, max_lat, min_lng, max_lng in boxes:
+        condition |= Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lng, max_lng))
+    return queryset.filter(condition)
+
+
+def clinics_within(lat, lng, radius_km, queryset=None):
+    """
+    Return the clinics within radius_km of (lat, lng), nearest first. Each
+    clinic gets a ``distance`` attribute in kilometres.
+    """
+    candidates = list(candidates_in_radius(lat, lng, radius_km, queryset))
+    if not candidates:
+        return []
+
+    mask, distances = within_radius(
+        lat, lng,
+        [clinic.latitude for clinic in candidates],
+        [clinic.longitude for clinic in candidates],
+        radius_km
+    )
+    results = []
+    for i in np.argsort(distances, kind='stable'):
+        if mask[i]:
+            clinic = candidates[i]
+            clinic.distance = float(distances[i])
+            results.append(clinic)
+    return results
+
+
+def nearest_clinics(lat, lng, k, queryset=None, start_radius_km=5, max_radius_km=500):
+    """
+    Return up to k clinics closest to (lat, lng), nearest first. The search
+    radius doubles until k clinics are found or max_radius_km is reached.
+    """
+    radius = start_radius_km
+    while True:
+        found = clinics_within(lat, lng, radius, queryset)
+        if len(found) >= k or radius >= max_radius_km:
+            return found[:k]
+        radius = min(radius * 2, max_radius_km)
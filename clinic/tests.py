@@ -1,7 +1,12 @@
-from django.test import TestCase
-from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+from django.contrib.auth.models import Group, User
+from django.urls import reverse
+from django.utils import timezone
 from clinic.forms import ClinicRegistrationForm
 from clinic.models import ClinicProfile, Disease
+from clinic import disease_mask, spatial
+from clinic.clustering import MAX_CLUSTER_ZOOM, ClusterIndex
+from patient.models import MedicationIntake, MedicationReminder, PatientProfile, Prescription, TreatmentRecord
 
 class ClinicRegistrationFormTest(TestCase):
     def setUp(self):
@@ -58,3 +63,235 @@ class ClinicRegistrationFormTest(TestCase):
         form = ClinicRegistrationForm(data=form_data)
         self.assertFalse(form.is_valid())
         self.assertIn('__all__', form.errors)
+
+
+class ClinicSpatialIndexTest(TestCase):
+    def make_clinic(self, username, lat, lng, **kwargs):
+        user = User.objects.create_user(username=username, password='TestPass123!')
+        return ClinicProfile.objects.create(
+            user=user,
+            name=f"{username} clinic",
+            address='Test Street',
+            phone_number='+1234567890',
+            location='Test City',
+            latitude=lat,
+            longitude=lng,
+            **kwargs
+        )
+
+    def indexed_ids(self):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {spatial.RTREE_TABLE}')
+            return {row[0] for row in cursor.fetchall()}
+
+    def test_index_follows_save_and_delete(self):
+        """Test the index tracks clinic coordinates"""
+        clinic = self.make_clinic('indexed', 28.61, 77.20)
+        unlocated = self.make_clinic('unlocated', None, None)
+        self.assertEqual(self.indexed_ids(), {clinic.id})
+
+        clinic.latitude, clinic.longitude = 19.07, 72.87
+        clinic.save()
+        ids = [c.id for c in spatial.clinics_within(19.07, 72.87, 5)]
+        self.assertEqual(ids, [clinic.id])
+        self.assertEqual(spatial.clinics_within(28.61, 77.20, 5), [])
+
+        clinic_id = clinic.id
+        clinic.delete()
+        unlocated.delete()
+        self.assertNotIn(clinic_id, self.indexed_ids())
+
+    def test_radius_query_matches_brute_force(self):
+        """Test radius search returns exactly the clinics within range"""
+        from geopy.distance import geodesic
+        origin = (28.61, 77.20)
+        clinics = [
+            self.make_clinic(f'clinic{i}', origin[0] + i * 0.1, origin[1] - i * 0.07)
+            for i in range(-6, 7)
+        ]
+        expected = sorted(
+            c.id for c in clinics
+            if geodesic(origin, (c.latitude, c.longitude)).km <= 50
+        )
+        found = spatial.clinics_within(origin[0], origin[1], 50)
+        self.assertEqual(sorted(c.id for c in found), expected)
+        distances = [c.distance for c in found]
+        self.assertEqual(distances, sorted(distances))
+
+    def test_radius_query_respects_queryset(self):
+        """Test the base queryset still filters candidates"""
+        self.make_clinic('approved', 28.61, 77.20, is_approved=True)
+        self.make_clinic('pending', 28.62, 77.21)
+        found = spatial.clinics_within(
+            28.61, 77.20, 10, queryset=ClinicProfile.objects.filter(is_approved=True)
+        )
+        self.assertEqual([c.name for c in found], ['approved clinic'])
+
+    def test_nearest_clinics_expands_radius(self):
+        """Test k-nearest search finds clinics beyond the first radius"""
+        near = self.make_clinic('near', 28.61, 77.21)
+        far = self.make_clinic('far', 29.61, 77.20)
+        self.make_clinic('farther', 31.61, 77.20)
+        found = spatial.nearest_clinics(28.61, 77.20, 2)
+        self.assertEqual([c.id for c in found], [near.id, far.id])
+
+    def test_bounding_boxes_split_at_antimeridian(self):
+        """Test circles crossing the antimeridian produce two boxes"""
+        boxes = spatial.bounding_boxes(0.0, 179.9, 50)
+        self.assertEqual(len(boxes), 2)
+        self.assertEqual(boxes[0][3], 180.0)
+        self.assertEqual(boxes[1][2], -180.0)
+
+
+class ClinicClusteringTest(SimpleTestCase):
+    def setUp(self):
+        # A dense block of 20 clinics in Delhi and one in Mumbai
+        self.lats = [28.61 + (i % 5) * 0.002 for i in range(20)] + [19.07]
+        self.lngs = [77.20 + (i // 5) * 0.002 for i in range(20)] + [72.87]
+        self.index = ClusterIndex(self.lats, self.lngs, list(range(21)))
+
+    def test_coarse_zoom_clusters_dense_area(self):
+        """Test nearby clinics merge into one cluster at country zoom"""
+        clusters, rows = self.index.query(5)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0][2], 20)
+        self.assertAlmostEqual(clusters[0][0], 28.614, places=3)
+        self.assertEqual(rows, [20])
+
+    def test_clusters_split_when_zooming_in(self):
+        """Test every clinic is shown individually at street zoom"""
+        previous = 1
+        for zoom in range(5, MAX_CLUSTER_ZOOM + 1):
+            clusters, rows = self.index.query(zoom)
+            self.assertEqual(sum(c[2] for c in clusters) + len(rows), 21)
+            markers = len(clusters) + len(rows)
+            self.assertGreaterEqual(markers, previous)
+            previous = markers
+        self.assertEqual(self.index.query(MAX_CLUSTER_ZOOM), ([], list(range(21))))
+
+    def test_bbox_limits_markers(self):
+        """Test only markers inside the viewport are returned"""
+        clusters, rows = self.index.query(5, bbox=(18, 72, 20, 73))
+        self.assertEqual((clusters, rows), ([], [20]))
+
+    def test_empty_index(self):
+        """Test an empty candidate set"""
+        index = ClusterIndex([], [], [])
+        self.assertEqual(index.query(3), ([], []))
+        self.assertIsNone(index.bounds)
+
+
+class ClinicDiseaseMaskTest(TestCase):
+    def setUp(self):
+        self.hiv = Disease.objects.create(name='HIV')
+        self.tb = Disease.objects.create(name='Tuberculosis')
+        self.malaria = Disease.objects.create(name='Malaria')
+        user = User.objects.create_user(username='maskclinic', password='TestPass123!')
+        self.clinic = ClinicProfile.objects.create(
+            user=user,
+            name='Mask Clinic',
+            address='Test Street',
+            phone_number='+1234567890',
+            location='Test City',
+        )
+
+    def stored_mask(self):
+        return disease_mask.from_bytes(ClinicProfile.objects.get(pk=self.clinic.pk).disease_mask)
+
+    def test_mask_follows_diseases_treated(self):
+        """Test the mask tracks add, remove and clear on the clinic side"""
+        self.clinic.diseases_treated.add(self.hiv, self.tb)
+        self.assertEqual(self.stored_mask(), disease_mask.mask_for([self.hiv.id, self.tb.id]))
+        self.assertEqual(disease_mask.from_bytes(self.clinic.disease_mask), self.stored_mask())
+
+        self.clinic.diseases_treated.remove(self.hiv)
+        self.assertEqual(self.stored_mask(), 1 << self.tb.id)
+
+        self.clinic.diseases_treated.clear()
+        self.assertEqual(self.stored_mask(), 0)
+
+    def test_mask_follows_reverse_side_and_disease_delete(self):
+        """Test changes made from the disease side update the clinic mask"""
+        self.malaria.clinicprofile_set.add(self.clinic)
+        self.assertEqual(self.stored_mask(), 1 << self.malaria.id)
+
+        self.malaria.clinicprofile_set.clear()
+        self.assertEqual(self.stored_mask(), 0)
+
+        self.clinic.diseases_treated.set([self.hiv, self.tb])
+        self.tb.delete()
+        self.assertEqual(self.stored_mask(), 1 << self.hiv.id)
+
+    def test_relevance_uses_mask(self):
+        """Test relevance matching needs no per-clinic queries"""
+        self.clinic.diseases_treated.add(self.tb)
+        clinics = list(ClinicProfile.objects.all())
+        mask = disease_mask.patient_mask({'tuberculosis'})
+        with self.assertNumQueries(0):
+            self.assertTrue(disease_mask.is_relevant(clinics[0], mask))
+            self.assertFalse(disease_mask.is_relevant(clinics[0], 1 << self.hiv.id))
+            self.assertFalse(disease_mask.is_relevant(clinics[0], 0))
+
+        self.clinic.diseases_treated.clear()
+        self.assertTrue(disease_mask.is_relevant(ClinicProfile.objects.get(), 1 << self.hiv.id))
+
+
+class AddTreatmentRecordTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='clinic', password='TestPass123!')
+        user.groups.add(Group.objects.create(name='Clinic'))
+        self.clinic = ClinicProfile.objects.create(user=user, name='Clinic', address='Test Street',
+                                                   phone_number='+1234567890', location='Delhi')
+        patient_user = User.objects.create_user(username='patient', password='TestPass123!')
+        self.patient = PatientProfile.objects.create(
+            user=patient_user, date_of_birth='1990-01-01', phone_number='+1234567890',
+            address='Test Street', current_location='Delhi', current_clinic=self.clinic
+        )
+        self.client.force_login(user)
+
+    def post(self, **rows):
+        data = {'patient': self.patient.id, 'disease': 'Flu', 'details': 'Fever', 'diagnosis': 'Influenza',
+                'start_date': str(timezone.localdate())}
+        data.update(rows)
+        return self.client.post(reverse('clinic:add_treatment_record'), data)
+
+    def test_each_medication_keeps_its_own_times(self):
+        """Test every row of the medication table gets its own frequency and intake times"""
+        response = self.post(**{
+            'medications[]': ['Paracetamol', 'Ibuprofen'],
+            'dosages[]': ['500 mg', '200 mg'],
+            'frequencies[]': ['twice daily', 'once daily'],
+            'intake_times[]': ['08:00, 20:00', '13:00'],
+        })
+        self.assertRedirects(response, reverse('clinic:clinic_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(Prescription.objects.get().diagnosis, 'Influenza')
+        self.assertEqual(
+            dict(MedicationReminder.objects.values_list('medication_name', 'dose_times')),
+            {'Paracetamol': ['08:00', '20:00'], 'Ibuprofen': ['13:00']},
+        )
+        today = MedicationIntake.objects.filter(intake_date=timezone.localdate())
+        self.assertEqual(today.filter(reminder__medication_name='Ibuprofen').count(), 1)
+        self.assertEqual(today.filter(reminder__medication_name='Paracetamol').count(), 2)
+
+    def test_invalid_medication_writes_nothing(self):
+        """Test an invalid row rejects the whole form before anything is written"""
+        response = self.post(**{
+            'medications[]': ['Paracetamol', 'Ibuprofen'],
+            'dosages[]': ['500 mg', '200 mg'],
+            'frequencies[]': ['twice daily', 'whenever'],
+            'intake_times[]': ['08:00, 20:00', ''],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Medication 2: unrecognized frequency',
+                      ' '.join(str(message) for message in response.context['messages']))
+        self.assertFalse(TreatmentRecord.objects.exists())
+        self.assertFalse(Prescription.objects.exists())
+        self.assertFalse(MedicationReminder.objects.exists())
+
+        # The form comes back with what was entered
+        self.assertContains(response, 'value="whenever"')
+        self.assertContains(response, 'value="08:00, 20:00"')
+        self.assertContains(response, 'Influenza</textarea>')
+        self.assertContains(response, f'<option value="{self.patient.id}" selected>')
+        self.assertEqual(len(response.context['medication_rows']), 2)
@@ -30,4 +30,6 @@ urlpatterns = [
     path('update_prescription/<int:prescription_id>/', views.update_prescription, name='update_prescription'),
     path('telemedicine/', views.telemedicine_management, name='telemedicine_management'),
     path('update_telemedicine/<int:session_id>/', views.update_telemedicine_session, name='update_telemedicine_session'),
+    path('patients/<int:patient_id>/metric_summaries/', views.patient_metric_summaries,
+         name='patient_metric_summaries'),
 ]
@@ -1,4 +1,5 @@
-from datetime import datetime
+from itertools import zip_longest
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -7,11 +8,13 @@ from django.contrib.auth.models import User, Group
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.db import IntegrityError, transaction
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from .models import ClinicProfile
 from .forms import ClinicRegistrationForm, AppointmentForm, TreatmentRecordForm, CounsellingSessionForm
-from patient.models import MedicationIntake, PatientProfile, TransferRequest, TreatmentRecord, Appointment, CounsellingSession, ExternalConsultation, MedicalDataRequest, Prescription, MedicationReminder, TelemedicineSession, HealthMetric
-from geopy.geocoders import Nominatim
+from patient.models import PatientProfile, TransferRequest, TreatmentRecord, Appointment, CounsellingSession, ExternalConsultation, MedicalDataRequest, Prescription, TelemedicineSession, HealthMetric
+from core import dashboard_cache, geocode_queue
+from emergency.models import EmergencyAccess
+from patient import metric_summaries, prescriptions
 from safar_saathi.utils import is_clinic_staff
 import logging
 
@@ -50,35 +53,8 @@ def clinic_register(request):
                     user.groups.add(clinic_group)
                     logger.info(f"Added user to Clinic group")
 
-                    # Geocode the address with improved error handling
-                    lat, lng = None, None
-                    try:
-                        from geopy.geocoders import Nominatim
-                        from geopy.exc import GeocoderTimedOut, GeocoderServiceError
-                        geolocator = Nominatim(user_agent="safar_saathi_clinic_registration", timeout=15)
-                        full_address = f"{form.cleaned_data['address']}, {form.cleaned_data['location']}"
-                        
-                        # Try geocoding with the full address
-                        location_obj = geolocator.geocode(full_address)
-                        
-                        # If full address fails, try just the location
-                        if not location_obj and form.cleaned_data['location']:
-                            location_obj = geolocator.geocode(form.cleaned_data['location'])
-                        
-                        if location_obj:
-                            lat, lng = location_obj.latitude, location_obj.longitude
-                            logger.info(f"Successfully geocoded address for clinic: {full_address} -> ({lat}, {lng})")
-                        else:
-                            logger.warning(f"Could not geocode address: {full_address}")
-                            messages.warning(request, 'Could not geocode your address. You can update it later in your profile.')
-                    except (GeocoderTimedOut, GeocoderServiceError) as e:
-                        logger.warning(f"Geocoding service error for address: {full_address} - {str(e)}")
-                        messages.warning(request, 'Geocoding service is temporarily unavailable. You can update your location later.')
-                    except Exception as e:
-                        logger.warning(f"Unexpected geocoding error for address: {full_address} - {str(e)}")
-                        messages.warning(request, 'Could not geocode your address. You can update it later in your profile.')
-
-                    # Create clinic profile (without many-to-many field)
+                    # Create clinic profile (without many-to-many field); the
+                    # address is geocoded in the background by geocode_pending
                     logger.info("Creating clinic profile...")
                     clinic = ClinicProfile.objects.create(
                         user=user,
@@ -86,8 +62,7 @@ def clinic_register(request):
                         address=form.cleaned_data['address'],
                         phone_number=form.cleaned_data['phone_number'],
                         location=form.cleaned_data['location'],
-                        latitude=lat,
-                        longitude=lng
+                        geocode_status='pending'
                     )
                     logger.info(f"Clinic profile created: {clinic.id}")
 
@@ -132,9 +107,10 @@ def clinic_dashboard(request):
         messages.error(request, 'Clinic profile not found.')
         return redirect('home')
 
-    transfer_requests = TransferRequest.objects.filter(to_clinic=clinic)
-    treatment_records = TreatmentRecord.objects.filter(
-        clinic=clinic).order_by('-record_date')[:5]
+    transfer_requests = dashboard_cache.get_block('clinic.transfer_requests', clinic.id, lambda: list(
+        TransferRequest.objects.filter(to_clinic=clinic).select_related('patient__user', 'from_clinic')))
+    treatment_records = dashboard_cache.get_block('clinic.treatment_records', clinic.id, lambda: list(
+        TreatmentRecord.objects.filter(clinic=clinic).select_related('patient__user').order_by('-record_date')[:5]))
 
     context = {
         'clinic': clinic,
@@ -154,15 +130,30 @@ def clinic_profile(request):
         return redirect('home')
 
     if request.method == 'POST':
+        response_radius = request.POST.get('response_radius_km', '').strip()
+        if response_radius:
+            try:
+                radius_km = int(response_radius)
+                if not 1 <= radius_km <= 500:
+                    raise ValueError(radius_km)
+            except ValueError:
+                messages.error(request, 'Response radius must be a whole number of kilometres between 1 and 500.')
+                return redirect('clinic:profile')
+            clinic.response_radius_km = radius_km
+
         # Update user fields
         request.user.email = request.POST.get('email', '').strip()
         request.user.save()
 
         # Update clinic profile fields
         clinic.name = request.POST.get('name', '').strip()
-        clinic.address = request.POST.get('address', '').strip()
+        address = request.POST.get('address', '').strip()
         clinic.phone_number = request.POST.get('phone_number', '').strip()
-        clinic.location = request.POST.get('location', '').strip()
+        location = request.POST.get('location', '').strip()
+        if clinic.address != address or location != clinic.location:
+            geocode_queue.mark_pending(clinic)
+        clinic.address = address
+        clinic.location = location
         
         # Handle diseases - this would need to be updated based on the multi-select
         # For now, we'll keep it simple
@@ -232,7 +223,7 @@ def approve_transfer(request, request_id):
         transfer.status = 'approved'
         transfer.save()
         transfer.patient.current_clinic = transfer.to_clinic
-        transfer.patient.save()
+        transfer.patient.save(update_fields=['current_clinic'])
         messages.success(request, 'Transfer approved!')
     return redirect('clinic:clinic_dashboard')
 
@@ -289,99 +280,60 @@ def reject_transfer(request, request_id):
 #     }
 #     return render(request, 'clinic/create_prescription.html', context)
 
+def medication_rows(data):
+    """The medication table of a submitted treatment form, to show it again; one empty row for a new form"""
+    columns = [data.getlist(name) for name in ('medications[]', 'dosages[]', 'frequencies[]', 'intake_times[]')]
+    rows = [dict(zip(('name', 'dosage', 'frequency', 'intake_times'), row))
+            for row in zip_longest(*columns, fillvalue='')]
+    return rows or [{}]
+
+
 @login_required
 @user_passes_test(is_clinic)
 def add_treatment_record(request):
     clinic = request.user.clinicprofile
 
     if request.method == 'POST':
-        patient_id = request.POST.get('patient')
-        disease = request.POST.get('disease')
-        details = request.POST.get('details')
-
-        # Prescription fields (optional)
-        diagnosis = request.POST.get('diagnosis', '').strip()
-        medications = request.POST.getlist('medications[]')
-        dosages = request.POST.getlist('dosages[]')
+        patient = get_object_or_404(PatientProfile, id=request.POST.get('patient'))
         instructions = request.POST.get('instructions', '').strip()
         follow_up_date = request.POST.get('follow_up_date')
-        frequency = request.POST.get('frequency', 'once daily')
-        intake_times = request.POST.getlist('intake_times[]')
-        start_date = request.POST.get('start_date')
-        end_date = request.POST.get('end_date')
-
-        patient = get_object_or_404(PatientProfile, id=patient_id)
 
-        with transaction.atomic():
-            # -------------------------------
-            # 1. Create Treatment Record
-            # -------------------------------
-            TreatmentRecord.objects.create(
-                patient=patient,
-                clinic=clinic,
-                disease=disease,
-                details=details
+        # Validate the whole medication table before writing anything
+        try:
+            plan = prescriptions.parse(
+                request.POST.get('diagnosis', '').strip(),
+                request.POST.getlist('medications[]'),
+                request.POST.getlist('dosages[]'),
+                request.POST.getlist('frequencies[]'),
+                request.POST.getlist('intake_times[]'),
+                request.POST.get('start_date', ''),
+                request.POST.get('end_date', ''),
             )
-
-            # -------------------------------
-            # 2. Build medications JSON
-            # -------------------------------
-            meds_list = []
-            for i in range(len(medications)):
-                med_name = medications[i].strip()
-                dosage = dosages[i].strip() if i < len(dosages) else ''
-                frequency = frequency if i < len(frequency) else 'once daily'
-                intake_time = intake_times[i].strip() if i < len(intake_times) else '09:00'
-                start_date_val = start_date if i < len(start_date) else timezone.now().date()
-                end_date_val = end_date if i < len(end_date) else None
-                
-
-                if med_name:  # ignore empty rows
-                    meds_list.append({
-                        'name': med_name,
-                        'dosage': dosage
-                    })
-
-            # -------------------------------
-            # 3. Create Prescription ONLY if valid
-            # -------------------------------
-            if diagnosis and meds_list:
-                prescription = Prescription.objects.create(
+        except prescriptions.PrescriptionError as e:
+            for error in e.errors:
+                messages.error(request, error)
+        else:
+            with transaction.atomic():
+                TreatmentRecord.objects.create(
                     patient=patient,
                     clinic=clinic,
-                    doctor=request.user,
-                    diagnosis=diagnosis,
-                    medications=meds_list,
-                    instructions=instructions,
-                    follow_up_date=follow_up_date or None
+                    disease=request.POST.get('disease'),
+                    details=request.POST.get('details')
                 )
+                # The prescription is optional
+                if plan.diagnosis and plan.medications:
+                    prescriptions.create(patient, clinic, request.user, plan, instructions, follow_up_date)
 
-                # -------------------------------
-                # 4. (Optional but Recommended)
-                # Auto-create Medication Reminders
-                # -------------------------------
-                for med in meds_list:
-                    medicationR = MedicationReminder.objects.create(
-                        prescription=prescription,
-                        medication_name=med['name'],
-                        dosage=med['dosage'],
-                        frequency=frequency,  # can be extended later
-                        
-                        start_date=start_date_val,
-                        end_date=end_date_val
-                    )
-                    times = intake_times[i].split(',')
-                    for time in times:
-                        MedicationIntake.objects.create(
-                            reminder=medicationR,
-                            intake_time=datetime.strptime(time.strip(), '%H:%M').time()
-                        )
-
-        messages.success(request, 'Treatment record added successfully.')
-        return redirect('clinic:clinic_dashboard')
+            messages.success(request, 'Treatment record added successfully.')
+            return redirect('clinic:clinic_dashboard')
 
     patients = PatientProfile.objects.filter(current_clinic=clinic)
-    return render(request, 'clinic/add_treatment.html', {'patients': patients})
+    # A rejected form is shown again with what was entered
+    return render(request, 'clinic/add_treatment.html', {
+        'patients': patients,
+        'form': request.POST,
+        'medication_rows': medication_rows(request.POST),
+    })
 
 
 @login_required
@@ -642,3 +594,25 @@ def update_telemedicine_session(request, session_id):
 
         messages.success(request, f'Telemedicine session updated.')
     return redirect('clinic:telemedicine_management')
+
+
+@login_required
+@user_passes_test(is_clinic)
+def patient_metric_summaries(request, patient_id):
+    """
+    JSON summaries of a patient's health metrics (latest value, 7/30/90-day
+    figures, trend), for the patient's own clinic and clinics holding an
+    active emergency access grant
+    """
+    clinic = request.user.clinicprofile
+    patient = get_object_or_404(PatientProfile, id=patient_id)
+    has_access = patient.current_clinic_id == clinic.id or EmergencyAccess.objects.filter(
+        patient=patient, clinic=clinic, is_active=True, expiry_time__gt=timezone.now()).exists()
+    if not has_access:
+        return JsonResponse({'error': 'You do not have access to this patient.'}, status=403)
+
+    try:
+        return JsonResponse({'patient': patient.id, 'summaries': metric_summaries.for_patient(patient)})
+    except Exception as e:
+        logger.error(f"Error loading metric summaries for patient {patient_id}: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'Could not load health metrics.'}, status=500)
@@ -0,0 +1,44 @@
+"""
+Fixtures shared by the benchmark_* management commands.
+
+Benchmarks run against the configured database, in a transaction they roll
+back, so the users, clinics and patients made here are never kept. Their
+usernames start with '<prefix>-bench-', the prefix naming the benchmark.
+"""
+import time
+
+from django.contrib.auth.models import User
+
+from clinic.models import ClinicProfile
+from patient.models import PatientProfile
+
+ROLLED_BACK = 'Runs in a transaction that is rolled back, so no data is kept.'
+
+
+def make_users(prefix, count):
+    return User.objects.bulk_create([User(username=f'{prefix}-bench-{i}') for i in range(count)])
+
+
+def _profile(user):
+    return PatientProfile(user=user, date_of_birth='1990-01-01', phone_number='0',
+                          address='Benchmark', current_location='Delhi')
+
+
+def make_patients(prefix, count):
+    """count patient profiles, inserted with bulk_create (no signals)"""
+    return PatientProfile.objects.bulk_create([_profile(user) for user in make_users(prefix, count)])
+
+
+def make_patient(prefix):
+    """One patient profile, saved so that its signals run"""
+    profile = _profile(User.objects.create(username=f'{prefix}-bench-{time.monotonic_ns()}'))
+    profile.save()
+    return profile
+
+
+def make_clinic(prefix):
+    """A throwaway clinic and its user, who can act as the doctor: (user, clinic)"""
+    user = User.objects.create(username=f'{prefix}-bench-{time.monotonic_ns()}')
+    clinic = ClinicProfile.objects.create(user=user, name='Benchmark clinic', address='Benchmark',
+                                          phone_number='0', location='Delhi')
+    return user, clinic
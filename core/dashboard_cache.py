@@ -0,0 +1,205 @@
+"""
+Cached dashboard context blocks.
+
+The admin, clinic and patient dashboards are built from blocks: the
+platform statistics, a clinic's transfer requests, a patient's adherence
+figure and so on. Each block is cached per scope (a clinic or patient id,
+or 0 for platform-wide blocks) for its TTL, and dropped as soon as one of
+the models it is built from changes for that scope.
+
+Invalidation bumps a version number instead of deleting entries: a view
+that computed a block from data read before the change stores it under the
+old version, where it is never read again. The version is bumped once the
+change is committed.
+
+Versions, blocks and counters all live in the default cache, so
+invalidation only reaches the processes that share it: production needs a
+shared backend (CACHE_REDIS_URL in settings). With the per-process
+local-memory cache, another process keeps serving a changed block until its
+TTL runs out.
+
+Hits and misses are counted per block in the cache; see the
+dashboard_cache_stats command. TTLs can be tuned per block with the
+DASHBOARD_CACHE_TTLS setting.
+"""
+import time
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+GLOBAL = 0
+
+# sources: (model label, scope(instance) -> id) pairs; a change to a row
+# of the model invalidates the block for that scope
+Block = namedtuple('Block', ['name', 'ttl', 'sources'])
+
+
+def _global(instance):
+    return GLOBAL
+
+
+def _reminder_patient(reminder):
+    Prescription = apps.get_model('patient', 'Prescription')
+    return Prescription.objects.filter(pk=reminder.prescription_id).values_list('patient_id', flat=True).first()
+
+
+def _intake_patient(intake):
+    MedicationReminder = apps.get_model('patient', 'MedicationReminder')
+    return (MedicationReminder.objects.filter(pk=intake.reminder_id)
+            .values_list('prescription__patient_id', flat=True).first())
+
+
+BLOCKS = {block.name: block for block in [
+    # Clinic approvals and registrations show up at once; the high-volume
+    # tables (intakes, metrics, notifications) only refresh with the TTL
+    Block('admin.stats', 60, [
+        ('clinic.ClinicProfile', _global),
+        ('patient.PatientProfile', _global),
+        ('patient.Appointment', _global),
+        ('patient.Prescription', _global),
+        ('emergency.EmergencyAccess', _global),
+        ('clinic.Disease', _global),
+    ]),
+    Block('admin.recent_clinics', 300, [
+        ('clinic.ClinicProfile', _global),
+    ]),
+    Block('admin.audit_logs', 60, [
+        ('admin_app.AuditLog', _global),
+    ]),
+    Block('clinic.transfer_requests', 300, [
+        ('patient.TransferRequest', lambda o: o.to_clinic_id),
+    ]),
+    Block('clinic.treatment_records', 300, [
+        ('patient.TreatmentRecord', lambda o: o.clinic_id),
+    ]),
+    Block('patient.treatment_records', 300, [
+        ('patient.TreatmentRecord', lambda o: o.patient_id),
+    ]),
+    Block('patient.upcoming_appointments', 300, [
+        ('patient.Appointment', lambda o: o.patient_id),
+    ]),
+    Block('patient.adherence', 900, [
+        ('patient.MedicationIntake', _intake_patient),
+        ('patient.MedicationReminder', _reminder_patient),
+    ]),
+    Block('patient.medications', 900, [
+        ('patient.MedicationIntake', _intake_patient),
+        ('patient.MedicationReminder', _reminder_patient),
+    ]),
+]}
+
+
+def ttl(name):
+    return getattr(settings, 'DASHBOARD_CACHE_TTLS', {}).get(name, BLOCKS[name].ttl)
+
+
+def _version_key(name, scope):
+    return f"dashboard:{name}:{scope}:version"
+
+
+def _counter_key(name, outcome):
+    return f"dashboard-stats:{name}:{outcome}"
+
+
+def _incr(key, initial):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing or evicted: add() loses to a concurrent writer, who
+        # already moved the value on
+        if not cache.add(key, initial, None):
+            return cache.incr(key)
+        return initial
+
+
+def _version(name, scope):
+    version = cache.get(_version_key(name, scope))
+    if version is None:
+        # Start from the clock so an evicted version never comes back to a
+        # number that still has stale entries behind it
+        version = time.time_ns()
+        if not cache.add(_version_key(name, scope), version, None):
+            version = cache.get(_version_key(name, scope), version)
+    return version
+
+
+def get_block(name, scope, compute, vary=''):
+    """
+    Return the cached value of a dashboard block, computing and storing it
+    with compute() on a miss. vary is added to the key for blocks that also
+    depend on something other than their sources, e.g. today's date.
+    compute() must return something picklable: evaluate querysets with list().
+    """
+    key = f"dashboard:{name}:{scope}:{_version(name, scope)}:{vary}"
+    value = cache.get(key)
+    if value is not None:
+        _incr(_counter_key(name, 'hits'), 1)
+        return value
+
+    _incr(_counter_key(name, 'misses'), 1)
+    value = compute()
+    cache.set(key, value, ttl(name))
+    return value
+
+
+def invalidate(name, scope):
+    """Drop every cached value of a block for one scope"""
+    _incr(_version_key(name, scope), time.time_ns())
+
+
+def block_scopes(instance):
+    """(block, scope) for every cached block built from a model instance"""
+    label = instance._meta.label
+    scopes = {}  # Blocks sharing a scope lookup run it once
+    scoped = []
+    for block in BLOCKS.values():
+        for source, scope in block.sources:
+            if source != label:
+                continue
+            if scope not in scopes:
+                scopes[scope] = scope(instance)
+            if scopes[scope] is not None:
+                scoped.append((block.name, scopes[scope]))
+    return scoped
+
+
+def invalidate_instance(instance):
+    """Drop the blocks built from a model instance, e.g. after QuerySet.update()"""
+    for name, scope in block_scopes(instance):
+        invalidate(name, scope)
+
+
+def invalidate_model(label, scopes):
+    """Drop the blocks built from a model for the given scopes, e.g. after bulk_create()"""
+    names = {block.name for block in BLOCKS.values() for source, _ in block.sources if source == label}
+    for name in names:
+        for scope in scopes:
+            invalidate(name, scope)
+
+
+def source_models():
+    """Every model that invalidates a block"""
+    labels = {source for block in BLOCKS.values() for source, _ in block.sources}
+    return [apps.get_model(label) for label in sorted(labels)]
+
+
+def stats():
+    """{block: {'hits', 'misses', 'hit_rate'}} since the counters were last reset"""
+    keys = [_counter_key(name, outcome) for name in BLOCKS for outcome in ('hits', 'misses')]
+    counts = cache.get_many(keys)
+    result = {}
+    for name in BLOCKS:
+        hits = counts.get(_counter_key(name, 'hits'), 0)
+        misses = counts.get(_counter_key(name, 'misses'), 0)
+        result[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses) * 100, 1) if hits + misses else None,
+        }
+    return result
+
+
+def reset_stats():
+    cache.delete_many([_counter_key(name, outcome) for name in BLOCKS for outcome in ('hits', 'misses')])
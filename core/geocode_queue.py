@@ -0,0 +1,162 @@
+"""
+Background geocoding for clinic and patient profiles.
+
+Registration saves profiles with geocode_status='pending' and returns
+immediately. The geocode_pending command drains the queue in batches. Each
+due profile of a batch is claimed with a conditional UPDATE that pushes its
+geocode_retry_at GEOCODE_CLAIM_LEASE_SECONDS ahead, so it is no longer due
+for other workers; a profile another worker claimed first no longer
+matches and is skipped. Claimed profiles are geocoded outside any
+transaction and written back with a conditional UPDATE, which also ends the
+lease. It only matches while the claim holds and the address is the one
+that was geocoded, so a profile re-queued meanwhile (mark_pending() after
+an address change) is not marked geocoded with stale coordinates; such a
+profile is left due again instead. post_save is sent for the written rows,
+so the clinic spatial index follows along. Profiles of a worker that died
+are due again once the lease runs out.
+
+A profile that only resolved against the offline gazetteer (because
+Nominatim was down) gets the centroid right away but stays pending, so a
+later pass replaces it with the precise location. Lookups that cannot be
+answered are retried with exponential back-off, up to GEOCODE_MAX_ATTEMPTS.
+"""
+import logging
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from . import geocoding
+
+logger = logging.getLogger(__name__)
+
+# (model label, address field, locality field) for every geocoded profile
+GEOCODE_TARGETS = [
+    ('clinic.ClinicProfile', 'address', 'location'),
+    ('patient.PatientProfile', 'address', 'current_location'),
+]
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'GEOCODE_RETRY_BASE_SECONDS', 60)
+    cap = getattr(settings, 'GEOCODE_RETRY_MAX_SECONDS', 24 * 3600)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), cap))
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, 'GEOCODE_CLAIM_LEASE_SECONDS', 600))
+
+
+def _due(model, now):
+    return model.objects.filter(geocode_status='pending').filter(
+        Q(geocode_retry_at__isnull=True) | Q(geocode_retry_at__lte=now))
+
+
+def claim(model, batch_size, now):
+    """
+    Claim up to batch_size due profiles of a model; returns the ones this
+    worker won, their geocode_retry_at set to the end of the lease
+    """
+    candidates = list(_due(model, now).order_by('geocode_retry_at', 'id')[:batch_size])
+    claimed_until = now + lease()
+    claimed = []
+    for profile in candidates:
+        # One UPDATE per profile: its row count says whether this worker won it
+        if _due(model, now).filter(pk=profile.pk).update(geocode_retry_at=claimed_until):
+            profile.geocode_retry_at = claimed_until
+            claimed.append(profile)
+    return claimed
+
+
+# The fields mark_pending() and the worker write
+GEOCODE_FIELDS = ['latitude', 'longitude', 'geocode_status', 'geocode_attempts', 'geocode_retry_at']
+
+
+def mark_pending(profile):
+    """Queue a profile for geocoding again, e.g. after its address changed; save GEOCODE_FIELDS afterwards"""
+    profile.latitude = None
+    profile.longitude = None
+    profile.geocode_status = 'pending'
+    profile.geocode_attempts = 0
+    profile.geocode_retry_at = None
+
+
+def _geocode_profile(profile, address_field, locality_field, now):
+    """Update a profile's location fields in place from one geocode attempt"""
+    if profile.geocode_attempts == 0 and profile.latitude is not None and profile.longitude is not None:
+        # Coordinates were supplied when the profile was created
+        profile.geocode_status = 'geocoded'
+        return
+
+    address = getattr(profile, address_field)
+    locality = getattr(profile, locality_field)
+    result = geocoding.geocode(f"{address}, {locality}", locality)
+    remote_down = not geocoding.remote_available()
+    profile.geocode_attempts += 1
+
+    if result is not None:
+        profile.latitude, profile.longitude = result.latitude, result.longitude
+    if result is not None and not (result.source == 'gazetteer' and remote_down):
+        profile.geocode_status = 'geocoded'
+        profile.geocode_retry_at = None
+    elif remote_down and profile.geocode_attempts < getattr(settings, 'GEOCODE_MAX_ATTEMPTS', 6):
+        profile.geocode_retry_at = now + retry_delay(profile.geocode_attempts)
+    elif result is None:
+        profile.geocode_status = 'failed'
+        profile.geocode_retry_at = None
+    else:
+        # Out of retries: keep the gazetteer centroid
+        profile.geocode_status = 'geocoded'
+        profile.geocode_retry_at = None
+
+
+def complete(profile, address_field, locality_field, claimed_until):
+    """
+    Write back a geocoded profile if it is still claimed and its address
+    unchanged; otherwise leave it due again. Returns whether it was written.
+    """
+    model = type(profile)
+    stored = model.objects.filter(pk=profile.pk)
+    written = stored.filter(
+        geocode_retry_at=claimed_until,
+        **{address_field: getattr(profile, address_field), locality_field: getattr(profile, locality_field)},
+    ).update(**{field: getattr(profile, field) for field in GEOCODE_FIELDS})
+    if not written:
+        # Changed while it was geocoded. mark_pending() has queued it again
+        # already; an address edited without it is queued here. A profile
+        # claimed again after the lease belongs to the other worker now.
+        stored.filter(geocode_retry_at=claimed_until).update(
+            geocode_status='pending', geocode_attempts=0, geocode_retry_at=None)
+        return False
+    post_save.send(sender=model, instance=profile, created=False, update_fields=frozenset(GEOCODE_FIELDS),
+                   raw=False, using=stored.db)
+    return True
+
+
+def process_batch(model_label, address_field, locality_field, batch_size=50):
+    """Geocode one batch of due profiles of a model. Returns how many were processed."""
+    model = apps.get_model(model_label)
+    now = timezone.now()
+    batch = claim(model, batch_size, now)
+
+    for profile in batch:
+        claimed_until = profile.geocode_retry_at
+        try:
+            _geocode_profile(profile, address_field, locality_field, now)
+        except Exception as e:
+            logger.error(f"Geocoding {model_label} {profile.pk} failed: {str(e)}", exc_info=True)
+            profile.geocode_attempts += 1
+            profile.geocode_retry_at = now + retry_delay(profile.geocode_attempts)
+        complete(profile, address_field, locality_field, claimed_until)
+    return len(batch)
+
+
+def process_pending(batch_size=50):
+    """Run one batch for every geocoded model. Returns the total processed."""
+    return sum(
+        process_batch(label, address_field, locality_field, batch_size)
+        for label, address_field, locality_field in GEOCODE_TARGETS
+    )
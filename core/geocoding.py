@@ -0,0 +1,230 @@
+"""
+Geocoding service shared by registration and consultation booking.
+
+Lookups go through three layers, cheapest first:
+
+1. the process cache (Django's cache framework), keyed by a hash of the
+   normalized address so keys stay short and free of spaces,
+2. the GeocodeCache table, which survives restarts and is pruned by TTL and
+   least-recent use (see the prune_geocode_cache command),
+3. the remote Nominatim geocoder, called with a short timeout.
+
+When Nominatim is slow or unreachable it is skipped for a back-off period and
+addresses are resolved against the bundled offline gazetteer of city and
+state centroids instead. Gazetteer fallbacks are not written to the
+persistent cache, so the address is geocoded properly once Nominatim is back.
+"""
+import hashlib
+import json
+import logging
+import re
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.utils import timezone
+from geopy.exc import GeocoderServiceError
+from geopy.geocoders import Nominatim
+
+from .models import GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+GeocodeResult = namedtuple('GeocodeResult', ['latitude', 'longitude', 'source'])
+
+GAZETTEER_PATH = Path(__file__).resolve().parent / 'data' / 'gazetteer.json'
+
+CACHE_KEY_PREFIX = 'geocode:'
+REMOTE_DOWN_KEY = 'geocode:remote_down'
+
+# Marker stored in the process cache for addresses known not to resolve
+_MISS = 'miss'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def normalize_address(address):
+    """Lowercase, drop punctuation noise and collapse whitespace"""
+    address = (address or '').lower()
+    address = re.sub(r'[^\w\s,-]', ' ', address)
+    parts = [' '.join(part.split()) for part in address.split(',')]
+    return ', '.join(part for part in parts if part)[:255]
+
+
+def cache_key(query):
+    """Cache key of a normalized query; the readable text is only kept in GeocodeCache"""
+    return CACHE_KEY_PREFIX + hashlib.sha1(query.encode()).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _gazetteer():
+    with open(GAZETTEER_PATH, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def gazetteer_lookup(address):
+    """
+    Resolve an address to a city centroid, or a state centroid when no city
+    is recognised. Returns None if neither appears in the address.
+    """
+    normalized = normalize_address(address)
+    if not normalized:
+        return None
+    gazetteer = _gazetteer()
+    parts = [part.strip() for part in normalized.split(',')]
+    # Addresses usually end with the locality, so search from the end
+    for table in ('cities', 'states'):
+        for part in reversed(parts):
+            if part in gazetteer[table]:
+                lat, lng = gazetteer[table][part]
+                return GeocodeResult(lat, lng, 'gazetteer')
+        for part in reversed(parts):
+            for word in reversed(part.split()):
+                if word in gazetteer[table]:
+                    lat, lng = gazetteer[table][word]
+                    return GeocodeResult(lat, lng, 'gazetteer')
+    return None
+
+
+@lru_cache(maxsize=1)
+def _geolocator():
+    return Nominatim(user_agent="safar_saathi", timeout=_setting('GEOCODE_TIMEOUT', 5))
+
+
+def _cached(query):
+    """Look a normalized query up in the process cache, then the database"""
+    value = cache.get(cache_key(query))
+    if value is not None:
+        return value
+
+    now = timezone.now()
+    entry = GeocodeCache.objects.filter(query=query, expires_at__gt=now).first()
+    if entry is None:
+        return None
+
+    # Touching last_used_at on every hit would turn reads into writes; once
+    # an hour is enough for least-recently-used eviction.
+    if now - entry.last_used_at > timedelta(hours=1):
+        GeocodeCache.objects.filter(pk=entry.pk).update(last_used_at=now)
+
+    if entry.latitude is None:
+        value = _MISS
+    else:
+        value = GeocodeResult(entry.latitude, entry.longitude, entry.source)
+    timeout = min((entry.expires_at - now).total_seconds(), _setting('GEOCODE_MEMORY_TTL', 3600))
+    cache.set(cache_key(query), value, timeout)
+    return value
+
+
+def _store(query, result):
+    if result is None:
+        ttl = _setting('GEOCODE_NEGATIVE_TTL', timedelta(days=1))
+        lat = lng = None
+        source = 'nominatim'
+    else:
+        ttl = _setting('GEOCODE_CACHE_TTL', timedelta(days=30))
+        lat, lng, source = result
+
+    now = timezone.now()
+    try:
+        GeocodeCache.objects.update_or_create(
+            query=query,
+            defaults={
+                'latitude': lat,
+                'longitude': lng,
+                'source': source,
+                'created_at': now,
+                'expires_at': now + ttl,
+                'last_used_at': now,
+            }
+        )
+    except IntegrityError:
+        # Another request cached the same address concurrently
+        pass
+    cache.set(cache_key(query), result or _MISS,
+              min(ttl.total_seconds(), _setting('GEOCODE_MEMORY_TTL', 3600)))
+
+
+def remote_available():
+    return not cache.get(REMOTE_DOWN_KEY)
+
+
+def _remote_geocode(address):
+    """
+    Ask Nominatim for an address. Returns a GeocodeResult, None when the
+    address does not resolve, or raises GeocoderServiceError (timeouts and
+    connection failures are subclasses) when the service is unusable.
+    """
+    location = _geolocator().geocode(address)
+    if location is None:
+        return None
+    return GeocodeResult(location.latitude, location.longitude, 'nominatim')
+
+
+def geocode(*addresses, allow_remote=True):
+    """
+    Geocode the first of ``addresses`` that resolves, e.g.
+    ``geocode(f"{address}, {city}", city)``.
+
+    Returns a GeocodeResult or None. Never raises for network problems: when
+    the remote geocoder fails, the offline gazetteer answers instead.
+    """
+    queries = []
+    for address in addresses:
+        query = normalize_address(address)
+        if query and query not in queries:
+            queries.append(query)
+    if not queries:
+        return None
+
+    pending = []
+    for query in queries:
+        value = _cached(query)
+        if value is None:
+            pending.append(query)
+        elif value != _MISS:
+            return value
+
+    if allow_remote and remote_available():
+        for query in pending:
+            try:
+                result = _remote_geocode(query)
+            except GeocoderServiceError as e:
+                logger.warning(f"Remote geocoder unavailable, using offline gazetteer: {str(e)}")
+                cache.set(REMOTE_DOWN_KEY, True, _setting('GEOCODE_BACKOFF_SECONDS', 300))
+                break
+            _store(query, result)
+            if result is not None:
+                return result
+
+    for query in queries:
+        result = gazetteer_lookup(query)
+        if result is not None:
+            return result
+    return None
+
+
+def prune_cache(max_entries=None):
+    """
+    Delete expired entries, then evict the least recently used ones above
+    max_entries. Returns (expired, evicted) counts.
+    """
+    if max_entries is None:
+        max_entries = _setting('GEOCODE_CACHE_MAX_ENTRIES', 50000)
+
+    expired, _ = GeocodeCache.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    evicted = 0
+    excess = GeocodeCache.objects.count() - max_entries
+    if excess > 0:
+        stale_ids = list(
+            GeocodeCache.objects.order_by('last_used_at').values_list('id', flat=True)[:excess]
+        )
+        evicted, _ = GeocodeCache.objects.filter(id__in=stale_ids).delete()
+    return expired, evicted
@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from safar_saathi.distance import within_radius
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch clinic distance filtering against per-clinic geodesic calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000],
+                            help='Numbers of clinics to benchmark')
+        parser.add_argument('--radius', type=float, default=50.0, help='Search radius in km')
+        parser.add_argument('--geodesic-sample', type=int, default=2000,
+                            help='Clinics measured with geodesic to extrapolate the loop cost')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        radius = options['radius']
+        origin = (28.6139, 77.2090)
+
+        self.stdout.write(f"{'clinics':>10} {'batch ms':>10} {'batch/s':>14} {'geodesic/s':>12} {'speedup':>8}")
+        for size in options['sizes']:
+            # Clinics scattered over roughly +-3 degrees of the origin
+            lats = origin[0] + rng.uniform(-3, 3, size)
+            lngs = origin[1] + rng.uniform(-3, 3, size)
+
+            start = time.perf_counter()
+            mask, _ = within_radius(origin[0], origin[1], lats, lngs, radius)
+            batch_seconds = time.perf_counter() - start
+
+            sample = min(size, options['geodesic_sample'])
+            start = time.perf_counter()
+            for i in range(sample):
+                geodesic(origin, (lats[i], lngs[i])).km
+            geodesic_rate = sample / (time.perf_counter() - start)
+
+            batch_rate = size / batch_seconds
+            self.stdout.write(
+                f'{size:>10} {batch_seconds * 1000:>10.2f} {batch_rate:>14,.0f} '
+                f'{geodesic_rate:>12,.0f} {batch_rate / geodesic_rate:>7.0f}x'
+            )
+            self.stdout.write(f'{"":>10} {int(mask.sum())} clinics within {radius:g} km')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from core import dashboard_cache
+
+
+class Command(BaseCommand):
+    help = ('Show dashboard cache hits and misses per block. The counters live in the cache, so '
+            'this only sees the web servers\' figures with a shared cache backend (Redis, Memcached)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        for name, counts in dashboard_cache.stats().items():
+            hit_rate = '-' if counts['hit_rate'] is None else f"{counts['hit_rate']}%"
+            self.stdout.write(
+                f"{name:<32} ttl {dashboard_cache.ttl(name):>5}s  hits {counts['hits']:>8}  "
+                f"misses {counts['misses']:>8}  hit rate {hit_rate:>6}"
+            )
+
+        if options['reset']:
+            dashboard_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Dashboard cache counters reset'))
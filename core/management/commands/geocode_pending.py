@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.geocode_queue import process_pending
+
+
+class Command(BaseCommand):
+    help = 'Geocode clinic and patient profiles that are waiting for coordinates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Profiles per model per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new profiles')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = process_pending(options['batch_size'])
+            total += processed
+            if processed:
+                self.stdout.write(f'Processed {processed} profiles')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully processed {total} profiles')
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.geocoding import prune_cache
+
+
+class Command(BaseCommand):
+    help = 'Delete expired geocoding cache entries and evict the least recently used ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-entries', type=int, help='Maximum entries to keep (defaults to GEOCODE_CACHE_MAX_ENTRIES)')
+
+    def handle(self, *args, **options):
+        expired, evicted = prune_cache(options.get('max_entries'))
+        self.stdout.write(
+            self.style.SUCCESS(f'Removed {expired} expired and {evicted} least recently used geocode entries')
+        )
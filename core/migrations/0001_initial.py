@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(help_text='Normalized address', max_length=255, unique=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+                ('source', models.CharField(choices=[('nominatim', 'Nominatim'), ('gazetteer', 'Offline Gazetteer')], default='nominatim', max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='core_geocod_expires_13530a_idx'), models.Index(fields=['last_used_at'], name='core_geocod_last_us_91f017_idx')],
+            },
+        ),
+    ]
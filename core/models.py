@@ -1,3 +1,25 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class GeocodeCache(models.Model):
+    SOURCE_CHOICES = [
+        ('nominatim', 'Nominatim'),
+        ('gazetteer', 'Offline Gazetteer'),
+    ]
+    query = models.CharField(max_length=255, unique=True, help_text="Normalized address")
+    latitude = models.FloatField(null=True, blank=True)  # Null for addresses that could not be geocoded
+    longitude = models.FloatField(null=True, blank=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='nominatim')
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at']),
+            models.Index(fields=['last_used_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.query} -> ({self.latitude}, {self.longitude})"
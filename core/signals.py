@@ -0,0 +1,20 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import dashboard_cache
+
+
+def invalidate_dashboard_blocks(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Scopes are read now, while a deleted row's relations still resolve;
+    # the versions are bumped once the change is visible to other requests
+    scoped = dashboard_cache.block_scopes(instance)
+    if scoped:
+        transaction.on_commit(lambda: [dashboard_cache.invalidate(name, scope) for name, scope in scoped])
+
+
+def connect():
+    for model in dashboard_cache.source_models():
+        post_save.connect(invalidate_dashboard_blocks, sender=model)
+        post_delete.connect(invalidate_dashboard_blocks, sender=model)
@@ -1,3 +1,344 @@
-from django.test import TestCase
+import warnings
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+from geopy.distance import geodesic
+from geopy.exc import GeocoderTimedOut
+
+from clinic import spatial
+from clinic.models import ClinicProfile
+from core import dashboard_cache, geocode_queue, geocoding
+from core.models import GeocodeCache
+from patient.models import PatientProfile, TransferRequest, TreatmentRecord
+
+from safar_saathi.distance import HAVERSINE_MAX_ERROR, haversine_km, within_radius
+
+
+class BatchDistanceTest(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.origin = (28.6139, 77.2090)
+        self.lats = self.origin[0] + rng.uniform(-1, 1, 500)
+        self.lngs = self.origin[1] + rng.uniform(-1, 1, 500)
+
+    def test_haversine_close_to_geodesic(self):
+        """Test haversine stays within the documented error bound"""
+        distances = haversine_km(self.origin[0], self.origin[1], self.lats, self.lngs)
+        for lat, lng, distance in zip(self.lats[:50], self.lngs[:50], distances[:50]):
+            exact = geodesic(self.origin, (lat, lng)).km
+            self.assertLessEqual(abs(distance - exact), exact * HAVERSINE_MAX_ERROR)
+
+    def test_within_radius_matches_geodesic_membership(self):
+        """Test refined membership agrees with geopy for every point"""
+        mask, _ = within_radius(self.origin[0], self.origin[1], self.lats, self.lngs, 50)
+        expected = [
+            geodesic(self.origin, (lat, lng)).km <= 50
+            for lat, lng in zip(self.lats, self.lngs)
+        ]
+        self.assertEqual(mask.tolist(), expected)
+
+    def test_within_radius_edge_near_the_equator(self):
+        """Test points just across the radius on low-latitude north-south paths, where haversine errs most"""
+        radius = 50
+        for lat in [0.0, 10.0]:
+            points = [
+                geodesic(kilometers=radius * (1 + offset)).destination((lat, 77.0), bearing)
+                for bearing in [0, 180] for offset in [-0.006, -0.0004, -0.0002, 0.0002, 0.006]
+            ]
+            lats = [point.latitude for point in points]
+            lngs = [point.longitude for point in points]
+            mask, _ = within_radius(lat, 77.0, lats, lngs, radius)
+            expected = [geodesic((lat, 77.0), (p, q)).km <= radius for p, q in zip(lats, lngs)]
+            self.assertEqual(mask.tolist(), expected)
+
+    def test_within_radius_empty_input(self):
+        """Test an empty coordinate array"""
+        mask, distances = within_radius(0.0, 0.0, [], [], 10)
+        self.assertEqual(mask.size, 0)
+        self.assertEqual(distances.size, 0)
+
+
+class GeocodingServiceTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_repeated_lookup_uses_cache(self, remote):
+        """Test a normalized address is only geocoded remotely once"""
+        remote.return_value = geocoding.GeocodeResult(19.07, 72.87, 'nominatim')
+        first = geocoding.geocode('12 Marine Drive,  Mumbai')
+        cache.clear()  # Force the second lookup through the database cache
+        second = geocoding.geocode('12 marine drive, MUMBAI!')
+        self.assertEqual(first, second)
+        remote.assert_called_once_with('12 marine drive, mumbai')
+        self.assertTrue(GeocodeCache.objects.filter(query='12 marine drive, mumbai').exists())
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_long_addresses_make_safe_cache_keys(self, remote):
+        """Test cache keys are short hashes without spaces, however long the address"""
+        remote.return_value = geocoding.GeocodeResult(19.07, 72.87, 'nominatim')
+        address = 'Flat 12, ' + 'Very Long Building Name ' * 20 + ', Mumbai'
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            geocoding.geocode(address)
+            self.assertEqual(geocoding.geocode(address), remote.return_value)
+        remote.assert_called_once()
+        key = geocoding.cache_key(geocoding.normalize_address(address))
+        self.assertLessEqual(len(key), 64)
+        self.assertNotIn(' ', key)
+        self.assertEqual(GeocodeCache.objects.get().query, geocoding.normalize_address(address))
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_unresolved_address_is_cached(self, remote):
+        """Test negative results are cached too"""
+        remote.return_value = None
+        self.assertIsNone(geocoding.geocode('Nowhere Lane'))
+        self.assertIsNone(geocoding.geocode('Nowhere Lane'))
+        remote.assert_called_once()
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_falls_back_to_gazetteer(self, remote):
+        """Test the offline gazetteer answers when the remote geocoder times out"""
+        remote.side_effect = GeocoderTimedOut('timed out')
+        result = geocoding.geocode('Flat 4, MG Road, Pune', 'Pune')
+        self.assertEqual(result.source, 'gazetteer')
+        self.assertAlmostEqual(result.latitude, 18.5204)
+        self.assertFalse(geocoding.remote_available())
+        self.assertFalse(GeocodeCache.objects.exists())
+
+        # While backing off, the remote geocoder is not called again
+        geocoding.geocode('Civil Lines, Jaipur, Rajasthan')
+        remote.assert_called_once()
+
+    def test_gazetteer_prefers_city_over_state(self):
+        """Test city centroids win over state centroids"""
+        result = geocoding.gazetteer_lookup('Sector 5, Noida, Uttar Pradesh')
+        self.assertAlmostEqual(result.latitude, 28.5355)
+        self.assertIsNone(geocoding.gazetteer_lookup('Atlantis'))
+
+    def test_prune_removes_expired_and_least_recently_used(self):
+        """Test TTL expiry and LRU eviction"""
+        now = timezone.now()
+        GeocodeCache.objects.create(query='expired', latitude=1, longitude=1,
+                                    expires_at=now - timedelta(days=1))
+        GeocodeCache.objects.create(query='old', latitude=1, longitude=1,
+                                    expires_at=now + timedelta(days=1),
+                                    last_used_at=now - timedelta(days=5))
+        GeocodeCache.objects.create(query='recent', latitude=1, longitude=1,
+                                    expires_at=now + timedelta(days=1))
+        self.assertEqual(geocoding.prune_cache(max_entries=1), (1, 1))
+        self.assertEqual(list(GeocodeCache.objects.values_list('query', flat=True)), ['recent'])
+
+
+class GeocodeQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def make_clinic(self, username, **kwargs):
+        user = User.objects.create_user(username=username, password='TestPass123!')
+        defaults = {
+            'name': f"{username} clinic",
+            'address': '14 Park Street',
+            'phone_number': '+1234567890',
+            'location': 'Kolkata',
+        }
+        defaults.update(kwargs)
+        return ClinicProfile.objects.create(user=user, **defaults)
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_pending_clinic_is_geocoded_and_indexed(self, remote):
+        """Test the worker fills coordinates and the spatial index"""
+        remote.return_value = geocoding.GeocodeResult(22.55, 88.35, 'nominatim')
+        clinic = self.make_clinic('queued')
+        self.assertEqual(geocode_queue.process_pending(), 1)
+
+        clinic.refresh_from_db()
+        self.assertEqual(clinic.geocode_status, 'geocoded')
+        self.assertEqual((clinic.latitude, clinic.longitude), (22.55, 88.35))
+        self.assertEqual([c.id for c in spatial.clinics_within(22.55, 88.35, 1)], [clinic.id])
+        self.assertEqual(geocode_queue.process_pending(), 0)
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_remote_outage_keeps_centroid_and_retries(self, remote):
+        """Test gazetteer centroids are provisional while the remote geocoder is down"""
+        remote.side_effect = GeocoderTimedOut('timed out')
+        clinic = self.make_clinic('outage')
+        geocode_queue.process_pending()
+
+        clinic.refresh_from_db()
+        self.assertEqual(clinic.geocode_status, 'pending')
+        self.assertEqual(clinic.geocode_attempts, 1)
+        self.assertAlmostEqual(clinic.latitude, 22.5726)
+        self.assertGreater(clinic.geocode_retry_at, timezone.now())
+        # Not due yet, so the next pass skips it
+        self.assertEqual(geocode_queue.process_pending(), 0)
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_unresolvable_address_fails(self, remote):
+        """Test an address nobody can resolve is marked failed"""
+        remote.return_value = None
+        clinic = self.make_clinic('lost', address='Unknown Lane', location='Atlantis')
+        geocode_queue.process_pending()
+        clinic.refresh_from_db()
+        self.assertEqual(clinic.geocode_status, 'failed')
+        self.assertIsNone(clinic.latitude)
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_supplied_coordinates_are_kept(self, remote):
+        """Test profiles created with coordinates are not re-geocoded"""
+        clinic = self.make_clinic('located', latitude=22.6, longitude=88.4)
+        geocode_queue.process_pending()
+        clinic.refresh_from_db()
+        self.assertEqual(clinic.geocode_status, 'geocoded')
+        self.assertEqual(clinic.latitude, 22.6)
+        remote.assert_not_called()
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_overlapping_workers_geocode_each_profile_once(self, remote):
+        """Test a worker starting while another holds a batch skips the claimed profiles"""
+        first = self.make_clinic('first')
+        second = self.make_clinic('second', address='2 Camac Street')
+        overlapping = []
+
+        def lookup(query):
+            if not overlapping:
+                # A second run starts while the first is still geocoding
+                overlapping.append(geocode_queue.process_batch('clinic.ClinicProfile', 'address', 'location'))
+            return geocoding.GeocodeResult(22.55, 88.35, 'nominatim')
+
+        remote.side_effect = lookup
+        self.assertEqual(geocode_queue.process_batch('clinic.ClinicProfile', 'address', 'location'), 2)
+        self.assertEqual(overlapping, [0])
+        self.assertEqual(remote.call_count, 2)
+        for clinic in (first, second):
+            clinic.refresh_from_db()
+            self.assertEqual((clinic.geocode_status, clinic.geocode_attempts, clinic.geocode_retry_at),
+                             ('geocoded', 1, None))
+
+    @mock.patch('core.geocoding._remote_geocode')
+    def test_address_changed_while_geocoding_is_queued_again(self, remote):
+        """Test the worker does not overwrite a profile re-queued while it was geocoding"""
+        clinic = self.make_clinic('moving')
+
+        def lookup(query):
+            if remote.call_count == 1:
+                edited = ClinicProfile.objects.get(pk=clinic.pk)
+                edited.address = '2 Camac Street'
+                geocode_queue.mark_pending(edited)
+                edited.save(update_fields=['address', *geocode_queue.GEOCODE_FIELDS])
+            return geocoding.GeocodeResult(22.55, 88.35, 'nominatim')
+
+        remote.side_effect = lookup
+        self.assertEqual(geocode_queue.process_pending(), 1)
+        clinic.refresh_from_db()
+        self.assertEqual((clinic.geocode_status, clinic.latitude, clinic.geocode_retry_at), ('pending', None, None))
+        self.assertEqual(spatial.clinics_within(22.55, 88.35, 1), [])
+
+        # Edited without mark_pending(): queued again all the same
+        remote.side_effect = lambda query: (
+            ClinicProfile.objects.filter(pk=clinic.pk).update(address='3 Camac Street')
+            and geocoding.GeocodeResult(22.56, 88.36, 'nominatim'))
+        self.assertEqual(geocode_queue.process_pending(), 1)
+        clinic.refresh_from_db()
+        self.assertEqual((clinic.geocode_status, clinic.geocode_retry_at), ('pending', None))
+
+        remote.side_effect = None
+        remote.return_value = geocoding.GeocodeResult(22.57, 88.37, 'nominatim')
+        self.assertEqual(geocode_queue.process_pending(), 1)
+        clinic.refresh_from_db()
+        self.assertEqual((clinic.geocode_status, clinic.latitude), ('geocoded', 22.57))
+
+    def test_expired_claims_are_taken_over(self):
+        """Test profiles of a worker that died are claimed again after the lease"""
+        clinic = self.make_clinic('abandoned')
+        now = timezone.now()
+        self.assertEqual(geocode_queue.claim(ClinicProfile, 10, now), [clinic])
+        self.assertEqual(geocode_queue.claim(ClinicProfile, 10, now), [])
+        self.assertEqual(geocode_queue.claim(ClinicProfile, 10, now + geocode_queue.lease()), [clinic])
+
+    def test_retry_delay_backs_off(self):
+        """Test retry delays grow exponentially up to the cap"""
+        self.assertEqual(geocode_queue.retry_delay(1), timedelta(seconds=60))
+        self.assertEqual(geocode_queue.retry_delay(3), timedelta(seconds=240))
+        self.assertEqual(geocode_queue.retry_delay(30), timedelta(days=1))
+
+
+class DashboardCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.clinics = []
+        for name in ['north', 'south']:
+            user = User.objects.create_user(username=name, password='TestPass123!')
+            self.clinics.append(ClinicProfile.objects.create(
+                user=user, name=f"{name} clinic", address='Test Street',
+                phone_number='+1234567890', location='Delhi'
+            ))
+        user = User.objects.create_user(username='patient', password='TestPass123!')
+        user.groups.add(Group.objects.create(name='Patient'))
+        self.patient = PatientProfile.objects.create(
+            user=user, date_of_birth='1990-01-01', phone_number='+1234567890',
+            address='Test Street', current_location='Delhi', current_clinic=self.clinics[0]
+        )
+        TreatmentRecord.objects.create(patient=self.patient, clinic=self.clinics[0], details='Checkup')
+        self.client.force_login(user)
+
+    def treatment_record_count(self):
+        return len(self.client.get(reverse('patient:dashboard')).context['treatment_records'])
+
+    def test_block_is_reused_until_a_source_changes(self):
+        """Test a cached block survives page loads and follows committed changes"""
+        self.assertEqual(self.treatment_record_count(), 1)
+        self.assertEqual(self.treatment_record_count(), 1)
+        self.assertEqual(dashboard_cache.stats()['patient.treatment_records'],
+                         {'hits': 1, 'misses': 1, 'hit_rate': 50.0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TreatmentRecord.objects.create(patient=self.patient, clinic=self.clinics[0], details='Follow-up')
+        self.assertEqual(self.treatment_record_count(), 2)
+
+        # QuerySet.update() sends no signals; callers invalidate explicitly
+        record = TreatmentRecord.objects.first()
+        TreatmentRecord.objects.filter(pk=record.pk).update(details='Corrected')
+        dashboard_cache.invalidate_instance(record)
+        self.assertEqual(self.client.get(reverse('patient:dashboard')).context['treatment_records'][0].details,
+                         'Corrected')
+
+    def test_invalidation_is_scoped(self):
+        """Test a change only drops the blocks of the clinic it belongs to"""
+        computed = []
+        for clinic in self.clinics:
+            dashboard_cache.get_block('clinic.transfer_requests', clinic.id, lambda: computed.append(clinic.id) or [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TransferRequest.objects.create(patient=self.patient, from_clinic=self.clinics[0],
+                                           to_clinic=self.clinics[1], reason='Moving')
+        for clinic in self.clinics:
+            dashboard_cache.get_block('clinic.transfer_requests', clinic.id, lambda: computed.append(clinic.id) or [])
+        self.assertEqual(computed, [self.clinics[0].id, self.clinics[1].id, self.clinics[1].id])
+
+    def test_value_computed_during_a_change_is_not_reused(self):
+        """Test a block read before an invalidation is stored under the old version"""
+        def compute():
+            dashboard_cache.invalidate('patient.treatment_records', self.patient.id)  # Concurrent change
+            return 'stale'
+
+        self.assertEqual(dashboard_cache.get_block('patient.treatment_records', self.patient.id, compute), 'stale')
+        self.assertEqual(dashboard_cache.get_block('patient.treatment_records', self.patient.id, lambda: 'fresh'),
+                         'fresh')
+
+    def test_stats_command(self):
+        """Test the stats command reports and resets the counters"""
+        self.treatment_record_count()
+        out = StringIO()
+        call_command('dashboard_cache_stats', '--reset', stdout=out)
+        self.assertRegex(out.getvalue(), r'patient.treatment_records .*misses +1')
+        self.assertEqual(dashboard_cache.stats()['patient.treatment_records']['misses'], 0)
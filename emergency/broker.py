@@ -0,0 +1,160 @@
+"""
+Fan-out of emergency alert events to connected clinic consoles.
+
+Each open alert stream (see views.alert_stream) subscribes to its clinic's
+channel and gets an asyncio queue. Views publish from request threads, so
+deliveries are handed to the subscriber's event loop with
+call_soon_threadsafe. A console that stops reading loses events once its
+queue is full rather than holding up the publisher.
+
+The backend is chosen with the EMERGENCY_BROKER setting:
+
+    EMERGENCY_BROKER = {
+        'BACKEND': 'emergency.broker.RedisBroker',
+        'OPTIONS': {'url': 'redis://localhost:6379/0'},
+    }
+
+InProcessBroker (the default) only reaches consoles connected to the same
+process. RedisBroker publishes through Redis pub/sub, and every process
+relays the messages to its own subscribers, so it works across several
+nodes.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 100
+
+
+def clinic_channel(clinic_id):
+    return f'clinic-{clinic_id}'
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, message):
+        """Queue a message; must run on the subscription's event loop"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.warning(f"Dropping event for slow subscriber on {self.channel}")
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self, **options):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        """Subscribe to a channel; call from the event loop that will read it"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+    def publish(self, channel, message):
+        """Send a JSON-serialisable message to every subscriber of a channel"""
+        self._dispatch(channel, message)
+
+    def _dispatch(self, channel, message, loop=None):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            if loop is not None and subscription.loop is not loop:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                self.unsubscribe(subscription)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Publishes through Redis so consoles connected to any process receive
+    events. Requires the redis package, which is only imported when this
+    backend is configured.
+    """
+    PREFIX = 'safar-saathi:emergency:'
+
+    def __init__(self, url='redis://localhost:6379/0', **options):
+        super().__init__(**options)
+        import redis
+        import redis.asyncio
+
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+        self._async_redis = redis.asyncio
+        self._listeners = {}
+
+    def subscribe(self, channel):
+        subscription = super().subscribe(channel)
+        # One relay task per event loop feeds that loop's subscribers
+        loop = subscription.loop
+        with self._lock:
+            if loop not in self._listeners or self._listeners[loop].done():
+                self._listeners[loop] = loop.create_task(self._relay())
+        return subscription
+
+    def publish(self, channel, message):
+        self._client.publish(self.PREFIX + channel, json.dumps(message))
+
+    async def _relay(self):
+        client = self._async_redis.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(self.PREFIX + '*')
+        try:
+            async for item in pubsub.listen():
+                if item['type'] != 'pmessage':
+                    continue
+                channel = item['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                self._dispatch(channel[len(self.PREFIX):], json.loads(item['data']), asyncio.get_running_loop())
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = getattr(settings, 'EMERGENCY_BROKER', {})
+            backend = import_string(config.get('BACKEND', 'emergency.broker.InProcessBroker'))
+            _broker = backend(**config.get('OPTIONS', {}))
+        return _broker
@@ -0,0 +1,68 @@
+"""
+Emergency access fan-out.
+
+When a patient raises an alert, every eligible clinic needs an active
+EmergencyAccess grant. The grants are written in a fixed number of
+queries, however many clinics are involved:
+
+1. one UPDATE retires the patient's active grants that have expired,
+2. one SELECT finds the clinics that still hold an active grant,
+3. one batched INSERT creates grants for the others,
+
+plus the few queries that count the new grants in the platform statistics
+rollup (admin_app/rollup.py).
+
+The unique_active_emergency_access constraint guarantees at most one active
+grant per patient and clinic. Rows that lose a race with a concurrent alert
+are dropped by the insert, not raised.
+"""
+from datetime import timedelta
+
+from django.utils import timezone
+
+from admin_app import rollup
+
+from .models import EmergencyAccess
+
+ACCESS_DURATION = timedelta(hours=24)
+
+
+def grant_access(patient, clinic_reasons, requested_by, **fields):
+    """
+    Give each clinic in clinic_reasons ({clinic id: reason}) an active
+    emergency access grant for the patient. Clinics that already hold one
+    keep it. Extra keyword arguments are EmergencyAccess field values
+    shared by every new grant.
+
+    Returns the ids of the clinics that were granted access.
+    """
+    if not clinic_reasons:
+        return []
+
+    now = timezone.now()
+    active = EmergencyAccess.objects.filter(patient=patient, is_active=True)
+    active.filter(expiry_time__lte=now).update(is_active=False)
+    existing = set(
+        active.filter(clinic_id__in=list(clinic_reasons)).values_list('clinic_id', flat=True)
+    )
+
+    # bulk_create skips save(), so expiry_time is set here
+    grants = [
+        EmergencyAccess(
+            patient=patient,
+            clinic_id=clinic_id,
+            requested_by=requested_by,
+            reason=reason,
+            request_time=now,
+            expiry_time=now + ACCESS_DURATION,
+            is_active=True,
+            **fields
+        )
+        for clinic_id, reason in clinic_reasons.items()
+        if clinic_id not in existing
+    ]
+    EmergencyAccess.objects.bulk_create(grants, ignore_conflicts=True)
+    # bulk_create sends no signals; a grant dropped by a race is counted
+    # anyway and corrected by reconcile_platform_stats
+    rollup.record_created(grants)
+    return [grant.clinic_id for grant in grants]
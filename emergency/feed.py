@@ -0,0 +1,119 @@
+"""
+Emergency alert feed for clinic consoles.
+
+A clinic sees the active alerts of its own patients plus the active alerts
+raised within its response radius. Nearby alerts are found with a bounding
+box query on the (is_active, location_lat, location_lng) index, then
+checked exactly in one vectorised pass, so only alerts in the clinic's area
+are loaded. The feed is ordered by severity, then most recent first.
+
+New and updated alerts are also pushed to the same clinics through the
+broker (see broker.py and views.alert_stream).
+"""
+import logging
+
+from django.db.models import Case, IntegerField, Max, Q, Value, When
+
+from clinic import spatial
+from clinic.models import ClinicProfile
+from clinic.spatial import bounding_boxes
+from safar_saathi.distance import within_radius
+
+from .broker import clinic_channel, get_broker
+from .models import EmergencyAlert
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_RANK = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
+
+def nearby_alert_distances(clinic):
+    """
+    {alert id: distance in km} for the active alerts within the clinic's
+    response radius, excluding alerts of the clinic's own patients. Empty
+    when the clinic has no coordinates.
+    """
+    if clinic.latitude is None or clinic.longitude is None:
+        return {}
+
+    radius = clinic.response_radius_km
+    in_boxes = Q()
+    for min_lat, max_lat, min_lng, max_lng in bounding_boxes(clinic.latitude, clinic.longitude, radius):
+        in_boxes |= Q(location_lat__range=(min_lat, max_lat), location_lng__range=(min_lng, max_lng))
+
+    candidates = list(
+        EmergencyAlert.objects.filter(in_boxes, is_active=True)
+        .exclude(patient__current_clinic=clinic)
+        .values_list('id', 'location_lat', 'location_lng')
+    )
+    if not candidates:
+        return {}
+
+    ids, lats, lngs = zip(*candidates)
+    mask, distances = within_radius(clinic.latitude, clinic.longitude, lats, lngs, radius)
+    return {
+        alert_id: round(float(distance), 1)
+        for alert_id, inside, distance in zip(ids, mask, distances)
+        if inside
+    }
+
+
+def alerts_for_clinic(clinic, nearby_ids):
+    """Active alerts of the clinic's patients and of nearby_ids, most urgent first"""
+    severity_rank = Case(
+        *[When(severity_level=level, then=Value(rank)) for level, rank in SEVERITY_RANK.items()],
+        default=Value(len(SEVERITY_RANK)),
+        output_field=IntegerField(),
+    )
+    return (
+        EmergencyAlert.objects.filter(is_active=True)
+        .filter(Q(patient__current_clinic=clinic) | Q(id__in=list(nearby_ids)))
+        .select_related('patient__user', 'patient__current_clinic', 'responded_by')
+        .annotate(severity_rank=severity_rank)
+        .order_by('severity_rank', '-triggered_at', '-id')
+    )
+
+
+def alert_recipients(alert):
+    """
+    {clinic id: distance in km} for the clinics whose feed shows an alert:
+    clinics with the alert inside their response radius, plus the patient's
+    own clinic (distance None).
+    """
+    recipients = {}
+    if alert.location_lat is not None and alert.location_lng is not None:
+        clinics = ClinicProfile.objects.filter(is_approved=True, is_active=True)
+        max_radius = clinics.aggregate(radius=Max('response_radius_km'))['radius']
+        if max_radius:
+            nearby = spatial.clinics_within(
+                alert.location_lat, alert.location_lng, max_radius,
+                queryset=clinics.only('id', 'latitude', 'longitude', 'response_radius_km')
+            )
+            for clinic in nearby:
+                if clinic.distance <= clinic.response_radius_km:
+                    recipients[clinic.id] = round(clinic.distance, 1)
+    if alert.patient.current_clinic_id:
+        recipients[alert.patient.current_clinic_id] = None
+    return recipients
+
+
+def publish_alert(alert, event):
+    """Push a created or updated alert to the consoles of every recipient clinic"""
+    try:
+        message = {
+            'event': event,
+            'id': alert.id,
+            'patient': alert.patient.user.get_full_name() or alert.patient.user.username,
+            'alert_message': alert.alert_message,
+            'location_address': alert.location_address,
+            'severity_level': alert.severity_level,
+            'resolution_status': alert.resolution_status,
+            'is_active': alert.is_active,
+            'triggered_at': alert.triggered_at.isoformat(),
+        }
+        broker = get_broker()
+        for clinic_id, distance in alert_recipients(alert).items():
+            broker.publish(clinic_channel(clinic_id), dict(message, distance_km=distance))
+    except Exception as e:
+        # Consoles still see the alert on their next page load
+        logger.error(f"Error publishing emergency alert {alert.id}: {str(e)}", exc_info=True)
@@ -0,0 +1,81 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from clinic import disease_mask, spatial
+from clinic.models import ClinicProfile
+from core import benchmarking
+from emergency import fanout
+from emergency.models import EmergencyAccess
+from emergency.views import EMERGENCY_RADIUS_KM
+
+
+class Command(BaseCommand):
+    help = 'Benchmark emergency access fan-out against the number of nearby clinics. ' + benchmarking.ROLLED_BACK
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500],
+                            help='Numbers of nearby clinics to benchmark')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        origin = (28.6139, 77.2090)
+
+        self.stdout.write(f"{'clinics':>8} {'loop ms':>9} {'loop q':>7} {'bulk ms':>9} {'bulk q':>7} {'speedup':>8}")
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.make_clinics(size, origin, rng)
+                loop_seconds, loop_queries = self.measure(self.per_clinic_fanout, origin)
+                bulk_seconds, bulk_queries = self.measure(self.bulk_fanout, origin)
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f'{size:>8} {loop_seconds * 1000:>9.1f} {loop_queries:>7} '
+                f'{bulk_seconds * 1000:>9.1f} {bulk_queries:>7} {loop_seconds / bulk_seconds:>7.1f}x'
+            )
+
+    def make_clinics(self, size, origin, rng):
+        users = benchmarking.make_users(f'fanout-{size}', size)
+        # Scattered within ~30 km of the origin
+        lats = origin[0] + rng.uniform(-0.25, 0.25, size)
+        lngs = origin[1] + rng.uniform(-0.25, 0.25, size)
+        ClinicProfile.objects.bulk_create([
+            ClinicProfile(user=user, name=user.username, address='Benchmark', phone_number='0',
+                          location='Delhi', latitude=lat, longitude=lng, is_approved=True)
+            for user, lat, lng in zip(users, lats, lngs)
+        ])
+        # bulk_create bypasses the signal that maintains the index
+        spatial.rebuild_index()
+
+    def measure(self, fanout_func, origin):
+        patient = benchmarking.make_patient(f'fanout-{fanout_func.__name__}')
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            fanout_func(patient, origin)
+            seconds = time.perf_counter() - start
+        return seconds, len(queries)
+
+    def nearby_relevant(self, patient, origin):
+        clinics = spatial.clinics_within(
+            origin[0], origin[1], EMERGENCY_RADIUS_KM,
+            queryset=ClinicProfile.objects.filter(is_approved=True, is_active=True)
+        )
+        mask = disease_mask.patient_mask(['HIV'])
+        return [clinic for clinic in clinics if disease_mask.is_relevant(clinic, mask)]
+
+    def per_clinic_fanout(self, patient, origin):
+        """The fan-out as it was before batching: one get_or_create per clinic"""
+        for clinic in self.nearby_relevant(patient, origin):
+            EmergencyAccess.objects.get_or_create(
+                patient=patient,
+                clinic=clinic,
+                defaults={'requested_by': patient.user, 'reason': 'Benchmark'}
+            )
+
+    def bulk_fanout(self, patient, origin):
+        clinic_reasons = {clinic.id: 'Benchmark' for clinic in self.nearby_relevant(patient, origin)}
+        fanout.grant_access(patient, clinic_reasons, patient.user)
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def deactivate_duplicate_grants(apps, schema_editor):
+    # Keep the newest active grant per patient and clinic
+    EmergencyAccess = apps.get_model('emergency', 'EmergencyAccess')
+    seen = set()
+    duplicates = []
+    active = (
+        EmergencyAccess.objects.filter(is_active=True)
+        .order_by('-request_time', '-id')
+        .values_list('id', 'patient_id', 'clinic_id')
+    )
+    for access_id, patient_id, clinic_id in active.iterator():
+        if (patient_id, clinic_id) in seen:
+            duplicates.append(access_id)
+        else:
+            seen.add((patient_id, clinic_id))
+    EmergencyAccess.objects.filter(id__in=duplicates).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0010_clinicprofile_disease_mask'),
+        ('emergency', '0004_emergencyaccess_created_at'),
+        ('patient', '0018_patientprofile_geocode_attempts_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_duplicate_grants, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='emergencyaccess',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('patient', 'clinic'), name='unique_active_emergency_access'),
+        ),
+    ]
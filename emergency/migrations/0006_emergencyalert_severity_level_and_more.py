@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency', '0005_unique_active_emergency_access'),
+        ('patient', '0018_patientprofile_geocode_attempts_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emergencyalert',
+            name='severity_level',
+            field=models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High'), ('critical', 'Critical')], default='medium', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='emergencyalert',
+            index=models.Index(fields=['is_active', 'location_lat', 'location_lng'], name='emergency_e_is_acti_5f3f64_idx'),
+        ),
+    ]
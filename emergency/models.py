@@ -36,6 +36,15 @@ class EmergencyAccess(models.Model):
     resolution_notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['patient', 'clinic'],
+                condition=models.Q(is_active=True),
+                name='unique_active_emergency_access',
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.expiry_time:
             self.expiry_time = self.request_time + \
@@ -55,6 +64,12 @@ class EmergencyAlert(models.Model):
         ('clinic_detected', 'Clinic Detected'),
         ('system_auto', 'System Auto-Alert'),
     ]
+    SEVERITY_LEVELS = [
+        ('low', 'Low'),
+        ('medium', 'Medium'),
+        ('high', 'High'),
+        ('critical', 'Critical'),
+    ]
     patient = models.ForeignKey('patient.PatientProfile', on_delete=models.CASCADE)
     alert_type = models.CharField(max_length=20, choices=ALERT_TYPES)
     triggered_at = models.DateTimeField(default=timezone.now)
@@ -62,6 +77,7 @@ class EmergencyAlert(models.Model):
     location_lng = models.FloatField(null=True, blank=True)
     location_address = models.TextField(blank=True)
     alert_message = models.TextField()
+    severity_level = models.CharField(max_length=20, choices=SEVERITY_LEVELS, default='medium')
     is_active = models.BooleanField(default=True)
     responded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='emergency_responses')
     response_time = models.DateTimeField(null=True, blank=True)
@@ -75,6 +91,9 @@ class EmergencyAlert(models.Model):
 
     class Meta:
         ordering = ['-triggered_at']
+        indexes = [
+            models.Index(fields=['is_active', 'location_lat', 'location_lng']),
+        ]
 
     def __str__(self):
         return f"Emergency Alert: {self.patient.user.username} - {self.alert_type}"
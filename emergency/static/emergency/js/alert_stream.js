@@ -0,0 +1,41 @@
+/*
+ * Live emergency alert notifications.
+ *
+ * Listens to the emergency:alert_stream Server-Sent Events endpoint and
+ * shows a banner on the alerts page when alerts for this clinic are raised
+ * or updated, so the page does not have to be polled. EventSource
+ * reconnects on its own after network errors. The page only sets
+ * data-url when the site runs under ASGI, the only server the stream
+ * works with.
+ */
+(function () {
+    'use strict';
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var banner = document.getElementById('alert-stream');
+        if (!banner || !banner.dataset.url || typeof EventSource === 'undefined') {
+            return;
+        }
+
+        var text = banner.querySelector('.alert-stream-text');
+        var created = 0;
+        var updated = 0;
+        var source = new EventSource(banner.dataset.url);
+
+        source.addEventListener('alert', function (event) {
+            var alert = JSON.parse(event.data);
+            if (alert.event === 'created') {
+                created += 1;
+                var where = alert.distance_km !== null ? ' (' + alert.distance_km + ' km away)' : '';
+                text.textContent = 'New ' + alert.severity_level + ' emergency from ' + alert.patient + where + '.';
+            } else {
+                updated += 1;
+                text.textContent = 'Alert for ' + alert.patient + ' is now ' + alert.resolution_status.replace('_', ' ') + '.';
+            }
+            if (created + updated > 1) {
+                text.textContent += ' ' + created + ' new, ' + updated + ' updated since this page loaded.';
+            }
+            banner.classList.remove('d-none');
+        });
+    });
+})();
@@ -1,3 +1,278 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from clinic.models import ClinicProfile, Disease
+from emergency import broker, fanout, feed
+from emergency.models import EmergencyAccess, EmergencyAlert
+from patient.models import PatientProfile
+
+
+class EmergencyFanoutTest(TestCase):
+    def setUp(self):
+        patient_group = Group.objects.create(name='Patient')
+        self.malaria = Disease.objects.create(name='Malaria')
+        self.clinics = []
+        # Clinics 0-3 are within a few km, clinic 4 is ~110 km away
+        for i, lat in enumerate([28.61, 28.62, 28.63, 28.64, 29.61]):
+            user = User.objects.create_user(username=f'clinic{i}', password='TestPass123!')
+            self.clinics.append(ClinicProfile.objects.create(
+                user=user,
+                name=f'Clinic {i}',
+                address='Test Street',
+                phone_number='+1234567890',
+                location='Delhi',
+                latitude=lat,
+                longitude=77.20,
+                is_approved=True
+            ))
+        self.clinics[3].diseases_treated.add(self.malaria)
+
+        self.user = User.objects.create_user(username='alertpatient', password='TestPass123!')
+        self.user.groups.add(patient_group)
+        self.patient = PatientProfile.objects.create(
+            user=self.user,
+            date_of_birth='1990-01-01',
+            phone_number='+1234567890',
+            address='Test Street',
+            current_location='Delhi',
+            current_clinic=self.clinics[4]
+        )
+        self.client.force_login(self.user)
+
+    def trigger(self):
+        return self.client.post(reverse('emergency:trigger_emergency'), {
+            'emergency_type': 'medical',
+            'severity_level': 'high',
+            'location_lat': '28.61',
+            'location_lng': '77.20',
+            'location_address': 'Connaught Place',
+            'alert_message': 'Severe chest pain and dizziness',
+        })
+
+    def granted_clinics(self):
+        return set(
+            EmergencyAccess.objects.filter(patient=self.patient, is_active=True)
+            .values_list('clinic_id', flat=True)
+        )
+
+    def test_trigger_grants_current_and_relevant_nearby_clinics(self):
+        """Test access goes to the current clinic and nearby clinics treating the patient"""
+        response = self.trigger()
+        self.assertRedirects(response, reverse('emergency:emergency_dashboard'), fetch_redirect_response=False)
+        self.assertEqual(EmergencyAlert.objects.count(), 1)
+        self.assertEqual(self.granted_clinics(), {c.id for c in self.clinics if c is not self.clinics[3]})
+
+        access = EmergencyAccess.objects.get(patient=self.patient, clinic=self.clinics[1])
+        self.assertEqual(access.severity_level, 'high')
+        self.assertEqual(access.reason, 'Emergency alert: Severe chest pain and dizziness')
+        self.assertFalse(access.is_expired())
+
+    def test_repeat_trigger_reuses_active_grants(self):
+        """Test a second alert does not duplicate grants and renews expired ones"""
+        self.trigger()
+        expired = EmergencyAccess.objects.get(patient=self.patient, clinic=self.clinics[0])
+        EmergencyAccess.objects.filter(pk=expired.pk).update(expiry_time=expired.request_time)
+
+        self.trigger()
+        self.assertEqual(EmergencyAccess.objects.filter(patient=self.patient, is_active=True).count(), 4)
+        self.assertFalse(EmergencyAccess.objects.get(pk=expired.pk).is_active)
+
+    def test_fanout_query_count_is_constant(self):
+        """Test grants are written in a fixed number of queries"""
+        # 3 for the grants, 4 to create the rollup counters (select,
+        # savepoint, insert, release)
+        with self.assertNumQueries(7):
+            granted = fanout.grant_access(
+                self.patient, {clinic.id: 'Test' for clinic in self.clinics}, self.user
+            )
+        self.assertEqual(len(granted), 5)
+
+    def test_one_active_grant_per_clinic(self):
+        """Test the database rejects a second active grant for the same clinic"""
+        fanout.grant_access(self.patient, {self.clinics[0].id: 'Test'}, self.user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            EmergencyAccess.objects.create(patient=self.patient, clinic=self.clinics[0],
+                                           requested_by=self.user, reason='Duplicate')
+
+
+class EmergencyAlertFeedTest(TestCase):
+    def setUp(self):
+        clinic_group = Group.objects.create(name='Clinic')
+        self.clinic_user = User.objects.create_user(username='feedclinic', password='TestPass123!')
+        self.clinic_user.groups.add(clinic_group)
+        self.clinic = ClinicProfile.objects.create(
+            user=self.clinic_user,
+            name='Feed Clinic',
+            address='Test Street',
+            phone_number='+1234567890',
+            location='Delhi',
+            latitude=28.61,
+            longitude=77.20,
+            is_approved=True,
+            response_radius_km=20
+        )
+        self.client.force_login(self.clinic_user)
+
+    def make_patient(self, username, clinic=None):
+        user = User.objects.create_user(username=username, password='TestPass123!')
+        return PatientProfile.objects.create(
+            user=user,
+            date_of_birth='1990-01-01',
+            phone_number='+1234567890',
+            address='Test Street',
+            current_location='Delhi',
+            current_clinic=clinic
+        )
+
+    def make_alert(self, patient, lat, lng, severity='medium', **kwargs):
+        return EmergencyAlert.objects.create(
+            patient=patient,
+            alert_type='patient_triggered',
+            location_lat=lat,
+            location_lng=lng,
+            alert_message='Need help',
+            severity_level=severity,
+            **kwargs
+        )
+
+    def test_feed_filters_by_response_radius(self):
+        """Test only own patients' alerts and alerts within the radius are shown"""
+        own = self.make_alert(self.make_patient('own', self.clinic), 19.07, 72.87)
+        near = self.make_alert(self.make_patient('near'), 28.70, 77.20)  # ~10 km
+        self.make_alert(self.make_patient('far'), 28.90, 77.20)  # ~32 km
+        self.make_alert(self.make_patient('mumbai'), 19.07, 72.87)
+        self.make_alert(self.make_patient('resolved'), 28.61, 77.20, is_active=False)
+        self.make_alert(self.make_patient('unlocated'), None, None)
+
+        response = self.client.get(reverse('emergency:emergency_alerts'))
+        alerts = list(response.context['alerts'])
+        self.assertEqual({a.id for a in alerts}, {own.id, near.id})
+        self.assertEqual(response.context['nearby_alerts_count'], 1)
+        self.assertAlmostEqual(next(a for a in alerts if a.id == near.id).distance, 10.0, delta=0.5)
+
+        self.clinic.response_radius_km = 50
+        self.clinic.save()
+        response = self.client.get(reverse('emergency:emergency_alerts'))
+        self.assertEqual(len(response.context['alerts']), 3)
+
+    def test_feed_orders_by_severity_then_recency_and_paginates(self):
+        """Test critical alerts come first and the feed is paginated"""
+        patient = self.make_patient('busy', self.clinic)
+        low = self.make_alert(patient, 28.61, 77.20, 'low')
+        critical = self.make_alert(patient, 28.61, 77.20, 'critical')
+        for _ in range(25):
+            self.make_alert(patient, 28.61, 77.20, 'medium')
+        newest_high = self.make_alert(patient, 28.61, 77.20, 'high')
+
+        response = self.client.get(reverse('emergency:emergency_alerts'))
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 28)
+        self.assertEqual([a.id for a in page][:2], [critical.id, newest_high.id])
+
+        response = self.client.get(reverse('emergency:emergency_alerts'), {'page': 2})
+        self.assertEqual(list(response.context['alerts'])[-1].id, low.id)
+
+
+class AlertBrokerTest(SimpleTestCase):
+    def test_publish_from_another_thread(self):
+        """Test events published from a request thread reach the subscriber's loop"""
+        alert_broker = broker.InProcessBroker()
+
+        async def listen():
+            subscription = alert_broker.subscribe('clinic-1')
+            other = alert_broker.subscribe('clinic-2')
+            publisher = threading.Thread(target=alert_broker.publish, args=('clinic-1', {'id': 7}))
+            publisher.start()
+            message = await asyncio.wait_for(subscription.get(), 1)
+            publisher.join()
+            self.assertTrue(other.queue.empty())
+            subscription.close()
+            other.close()
+            return message
+
+        self.assertEqual(asyncio.run(listen()), {'id': 7})
+        self.assertEqual(alert_broker.subscriber_count('clinic-1'), 0)
+
+    def test_full_queue_drops_events(self):
+        """Test a console that stops reading does not block publishers"""
+        alert_broker = broker.InProcessBroker()
+
+        async def flood():
+            subscription = alert_broker.subscribe('clinic-1')
+            for i in range(broker.QUEUE_SIZE + 5):
+                alert_broker.publish('clinic-1', {'id': i})
+            await asyncio.sleep(0)
+            return subscription.queue.qsize()
+
+        with self.assertLogs('emergency.broker', 'WARNING'):
+            self.assertEqual(asyncio.run(flood()), broker.QUEUE_SIZE)
+
+
+class AlertStreamTest(EmergencyAlertFeedTest):
+    def test_alert_recipients(self):
+        """Test alerts go to the home clinic and clinics whose radius covers them"""
+        far_user = User.objects.create_user(username='farclinic', password='TestPass123!')
+        far = ClinicProfile.objects.create(user=far_user, name='Far Clinic', address='Test Street',
+                                           phone_number='+1234567890', location='Delhi', latitude=28.90,
+                                           longitude=77.20, is_approved=True, response_radius_km=100)
+        home = ClinicProfile.objects.create(user=User.objects.create_user(username='homeclinic'),
+                                            name='Home Clinic', address='Test Street',
+                                            phone_number='+1234567890', location='Mumbai')
+        alert = self.make_alert(self.make_patient('streamed', home), 28.70, 77.20)
+
+        recipients = feed.alert_recipients(alert)
+        self.assertEqual(set(recipients), {self.clinic.id, far.id, home.id})
+        self.assertIsNone(recipients[home.id])
+        self.assertAlmostEqual(recipients[self.clinic.id], 10.0, delta=0.5)
+
+        self.clinic.response_radius_km = 5
+        self.clinic.save()
+        self.assertNotIn(self.clinic.id, feed.alert_recipients(alert))
+
+    def test_respond_publishes_update_after_commit(self):
+        """Test responding to an alert pushes the new status to consoles"""
+        alert = self.make_alert(self.make_patient('responded', self.clinic), 28.61, 77.20)
+        with mock.patch.object(broker.get_broker(), 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('emergency:respond_to_emergency', args=[alert.id]),
+                                 {'resolution_status': 'resolved'})
+        channel, message = publish.call_args.args
+        self.assertEqual(channel, broker.clinic_channel(self.clinic.id))
+        self.assertEqual((message['event'], message['resolution_status'], message['is_active']),
+                         ('updated', 'resolved', False))
+
+    async def test_stream_delivers_published_alerts(self):
+        """Test the SSE endpoint forwards events for the clinic's channel"""
+        await self.async_client.aforce_login(self.clinic_user)
+        response = await self.async_client.get(reverse('emergency:alert_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+        next_chunk = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        broker.get_broker().publish(broker.clinic_channel(self.clinic.id), {'id': 5, 'event': 'created'})
+        chunk = (await asyncio.wait_for(next_chunk, 1)).decode()
+        self.assertTrue(chunk.startswith('event: alert\nid: 5\n'))
+        self.assertEqual(json.loads(chunk.split('data: ')[1]), {'id': 5, 'event': 'created'})
+        await stream.aclose()
+        response.close()
+        self.assertEqual(broker.get_broker().subscriber_count(broker.clinic_channel(self.clinic.id)), 0)
+
+    def test_stream_needs_asgi(self):
+        """Test the stream is refused under WSGI and the alerts page does not connect to it"""
+        self.client.force_login(self.clinic_user)
+        response = self.client.get(reverse('emergency:alert_stream'))
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(broker.get_broker().subscriber_count(broker.clinic_channel(self.clinic.id)), 0)
+
+        response = self.client.get(reverse('emergency:emergency_alerts'))
+        self.assertFalse(response.context['alert_stream'])
+        self.assertNotContains(response, reverse('emergency:alert_stream'))
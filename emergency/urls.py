@@ -7,5 +7,6 @@ urlpatterns = [
     path('dashboard/', views.emergency_dashboard, name='emergency_dashboard'),
     path('trigger/', views.trigger_emergency, name='trigger_emergency'),
     path('alerts/', views.emergency_alerts, name='emergency_alerts'),
+    path('alerts/stream/', views.alert_stream, name='alert_stream'),
     path('respond/<int:alert_id>/', views.respond_to_emergency, name='respond_to_emergency'),
 ]
@@ -4,15 +4,30 @@ from django.contrib import messages
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError, transaction
-from django.http import Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.core.paginator import Paginator
 from .models import EmergencyAccess, EmergencyAlert
+from . import broker, feed, fanout
 from patient.models import PatientProfile, MedicalDataRequest
 from clinic.models import ClinicProfile
+from clinic import disease_mask, spatial
+from patient.nearby import patient_diseases
 from safar_saathi.utils import is_patient, is_clinic_staff
+from asgiref.sync import sync_to_async
+import asyncio
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+EMERGENCY_RADIUS_KM = 50
+
+ALERTS_PER_PAGE = 20
+
+# Comment lines sent on idle alert streams so proxies keep them open
+STREAM_KEEPALIVE_SECONDS = 15
+
 
 @login_required
 @user_passes_test(is_patient)
@@ -87,62 +102,37 @@ def trigger_emergency(request):
                     location_lat=location_lat or None,
                     location_lng=location_lng or None,
                     location_address=location_address,
-                    alert_message=alert_message
+                    alert_message=alert_message,
+                    severity_level=severity_level
                 )
 
-                # If patient has current clinic, create emergency access
-                if patient.current_clinic:
-                    EmergencyAccess.objects.create(
-                        patient=patient,
-                        clinic=patient.current_clinic,
-                        requested_by=request.user,
-                        reason=alert_message,
-                        emergency_type=emergency_type,
-                        severity_level=severity_level,
-                        location_lat=location_lat or None,
-                        location_lng=location_lng or None,
-                        location_address=location_address
-                    )
+                # The patient's current clinic always gets access
+                clinic_reasons = {}
+                if patient.current_clinic_id:
+                    clinic_reasons[patient.current_clinic_id] = alert_message
 
-                # Find nearby clinics and create emergency access for them
+                # Nearby clinics get access if they treat the patient's
+                # diseases or have no specific diseases
                 if location_lat and location_lng:
-                    from geopy.distance import geodesic
-                    from clinic.models import ClinicProfile
-
-                    patient_location = (float(location_lat), float(location_lng))
-                    nearby_clinics = ClinicProfile.objects.filter(
-                        is_approved=True,
-                        is_active=True,
-                        latitude__isnull=False,
-                        longitude__isnull=False
+                    nearby_clinics = spatial.clinics_within(
+                        float(location_lat), float(location_lng), EMERGENCY_RADIUS_KM,
+                        queryset=ClinicProfile.objects.filter(is_approved=True, is_active=True)
                     )
-
+                    mask = disease_mask.patient_mask(patient_diseases(patient))
                     for clinic in nearby_clinics:
-                        clinic_location = (clinic.latitude, clinic.longitude)
-                        distance = geodesic(patient_location, clinic_location).km
-                        if distance <= 50:  # Within 50 km
-                            # Check if clinic treats patient's diseases
-                            patient_diseases = set()
-                            if hasattr(patient, 'disease') and patient.disease:
-                                patient_diseases.add(patient.disease.lower())
-
-                            clinic_diseases = set(d.name.lower() for d in clinic.diseases_treated.all())
-
-                            # Create access if clinic is relevant or if no specific diseases
-                            if not clinic_diseases or patient_diseases & clinic_diseases:
-                                EmergencyAccess.objects.get_or_create(
-                                    patient=patient,
-                                    clinic=clinic,
-                                    defaults={
-                                        'requested_by': request.user,
-                                        'reason': f"Emergency alert: {alert_message}",
-                                        'emergency_type': emergency_type,
-                                        'severity_level': severity_level,
-                                        'location_lat': location_lat,
-                                        'location_lng': location_lng,
-                                        'location_address': location_address
-                                    }
-                                )
+                        if clinic.id not in clinic_reasons and disease_mask.is_relevant(clinic, mask):
+                            clinic_reasons[clinic.id] = f"Emergency alert: {alert_message}"
+
+                granted = fanout.grant_access(
+                    patient, clinic_reasons, request.user,
+                    emergency_type=emergency_type,
+                    severity_level=severity_level,
+                    location_lat=location_lat or None,
+                    location_lng=location_lng or None,
+                    location_address=location_address
+                )
+                logger.info(f"Emergency access granted to {len(granted)} clinics for alert {alert.id}")
+                transaction.on_commit(lambda: feed.publish_alert(alert, 'created'))
 
                 logger.warning(f"Emergency alert triggered by patient {request.user.username}: {alert_message}")
                 messages.success(request, 'Emergency alert sent! Help is on the way.')
@@ -171,30 +161,83 @@ def trigger_emergency(request):
 def emergency_alerts(request):
     clinic = request.user.clinicprofile
 
-    # Get alerts for patients registered at this clinic
-    registered_alerts = EmergencyAlert.objects.filter(
-        patient__current_clinic=clinic,
-        is_active=True
-    )
+    # Alerts of patients registered at this clinic, plus alerts raised within
+    # the clinic's response radius
+    nearby_distances = feed.nearby_alert_distances(clinic)
+    alerts = feed.alerts_for_clinic(clinic, nearby_distances)
 
-    # Get nearby emergency alerts (patients not registered here but in emergency)
-    # For now, we'll show all active alerts - in production, you'd filter by distance
-    nearby_alerts = EmergencyAlert.objects.filter(
-        is_active=True
-    ).exclude(patient__current_clinic=clinic)
-
-    # Combine and order by triggered time
-    all_alerts = (registered_alerts | nearby_alerts).order_by('-triggered_at')
+    paginator = Paginator(alerts, ALERTS_PER_PAGE)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    for alert in page_obj:
+        alert.distance = nearby_distances.get(alert.id)
 
     context = {
-        'alerts': all_alerts,
+        'alerts': page_obj,
+        'page_obj': page_obj,
         'clinic': clinic,
-        'registered_alerts_count': registered_alerts.count(),
-        'nearby_alerts_count': nearby_alerts.count(),
+        'registered_alerts_count': paginator.count - len(nearby_distances),
+        'nearby_alerts_count': len(nearby_distances),
+        # The page listens to alert_stream only where it can be served
+        'alert_stream': streams_supported(request),
     }
     return render(request, 'emergency/alerts.html', context)
 
 
+def streams_supported(request):
+    """
+    Whether the request is served by an ASGI server. Under WSGI Django reads
+    an async streaming body to the end before sending anything, and an alert
+    stream never ends.
+    """
+    return isinstance(request, ASGIRequest)
+
+
+class AlertEventStream:
+    """
+    Server-Sent Events body for one broker subscription. Closing the
+    response, or the client disconnecting, ends the subscription.
+    """
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+
+    async def __aiter__(self):
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.subscription.get(), STREAM_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: alert\nid: {message['id']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            self.close()
+
+    def close(self):
+        self.subscription.close()
+
+
+@login_required
+@user_passes_test(is_clinic_staff)
+async def alert_stream(request):
+    """
+    Server-Sent Events stream of new and updated alerts for the clinic's
+    feed. Only served under ASGI (safar_saathi.asgi); the WSGI deployment
+    answers 501 Not Implemented and the alerts page does not connect.
+    """
+    if not streams_supported(request):
+        return HttpResponse('Alert streams need an ASGI server.', status=501, content_type='text/plain')
+    user = await request.auser()
+    clinic_id = await sync_to_async(lambda: user.clinicprofile.id)()
+    subscription = broker.get_broker().subscribe(broker.clinic_channel(clinic_id))
+
+    response = StreamingHttpResponse(AlertEventStream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 @user_passes_test(is_clinic_staff)
 def respond_to_emergency(request, alert_id):
@@ -215,6 +258,7 @@ def respond_to_emergency(request, alert_id):
         if resolution_status in ['resolved', 'false_alarm']:
             alert.is_active = False
         alert.save()
+        transaction.on_commit(lambda: feed.publish_alert(alert, 'updated'))
 
         # Auto-create medical data request for out-of-town patients
         if alert.patient.current_clinic != clinic:
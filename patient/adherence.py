@@ -0,0 +1,233 @@
+"""
+Daily medication adherence rollup.
+
+Adherence used to be recomputed by counting MedicationIntake rows through
+reminder -> prescription -> patient for 30 days on every page load.
+DailyAdherence keeps the counts per patient and day instead, plus
+platform-wide rows (patient NULL), so adherence over any window is a sum
+over one row per day.
+
+Signal handlers (patient/signals.py) keep the rows current:
+
+* post_init remembers an intake's reminder, date and has_taken, without
+  touching the database;
+* post_save and post_delete apply the difference, so a save that does not
+  change those fields costs nothing;
+* a reminder that is deactivated or reactivated moves all of its intakes
+  out of or into the counts.
+
+Code that creates intakes with bulk_create must call record_created().
+The rebuild_daily_adherence command recounts everything from the intakes.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import DailyAdherence, MedicationIntake, MedicationReminder, Prescription
+
+ADHERENCE_DAYS = 30
+TREND_DAYS = 14
+
+SNAPSHOT_ATTR = '_adherence_snapshot'
+TRACKED_FIELDS = {'reminder_id', 'intake_date', 'has_taken'}
+
+
+def _date(value):
+    if isinstance(value, datetime):
+        return MedicationIntake._meta.get_field('intake_date').to_python(value)
+    return value
+
+
+def _entry(intake):
+    return intake.reminder_id, _date(intake.intake_date), intake.has_taken
+
+
+def snapshot(intake):
+    """Remember what an intake counts towards; None when unknown (new or partly loaded)"""
+    if intake.pk is None or TRACKED_FIELDS & intake.get_deferred_fields():
+        entry = None
+    else:
+        entry = _entry(intake)
+    setattr(intake, SNAPSHOT_ATTR, entry)
+
+
+def _owners(reminder_ids):
+    """{reminder id: patient id} for the given reminders that are active"""
+    return dict(
+        MedicationReminder.objects.filter(pk__in=reminder_ids, is_active=True)
+        .values_list('pk', 'prescription__patient_id')
+    )
+
+
+def _deltas(added, removed):
+    """{(patient id, date): [scheduled, taken]} for (reminder id, date, has_taken) entries"""
+    owners = _owners({entry[0] for entry in added + removed})
+    deltas = defaultdict(lambda: [0, 0])
+    for entries, sign in ((added, 1), (removed, -1)):
+        for reminder_id, date, has_taken in entries:
+            patient_id = owners.get(reminder_id)
+            if patient_id is None:
+                continue
+            for key in ((patient_id, date), (None, date)):
+                deltas[key][0] += sign
+                deltas[key][1] += sign if has_taken else 0
+    return deltas
+
+
+def apply(deltas):
+    """
+    Add {(patient id or None, date): [scheduled, taken]} to the stored rows:
+    one query to find them, one to update them and one to insert missing
+    rows. Decrements of rows that no longer exist (e.g. removed with their
+    patient) are dropped.
+    """
+    deltas = {key: value for key, value in deltas.items() if any(value)}
+    if not deltas:
+        return
+
+    # A superset of the rows by patient and date, trimmed here: cheaper to
+    # build and run than one condition per (patient, date) pair
+    patient_ids = {patient_id for patient_id, _ in deltas if patient_id is not None}
+    lookup = Q(patient__isnull=True) | Q(patient_id__in=patient_ids) if patient_ids else Q(patient__isnull=True)
+    existing = [
+        row for row in DailyAdherence.objects.filter(lookup, date__in={date for _, date in deltas})
+        if (row.patient_id, row.date) in deltas
+    ]
+    for row in existing:
+        scheduled, taken = deltas.pop((row.patient_id, row.date))
+        row.scheduled = F('scheduled') + scheduled
+        row.taken = F('taken') + taken
+    if existing:
+        DailyAdherence.objects.bulk_update(existing, ['scheduled', 'taken'])
+
+    missing = {key: value for key, value in deltas.items() if value[0] > 0}
+    if missing:
+        try:
+            with transaction.atomic():
+                DailyAdherence.objects.bulk_create([
+                    DailyAdherence(patient_id=patient_id, date=date, scheduled=scheduled, taken=taken)
+                    for (patient_id, date), (scheduled, taken) in missing.items()
+                ])
+        except IntegrityError:
+            # A concurrent writer created some of the rows first
+            for (patient_id, date), (scheduled, taken) in missing.items():
+                row, _ = DailyAdherence.objects.get_or_create(patient_id=patient_id, date=date)
+                DailyAdherence.objects.filter(pk=row.pk).update(
+                    scheduled=F('scheduled') + scheduled, taken=F('taken') + taken)
+
+
+def record_change(intake, created):
+    old = None if created else getattr(intake, SNAPSHOT_ATTR, None)
+    if old is None and not created:
+        # Loaded with deferred fields: read the stored row to diff against
+        stored = MedicationIntake.objects.filter(pk=intake.pk).values_list(
+            'reminder_id', 'intake_date', 'has_taken').first()
+        old = tuple(stored) if stored else None
+    new = _entry(intake)
+    if old != new:
+        apply(_deltas([new], [old] if old else []))
+    setattr(intake, SNAPSHOT_ATTR, new)
+
+
+def record_created(intakes):
+    """Count intakes inserted without signals, e.g. by bulk_create"""
+    entries = [_entry(intake) for intake in intakes]
+    apply(_deltas(entries, []))
+    for intake, entry in zip(intakes, entries):
+        setattr(intake, SNAPSHOT_ATTR, entry)
+
+
+def record_deleted(intake):
+    old = getattr(intake, SNAPSHOT_ATTR, None)
+    if old is not None:
+        apply(_deltas([], [old]))
+
+
+def record_reminder_toggled(reminder):
+    """Move a reminder's intakes into or out of the counts after is_active changed"""
+    patient_id = Prescription.objects.filter(pk=reminder.prescription_id).values_list('patient_id', flat=True).first()
+    if patient_id is None:
+        return
+    sign = 1 if reminder.is_active else -1
+    deltas = defaultdict(lambda: [0, 0])
+    days = (
+        MedicationIntake.objects.filter(reminder=reminder).values('intake_date')
+        .annotate(scheduled=Count('pk'), taken=Count('pk', filter=Q(has_taken=True)))
+    )
+    for day in days:
+        for key in ((patient_id, day['intake_date']), (None, day['intake_date'])):
+            deltas[key][0] += sign * day['scheduled']
+            deltas[key][1] += sign * day['taken']
+    apply(deltas)
+
+
+def expected_rows():
+    """Recount every row from the intakes: {(patient id or None, date): [scheduled, taken]}"""
+    rows = defaultdict(lambda: [0, 0])
+    days = (
+        MedicationIntake.objects.filter(reminder__is_active=True)
+        .values_list('reminder__prescription__patient_id', 'intake_date')
+        .annotate(scheduled=Count('pk'), taken=Count('pk', filter=Q(has_taken=True)))
+        .order_by()
+    )
+    for patient_id, date, scheduled, taken in days:
+        for key in ((patient_id, date), (None, date)):
+            rows[key][0] += scheduled
+            rows[key][1] += taken
+    return rows
+
+
+def rebuild():
+    """Replace the rollup with a full recount; returns the number of rows"""
+    rows = expected_rows()
+    with transaction.atomic():
+        DailyAdherence.objects.all().delete()
+        DailyAdherence.objects.bulk_create([
+            DailyAdherence(patient_id=patient_id, date=date, scheduled=scheduled, taken=taken)
+            for (patient_id, date), (scheduled, taken) in rows.items()
+        ], batch_size=1000)
+    return len(rows)
+
+
+def rate(scheduled, taken, default=100):
+    """Percentage of scheduled doses taken"""
+    return round(taken / scheduled * 100, 2) if scheduled else default
+
+
+def window(today, days=ADHERENCE_DAYS):
+    return today - timedelta(days=days), today
+
+
+def patient_summary(patient, today):
+    """
+    Adherence over the last 30 days and a per-day trend for the last two
+    weeks, from one query over at most 31 rows.
+    """
+    days = dict(
+        (row[0], row[1:]) for row in
+        DailyAdherence.objects.filter(patient=patient, date__range=window(today))
+        .values_list('date', 'scheduled', 'taken')
+    )
+    scheduled = sum(day[0] for day in days.values())
+    taken = sum(day[1] for day in days.values())
+
+    trend = []
+    for offset in range(TREND_DAYS - 1, -1, -1):
+        date = today - timedelta(days=offset)
+        day_scheduled, day_taken = days.get(date, (0, 0))
+        trend.append({
+            'date': date,
+            'scheduled': day_scheduled,
+            'taken': day_taken,
+            'rate': rate(day_scheduled, day_taken, default=None),
+        })
+    return {'percentage': rate(scheduled, taken), 'trend': trend}
+
+
+def platform_totals(today):
+    """Platform-wide {'total', 'taken'} doses over the last 30 days, from the per-day totals"""
+    return DailyAdherence.objects.filter(patient__isnull=True, date__range=window(today)).aggregate(
+        total=Coalesce(Sum('scheduled'), 0), taken=Coalesce(Sum('taken'), 0))
@@ -0,0 +1,259 @@
+"""
+Anomaly detection over health metric readings.
+
+The detect_health_anomalies command scans the readings stored since its
+last run (an id high-water mark kept in AnomalyScan) for the metrics in
+WATCHED, and flags a reading when it
+
+* falls outside the metric's normal range (high severity) or its critical
+  range (critical), or
+* is more than Z_THRESHOLD standard deviations from the patient's own
+  baseline: the mean of their previous BASELINE_READINGS readings of the
+  metric (medium).
+
+A batch is scored for all patients at once. Its readings and the week of
+readings before them are loaded into arrays ordered by patient, metric and
+time, so each series is one contiguous run and the rolling baselines come
+from cumulative sums without a Python loop per reading.
+
+Each patient gets one notification per metric and run, describing the
+most severe reading, however many were flagged; notify.py folds alerts
+for a metric that follow an unread one within its coalesce window into it,
+keeping the most severe message. With emergency alerts
+enabled, critical readings also raise a system_auto EmergencyAlert, unless
+the patient already has an active one.
+"""
+import logging
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from emergency import feed
+from emergency.models import EmergencyAlert
+
+from . import notify
+from .models import AnomalyScan, HealthMetric, Notification, PatientProfile
+
+logger = logging.getLogger(__name__)
+
+# Readings below critical_low or above critical_high are critical, outside
+# low..high abnormal. min_std keeps a very steady baseline from turning
+# small changes into large z-scores.
+Limits = namedtuple('Limits', ['critical_low', 'low', 'high', 'critical_high', 'min_std'])
+
+WATCHED = {
+    'blood_pressure_systolic': Limits(70, 90, 140, 180, 5),
+    'blood_pressure_diastolic': Limits(40, 60, 90, 120, 4),
+    'blood_sugar': Limits(54, 70, 250, 400, 10),
+    'oxygen_saturation': Limits(85, 92, np.inf, np.inf, 1),
+    'heart_rate': Limits(35, 45, 130, 160, 5),
+}
+METRICS = list(WATCHED)
+CODES = {metric_type: code for code, metric_type in enumerate(METRICS)}
+LIMITS = np.array([WATCHED[metric_type] for metric_type in METRICS], dtype=float)
+
+BASELINE_READINGS = 50
+MIN_BASELINE = 10  # Readings needed before z-scores count
+BASELINE_PERIOD = timedelta(days=7)
+Z_THRESHOLD = 4.0
+BATCH_SIZE = 200000
+SCAN_NAME = 'health_metrics'
+
+NORMAL, DEVIATION, ABNORMAL, CRITICAL = range(4)
+
+
+def score(series, codes, values):
+    """
+    (severity, z-score) of every reading. series identifies each reading's
+    (patient, metric) series, whose readings must be contiguous and in time
+    order; codes index METRICS.
+    """
+    n = len(values)
+    index = np.arange(n)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = series[1:] != series[:-1]
+    first = np.maximum.accumulate(np.where(starts, index, 0))
+
+    # Rolling sums over the previous BASELINE_READINGS readings of the same
+    # series, shifted by the series' first value for precision
+    shifted = values - values[first]
+    sums = np.concatenate([[0], np.cumsum(shifted)])
+    squares = np.concatenate([[0], np.cumsum(shifted ** 2)])
+    begin = np.maximum(first, index - BASELINE_READINGS)
+    count = index - begin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sums[index] - sums[begin]) / count
+        variance = (squares[index] - squares[begin]) / count - mean ** 2
+        std = np.maximum(np.sqrt(np.maximum(variance, 0)), LIMITS[codes, 4])
+        z = np.where(count >= MIN_BASELINE, (shifted - mean) / std, 0)
+
+    limits = LIMITS[codes]
+    severity = np.where(np.abs(z) >= Z_THRESHOLD, DEVIATION, NORMAL)
+    severity = np.where((values < limits[:, 1]) | (values > limits[:, 2]), ABNORMAL, severity)
+    severity = np.where((values < limits[:, 0]) | (values > limits[:, 3]), CRITICAL, severity)
+    return severity, z
+
+
+def _batch_end(after_id, batch_size):
+    """Id of the last reading in the next batch after after_id, or None when there is none"""
+    ids = HealthMetric.objects.filter(pk__gt=after_id).order_by('pk').values_list('pk', flat=True)
+    last = list(ids[batch_size - 1:batch_size])
+    if last:
+        return last[0]
+    return HealthMetric.objects.filter(pk__gt=after_id).order_by('-pk').values_list('pk', flat=True).first()
+
+
+def load(after_id, up_to_id):
+    """
+    Arrays (ids, series, codes, values, new) of the watched readings in
+    (after_id, up_to_id] plus the readings before them in their series
+    over BASELINE_PERIOD, ordered by patient, metric and time
+    """
+    new = HealthMetric.objects.filter(pk__gt=after_id, pk__lte=up_to_id, metric_type__in=METRICS)
+    earliest = new.aggregate(earliest=Min('recorded_at'))['earliest']
+    if earliest is None:
+        return None
+    rows = list(
+        HealthMetric.objects.filter(
+            patient_id__in=new.values('patient_id'),
+            metric_type__in=METRICS,
+            recorded_at__gte=earliest - BASELINE_PERIOD,
+        ).order_by('patient_id', 'metric_type', 'recorded_at').values_list('pk', 'patient_id', 'metric_type', 'value')
+    )
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    patients = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    codes = np.fromiter((CODES[row[2]] for row in rows), dtype=np.intp, count=len(rows))
+    values = np.fromiter((row[3] for row in rows), dtype=float, count=len(rows))
+    series = patients * len(METRICS) + codes
+
+    is_new = (ids > after_id) & (ids <= up_to_id)
+    # Drop context of series with nothing new, e.g. another metric of a patient
+    keep = np.isin(series, series[is_new])
+    return ids[keep], series[keep], codes[keep], values[keep], is_new[keep]
+
+
+def findings(ids, series, codes, values, new):
+    """
+    [(metric id, severity, z-score, flagged readings)] with the most severe
+    new reading of each series that has any flagged
+    """
+    severity, z = score(series, codes, values)
+    flagged = np.flatnonzero(new & (severity > NORMAL))
+    if not len(flagged):
+        return []
+    # Most severe first within each series, then the largest deviation
+    order = flagged[np.lexsort((-np.abs(z[flagged]), -severity[flagged], series[flagged]))]
+    _, first, counts = np.unique(series[order], return_index=True, return_counts=True)
+    worst = order[first]
+    return [
+        (int(ids[i]), int(severity[i]), float(z[i]), int(count))
+        for i, count in zip(worst, counts)
+    ]
+
+
+def _reason(metric, severity, z):
+    if severity == CRITICAL:
+        return 'dangerously low' if metric.value < WATCHED[metric.metric_type].low else 'dangerously high'
+    if severity == ABNORMAL:
+        return 'below the normal range' if metric.value < WATCHED[metric.metric_type].low else 'above the normal range'
+    return f"{abs(z):.1f} standard deviations {'below' if z < 0 else 'above'} your recent readings"
+
+
+def _notification(metric, severity, z, count):
+    label = metric.get_metric_type_display()
+    reading = f"{metric.value:g} {metric.unit}".strip()
+    others = f" ({count} unusual readings in all)" if count > 1 else ''
+    return Notification(
+        patient_id=metric.patient_id,
+        notification_type='health_alert',
+        coalesce_key=metric.metric_type,
+        severity=severity,
+        title=f"Unusual {label} reading",
+        message=(f"Your {label} reading of {reading} on {timezone.localtime(metric.recorded_at):%d %b %Y %H:%M}"
+                 f" was {_reason(metric, severity, z)}{others}. Contact your clinic if you feel unwell."),
+    )
+
+
+def _alerts(critical):
+    """system_auto alerts for [(metric, z)] critical readings of patients without an active one"""
+    patient_ids = {metric.patient_id for metric, _ in critical}
+    alerted = set(
+        EmergencyAlert.objects.filter(patient_id__in=patient_ids, alert_type='system_auto', is_active=True)
+        .values_list('patient_id', flat=True)
+    )
+    patients = PatientProfile.objects.in_bulk(patient_ids - alerted)
+    alerts = {}
+    for metric, z in critical:
+        patient = patients.get(metric.patient_id)
+        if patient is None or patient.pk in alerts:
+            continue
+        reading = f"{metric.value:g} {metric.unit}".strip()
+        alerts[patient.pk] = EmergencyAlert(
+            patient=patient,
+            alert_type='system_auto',
+            severity_level='critical',
+            alert_message=(f"Automatic alert: {metric.get_metric_type_display()} reading of {reading} "
+                           f"at {timezone.localtime(metric.recorded_at):%d %b %Y %H:%M}"),
+            location_lat=patient.latitude,
+            location_lng=patient.longitude,
+            location_address=patient.address,
+        )
+    return list(alerts.values())
+
+
+def scan_batch(emergency_alerts=False, batch_size=BATCH_SIZE):
+    """
+    Score the next batch of readings after the high-water mark and notify
+    the patients with anomalies. Returns a summary dict, or None when there
+    is nothing new.
+    """
+    with transaction.atomic():
+        scan, _ = AnomalyScan.objects.select_for_update().get_or_create(name=SCAN_NAME)
+        up_to_id = _batch_end(scan.last_metric_id, batch_size)
+        if up_to_id is None:
+            return None
+
+        loaded = load(scan.last_metric_id, up_to_id)
+        found = findings(*loaded) if loaded else []
+        metrics = HealthMetric.objects.in_bulk([metric_id for metric_id, *_ in found])
+
+        notifications = [
+            _notification(metrics[metric_id], severity, z, count) for metric_id, severity, z, count in found
+        ]
+        notifications = notify.send_many(notifications)
+
+        alerts = []
+        if emergency_alerts:
+            critical = [(metrics[metric_id], z) for metric_id, severity, z, _ in found if severity == CRITICAL]
+            alerts = EmergencyAlert.objects.bulk_create(_alerts(critical)) if critical else []
+
+        summary = {
+            'from_id': scan.last_metric_id + 1,
+            'to_id': up_to_id,
+            'scanned': int(loaded[4].sum()) if loaded else 0,
+            'flagged': sum(count for *_, count in found),
+            'notifications': len(notifications),
+            'alerts': len(alerts),
+        }
+        scan.last_metric_id = up_to_id
+        scan.save(update_fields=['last_metric_id', 'updated_at'])
+
+        for alert in alerts:
+            transaction.on_commit(lambda alert=alert: feed.publish_alert(alert, 'created'))
+    if alerts:
+        logger.warning(f"Raised {len(alerts)} automatic emergency alerts for health metric readings")
+    return summary
+
+
+def scan(emergency_alerts=False, batch_size=BATCH_SIZE):
+    """Scan every reading stored since the last run; returns the batch summaries"""
+    summaries = []
+    while True:
+        summary = scan_batch(emergency_alerts, batch_size)
+        if summary is None:
+            return summaries
+        summaries.append(summary)
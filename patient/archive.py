@@ -0,0 +1,198 @@
+"""
+Cold archive of old device health metric readings.
+
+Wearables sync a reading every few seconds or minutes, so HealthMetric
+grows faster than every other table, while readings older than a few
+months are only ever read back as chart series. The
+archive_health_metrics command moves device readings older than
+HEALTH_METRIC_ARCHIVE_AGE out of the table into column files, one
+directory per patient and metric:
+
+    <HEALTH_METRIC_ARCHIVE_DIR>/<patient id>/<metric_type>/
+        manifest.json                  segments and the range each covers
+        <first ms>-<last ms>.t.npy     int64 timestamps, ms since the epoch
+        <first ms>-<last ms>.v.npy     float32 values
+
+Each archive run adds a segment of sorted readings. Segments are plain .npy
+arrays, so readers np.load() them memory-mapped and binary search the
+timestamps for the requested range instead of reading whole files. A
+reading takes 12 bytes instead of a table row plus its index entry; the
+arrays are not compressed further, since compressed files cannot be
+memory-mapped.
+
+Only readings with source 'device' and no notes are archived: the file
+keeps a timestamp and a value and nothing else. Manual and clinic entries
+stay in the table.
+
+timeseries.py merges the archive into the chart series, so the archive is
+invisible to the API. A reading that is in both (between a segment being
+written and its rows being deleted, or a device resending old samples) is
+shown once in raw series; the next archive run drops the table copy.
+"""
+import json
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from admin_app import rollup
+
+from .models import HealthMetric
+
+ARCHIVABLE = Q(source='device', notes='')
+CHUNK_ROWS = 200000  # Most readings in one segment
+DELETE_BATCH = 500
+VALUE_DTYPE = np.float32
+VALUE_DECIMALS = 4  # float32 keeps about 7 significant digits
+
+
+def root():
+    return settings.HEALTH_METRIC_ARCHIVE_DIR
+
+
+def cutoff(now=None, age=None):
+    """Readings recorded before this are archived"""
+    return (now or timezone.now()) - (age or settings.HEALTH_METRIC_ARCHIVE_AGE)
+
+
+def _directory(patient_id, metric_type):
+    return os.path.join(root(), str(patient_id), metric_type)
+
+
+def _milliseconds(moment):
+    return int(moment.timestamp() * 1000)
+
+
+def segments(patient_id, metric_type):
+    """[{'name', 'start', 'end', 'count'}] of a patient's archived metric, oldest first"""
+    try:
+        with open(os.path.join(_directory(patient_id, metric_type), 'manifest.json')) as f:
+            return json.load(f)['segments']
+    except FileNotFoundError:
+        return []
+
+
+def archived_series():
+    """(patient id, metric_type) of every series with archived readings"""
+    try:
+        patients = os.listdir(root())
+    except FileNotFoundError:
+        return []
+    return [
+        (int(patient_id), metric_type)
+        for patient_id in patients if patient_id.isdigit()
+        for metric_type in os.listdir(os.path.join(root(), patient_id))
+        if os.path.exists(os.path.join(root(), patient_id, metric_type, 'manifest.json'))
+    ]
+
+
+def _write_atomic(path, write):
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def _load(directory, segment, column):
+    return np.load(os.path.join(directory, f"{segment['name']}.{column}.npy"), mmap_mode='r')
+
+
+def load_range(patient_id, metric_type, start_ms, end_ms):
+    """(timestamps in ms, values) of the archived readings in [start_ms, end_ms], oldest first"""
+    directory = _directory(patient_id, metric_type)
+    times, values = [], []
+    for segment in segments(patient_id, metric_type):
+        if segment['end'] < start_ms or segment['start'] > end_ms:
+            continue
+        segment_times = _load(directory, segment, 't')
+        first = np.searchsorted(segment_times, start_ms, side='left')
+        last = np.searchsorted(segment_times, end_ms, side='right')
+        times.append(np.array(segment_times[first:last]))
+        values.append(np.array(_load(directory, segment, 'v')[first:last], dtype=float))
+
+    if not times:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    multiple = len(times) > 1
+    times, values = np.concatenate(times), np.concatenate(values).round(VALUE_DECIMALS)
+    if multiple:
+        # Segments may overlap in time (see archive())
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+    return times, values
+
+
+def _write_segment(patient_id, metric_type, times, values):
+    directory = _directory(patient_id, metric_type)
+    os.makedirs(directory, exist_ok=True)
+    segment = {'name': f'{times[0]}-{times[-1]}', 'start': int(times[0]), 'end': int(times[-1]),
+               'count': len(times)}
+    for column, array in (('t', times), ('v', values.astype(VALUE_DTYPE))):
+        _write_atomic(os.path.join(directory, f"{segment['name']}.{column}.npy"), lambda f: np.save(f, array))
+
+    # Readers only see the segment once it is in the manifest
+    manifest = [existing for existing in segments(patient_id, metric_type) if existing['name'] != segment['name']]
+    manifest = sorted(manifest + [segment], key=lambda s: (s['start'], s['end']))
+    _write_atomic(os.path.join(directory, 'manifest.json'),
+                  lambda f: f.write(json.dumps({'segments': manifest}, indent=1).encode()))
+    return segment
+
+
+def candidates(before):
+    """(patient id, metric_type) pairs with readings to archive"""
+    return list(
+        HealthMetric.objects.filter(ARCHIVABLE, recorded_at__lt=before)
+        .values_list('patient_id', 'metric_type').distinct().order_by('patient_id', 'metric_type')
+    )
+
+
+def _delete(ids, days):
+    """Delete archived rows by id, without loading instances, and uncount them"""
+    table = connection.ops.quote_name(HealthMetric._meta.db_table)
+    pk = connection.ops.quote_name(HealthMetric._meta.pk.column)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for i in range(0, len(ids), DELETE_BATCH):
+                batch = ids[i:i + DELETE_BATCH]
+                cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({', '.join(['%s'] * len(batch))})", batch)
+        rollup.record_values(HealthMetric, [(SimpleNamespace(recorded_at=day), -rows) for day, rows in days.items()])
+
+
+def archive(patient_id, metric_type, before, dry_run=False):
+    """
+    Move one patient's device readings of a metric recorded before
+    `before` into the archive, CHUNK_ROWS at a time. Returns the number of
+    readings moved out of the table.
+    """
+    moved = 0
+    tz = timezone.get_current_timezone()
+    rows = HealthMetric.objects.filter(
+        ARCHIVABLE, patient_id=patient_id, metric_type=metric_type, recorded_at__lt=before
+    ).order_by('recorded_at').values_list('id', 'recorded_at', 'value')
+    if dry_run:
+        return rows.count()
+    while True:
+        chunk = list(rows[:CHUNK_ROWS])
+        if not chunk:
+            return moved
+
+        ids = [row[0] for row in chunk]
+        times = np.fromiter((_milliseconds(row[1]) for row in chunk), dtype=np.int64, count=len(chunk))
+        values = np.fromiter((row[2] for row in chunk), dtype=float, count=len(chunk))
+        # Rows left behind by an interrupted run are already in a segment
+        archived, _ = load_range(patient_id, metric_type, int(times[0]), int(times[-1]))
+        new = ~np.isin(times, archived)
+        if new.any():
+            _write_segment(patient_id, metric_type, times[new], values[new])
+
+        days = Counter(row[1].astimezone(tz).date() for row in chunk)
+        _delete(ids, days)
+        moved += len(chunk)
+        if len(chunk) < CHUNK_ROWS:
+            return moved
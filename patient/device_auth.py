@@ -0,0 +1,58 @@
+"""
+API key authentication for device uploads.
+
+Devices and scripts that post health metrics (views.ingest_health_metrics)
+have no browser session and cannot send a CSRF token. They authenticate
+with a DeviceToken instead, sent as
+
+    Authorization: Token <key>
+
+The issue_device_token command creates a key and prints it once; only its
+SHA-256 digest is stored, so a leaked database does not leak usable keys.
+Requests without the header fall back to the patient's session, and those
+still go through the CSRF check.
+"""
+import hashlib
+import secrets
+
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils import timezone
+
+from .models import DeviceToken
+
+SCHEME = 'token'
+
+
+def digest(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue(patient, name):
+    """Create a token for a patient's device; returns (token, key). The key cannot be recovered later."""
+    key = secrets.token_urlsafe(32)
+    token = DeviceToken.objects.create(patient=patient, name=name, key_digest=digest(key))
+    return token, key
+
+
+def presented_key(request):
+    """The key of an 'Authorization: Token <key>' header, '' for an empty one, or None without one"""
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    return key.strip() if scheme.lower() == SCHEME else None
+
+
+def authenticate(key):
+    """The patient an active token belongs to, or None"""
+    if not key:
+        return None
+    token = DeviceToken.objects.filter(key_digest=digest(key), is_active=True).select_related('patient__user').first()
+    if token is None:
+        return None
+    DeviceToken.objects.filter(pk=token.pk).update(last_used_at=timezone.now())
+    return token.patient
+
+
+def csrf_failure(request):
+    """The 403 response for a session request failing the CSRF check, or None when it passes"""
+    check = CsrfViewMiddleware(lambda request: None)
+    check.process_request(request)
+    return check.process_view(request, None, (), {})
@@ -0,0 +1,167 @@
+"""
+Delivery of scheduled notifications.
+
+A notification with scheduled_at stays hidden from the patient until the
+dispatcher delivers it (see Notification.DELIVERED). The
+dispatch_notifications command, run from cron or as a worker with --loop,
+drains the due notifications in batches:
+
+1. claim: pick up to a batch of due, unclaimed notifications from the
+   notification_due_idx partial index and stamp them with a random claim
+   token and a lease (claimed_until) in one conditional UPDATE. A row
+   another worker claimed first no longer matches, so every row is
+   claimed by one worker; on databases with SKIP LOCKED the candidates are
+   also locked so concurrent workers pick different rows;
+2. run the NOTIFICATION_DELIVERY_HANDLERS (dotted paths to callables
+   taking the list of notifications, e.g. to send e-mail or push), outside
+   any transaction;
+3. complete: set delivered_at on the rows still holding the token, in
+   one transaction with the platform statistics.
+
+A worker that dies between 1 and 3 leaves its rows claimed until the
+lease runs out; then another worker claims them again. Notifications are
+therefore shown exactly once, while handlers may see a notification again
+after a crash and must tolerate that.
+
+Throughput and lag counters are kept in the cache; see stats() and the
+notification_dispatch_stats command. They add up the workers' figures only
+with a shared cache backend (CACHE_REDIS_URL in settings).
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from admin_app import rollup
+
+from . import unread
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+COUNTERS = ('batches', 'delivered', 'released', 'lag_ms', 'busy_ms')
+
+
+def lease():
+    return timedelta(seconds=getattr(settings, 'NOTIFICATION_DISPATCH_LEASE_SECONDS', 60))
+
+
+def due(now):
+    """Scheduled notifications waiting for delivery at `now`"""
+    return Notification.objects.filter(delivered_at__isnull=True, scheduled_at__lte=now)
+
+
+def _unclaimed(now):
+    return Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)
+
+
+def claim(batch_size=BATCH_SIZE, now=None):
+    """Claim a batch of due notifications; returns (token, notifications)"""
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        candidates = due(now).filter(_unclaimed(now)).order_by('scheduled_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return token, []
+        # Re-checked by the UPDATE: rows claimed meanwhile are left alone
+        due(now).filter(_unclaimed(now), pk__in=ids).update(claim_token=token, claimed_until=now + lease())
+    return token, list(Notification.objects.filter(claim_token=token).order_by('scheduled_at', 'pk'))
+
+
+def handlers():
+    return [import_string(path) for path in getattr(settings, 'NOTIFICATION_DELIVERY_HANDLERS', [])]
+
+
+def complete(token, now=None):
+    """Mark the notifications still claimed with token as delivered; returns how many were"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        claimed = Notification.objects.filter(claim_token=token, delivered_at__isnull=True)
+        by_patient = dict(claimed.filter(is_read=False).values_list('patient_id').annotate(Count('pk')).order_by())
+        delivered = claimed.update(delivered_at=now, claim_token='', claimed_until=None)
+        # Delivered unread notifications start counting as unread
+        rollup.adjust('notifications', 'unread', sum(by_patient.values()))
+        for patient_id, count in by_patient.items():
+            unread.adjust(patient_id, count)
+    return delivered
+
+
+def release(token):
+    """Give claimed notifications back to the queue, e.g. after a handler failed"""
+    return Notification.objects.filter(claim_token=token, delivered_at__isnull=True).update(
+        claim_token='', claimed_until=None)
+
+
+def dispatch_batch(batch_size=BATCH_SIZE):
+    """Claim, hand over and deliver one batch. Returns the number delivered."""
+    started = time.perf_counter()
+    token, notifications = claim(batch_size)
+    if not notifications:
+        return 0
+
+    try:
+        for handler in handlers():
+            handler(notifications)
+    except Exception as e:
+        logger.error(f"Notification delivery handler failed for {len(notifications)} notifications: {str(e)}",
+                     exc_info=True)
+        _count(released=release(token))
+        return 0
+
+    now = timezone.now()
+    delivered = complete(token, now)
+    lag = sum((now - notification.scheduled_at).total_seconds() for notification in notifications) / len(notifications)
+    _count(batches=1, delivered=delivered, lag_ms=int(lag * delivered * 1000),
+           busy_ms=int((time.perf_counter() - started) * 1000))
+    return delivered
+
+
+def _key(name):
+    return f"notification-dispatch:{name}"
+
+
+def _count(**counts):
+    for name, value in counts.items():
+        if not value:
+            continue
+        try:
+            cache.incr(_key(name), value)
+        except ValueError:
+            if not cache.add(_key(name), value, None):
+                cache.incr(_key(name), value)
+
+
+def stats(now=None):
+    """
+    Dispatcher counters since the last reset (delivered, average lag behind
+    scheduled_at, throughput while busy) and the current queue (due
+    notifications and how late the oldest is)
+    """
+    now = now or timezone.now()
+    counters = cache.get_many([_key(name) for name in COUNTERS])
+    values = {name: counters.get(_key(name), 0) for name in COUNTERS}
+    queue = due(now).aggregate(due=Count('pk'), oldest=Min('scheduled_at'))
+    return {
+        'batches': values['batches'],
+        'delivered': values['delivered'],
+        'released': values['released'],
+        'average_lag_seconds': round(values['lag_ms'] / values['delivered'] / 1000, 3) if values['delivered'] else None,
+        'throughput_per_second': round(values['delivered'] / values['busy_ms'] * 1000, 1) if values['busy_ms'] else None,
+        'due': queue['due'],
+        'oldest_due_lag_seconds': round((now - queue['oldest']).total_seconds(), 3) if queue['oldest'] else None,
+    }
+
+
+def reset_stats():
+    cache.delete_many([_key(name) for name in COUNTERS])
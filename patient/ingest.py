@@ -0,0 +1,305 @@
+"""
+Bulk ingestion of health metric readings from wearable devices.
+
+A device sync posts its samples as one stream, either NDJSON:
+
+    {"metric_type": "heart_rate", "recorded_at": "2026-01-01T08:00:00Z", "value": 72, "unit": "bpm"}
+
+or compact CSV with a header row naming the columns it carries:
+
+    recorded_at,value
+    1767254400,72
+
+Columns missing from the rows (metric_type, unit) can be given once as
+request parameters instead. recorded_at is an ISO 8601 datetime or a Unix
+timestamp in seconds or milliseconds.
+
+The stream is read line by line and handled in batches. Each batch is
+validated, deduplicated on (patient, metric_type, recorded_at) against
+itself and the stored readings with one query, and inserted with one
+executemany() in its own transaction. Rows a concurrent sync stored first
+are skipped, and only the rows written are counted in the platform
+statistics and metric summaries. A bad row is rejected on its own and does
+not fail its batch.
+"""
+import csv
+import json
+import math
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from admin_app import rollup
+
+from . import metric_summaries
+from .models import HealthMetric
+
+BATCH_SIZE = 5000
+MAX_ERRORS = 20  # rejected rows described per request
+METRIC_TYPES = frozenset(dict(HealthMetric.METRIC_TYPES))
+FORMATS = ('ndjson', 'csv')
+INSERT_FIELDS = ['patient', 'metric_type', 'value', 'unit', 'recorded_at', 'source', 'notes']
+# Readings stamped further ahead than this are rejected as clock errors
+MAX_CLOCK_SKEW = timedelta(days=1)
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(content_type, requested=None):
+    """'ndjson' or 'csv' from an explicit format parameter or the Content-Type, else None"""
+    if requested:
+        return requested if requested in FORMATS else None
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in ('application/x-ndjson', 'application/jsonl', 'application/json'):
+        return 'ndjson'
+    if content_type in ('text/csv', 'application/csv'):
+        return 'csv'
+    return None
+
+
+def parse_timestamp(raw):
+    """Aware datetime from an ISO 8601 string or Unix seconds/milliseconds"""
+    if isinstance(raw, str):
+        try:
+            raw = float(raw)
+        except ValueError:
+            try:
+                moment = datetime.fromisoformat(raw)
+            except ValueError:
+                raise RowError(f'invalid recorded_at {raw!r}')
+            if timezone.is_naive(moment):
+                moment = timezone.make_aware(moment)
+            return moment.astimezone(dt_timezone.utc)
+    if isinstance(raw, bool) or not isinstance(raw, (int, float)) or not math.isfinite(raw):
+        raise RowError(f'invalid recorded_at {raw!r}')
+    if abs(raw) > 1e11:  # Milliseconds
+        raw /= 1000
+    try:
+        return datetime.fromtimestamp(raw, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise RowError(f'invalid recorded_at {raw!r}')
+
+
+def _row(fields, defaults):
+    """(metric_type, recorded_at, value, unit) from a parsed NDJSON object or CSV record"""
+    metric_type = fields.get('metric_type') or defaults.get('metric_type')
+    if metric_type not in METRIC_TYPES:
+        raise RowError(f'unknown metric_type {metric_type!r}')
+    if fields.get('recorded_at') in (None, ''):
+        raise RowError('recorded_at is required')
+    recorded_at = parse_timestamp(fields['recorded_at'])
+    try:
+        value = float(fields['value'])
+    except (KeyError, TypeError, ValueError):
+        raise RowError(f"invalid value {fields.get('value')!r}")
+    if not math.isfinite(value):
+        raise RowError(f'invalid value {value!r}')
+    unit = str(fields.get('unit') or defaults.get('unit') or '')[:20]
+    return metric_type, recorded_at, value, unit
+
+
+def _ndjson_records(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            fields = json.loads(line)
+        except ValueError:
+            yield number, RowError('invalid JSON')
+            continue
+        yield number, fields if isinstance(fields, dict) else RowError('expected a JSON object')
+
+
+def _csv_records(lines):
+    reader = csv.reader(lines)
+    header = next((record for record in reader if record), None)
+    header = [column.strip() for column in header or []]
+    if not {'recorded_at', 'value'} <= set(header):
+        yield reader.line_num, RowError('CSV header must name recorded_at and value columns')
+        return
+    for record in reader:
+        if not record:
+            continue
+        if len(record) != len(header):
+            yield reader.line_num, RowError(f'expected {len(header)} columns')
+        else:
+            yield reader.line_num, dict(zip(header, record))
+
+
+def parse_rows(lines, fmt, defaults):
+    """
+    Yield (line number, row) for every record in the stream; row is a
+    (metric_type, recorded_at, value, unit) tuple, or the RowError that
+    rejected it.
+    """
+    lines = (line.decode('utf-8', 'replace') if isinstance(line, bytes) else line for line in lines)
+    records = _ndjson_records(lines) if fmt == 'ndjson' else _csv_records(lines)
+    for number, fields in records:
+        if isinstance(fields, RowError):
+            yield number, fields
+            continue
+        try:
+            yield number, _row(fields, defaults)
+        except RowError as e:
+            yield number, e
+
+
+def _insert_sql(fields, rows=1, returning=()):
+    """
+    INSERT of `rows` rows that skips rows violating a unique constraint, for
+    the current backend, optionally returning columns of the rows it wrote
+    """
+    ops = connection.ops
+    columns = ', '.join(ops.quote_name(field.column) for field in fields)
+    placeholders = ', '.join([f"({', '.join(['%s'] * len(fields))})"] * rows)
+    suffix = ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)
+    sql = (f'{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {ops.quote_name(HealthMetric._meta.db_table)} '
+           f'({columns}) VALUES {placeholders} {suffix}')
+    if returning:
+        sql += f" RETURNING {', '.join(ops.quote_name(field.column) for field in returning)}"
+    return sql
+
+
+def _stored_time(value):
+    """A recorded_at value read back from the database, as an aware datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    # Naive values are stored in UTC
+    return value if timezone.is_aware(value) else value.replace(tzinfo=dt_timezone.utc)
+
+
+def _insert(fields, keys, params):
+    """
+    Insert rows, skipping the ones a concurrent writer stored first; keys
+    are the (metric_type, recorded_at) of params. Returns the keys of the
+    rows actually written.
+    """
+    with connection.cursor() as cursor:
+        # Normally every row is written, which one executemany() shows
+        # cheapest. Otherwise it is undone and the rows are written again in
+        # a way that tells which ones went in.
+        sid = transaction.savepoint()
+        cursor.executemany(_insert_sql(fields), params)
+        if cursor.rowcount == len(params):
+            transaction.savepoint_commit(sid)
+            return keys
+        transaction.savepoint_rollback(sid)
+
+        written = []
+        if not connection.features.can_return_rows_from_bulk_insert:
+            for key, row in zip(keys, params):
+                cursor.execute(_insert_sql(fields), row)
+                if cursor.rowcount:
+                    written.append(key)
+            return written
+
+        # Multi-row statements returning the keys of the rows they wrote
+        returning = [HealthMetric._meta.get_field('metric_type'), HealthMetric._meta.get_field('recorded_at')]
+        size = connection.ops.bulk_batch_size(fields, params)
+        for start in range(0, len(params), size):
+            chunk = params[start:start + size]
+            cursor.execute(_insert_sql(fields, len(chunk), returning), [value for row in chunk for value in row])
+            written.extend((metric_type, _stored_time(recorded_at)) for metric_type, recorded_at in cursor.fetchall())
+    return written
+
+
+def store_batch(patient, rows, source='device'):
+    """
+    Insert new (metric_type, recorded_at, value, unit) rows for a patient.
+    Returns (accepted, duplicates).
+
+    Rows go straight to one executemany() instead of through model
+    instances and bulk_create, which spend most of their time building and
+    compiling objects a batch never needs.
+    """
+    unique = {}
+    for metric_type, recorded_at, value, unit in rows:
+        unique.setdefault((metric_type, recorded_at), (value, unit))
+    duplicates = len(rows) - len(unique)
+    if not unique:
+        return 0, duplicates
+
+    times = [recorded_at for _, recorded_at in unique]
+    stored = set(
+        HealthMetric.objects.filter(
+            patient=patient,
+            metric_type__in={metric_type for metric_type, _ in unique},
+            recorded_at__range=(min(times), max(times)),
+        ).values_list('metric_type', 'recorded_at')
+    )
+    new = [key for key in unique if key not in stored]
+    duplicates += len(unique) - len(new)
+    if not new:
+        return 0, duplicates
+
+    fields = [HealthMetric._meta.get_field(name) for name in INSERT_FIELDS]
+    adapt = connection.ops.adapt_datetimefield_value
+    params = [
+        (patient.pk, metric_type, unique[metric_type, recorded_at][0], unique[metric_type, recorded_at][1],
+         adapt(recorded_at), source, '')
+        for metric_type, recorded_at in new
+    ]
+    with transaction.atomic():
+        # A concurrent sync of the same samples loses on the unique
+        # constraint; those rows are its to count
+        inserted = _insert(fields, new, params)
+        # Nothing sends signals here; count the readings written in the
+        # platform statistics, which only look at the local day of
+        # recorded_at, and in the patient's metric summaries
+        tz = timezone.get_current_timezone()
+        days = Counter(recorded_at.astimezone(tz).date() for _, recorded_at in inserted)
+        rollup.record_values(HealthMetric, [(SimpleNamespace(recorded_at=day), rows) for day, rows in days.items()])
+        metric_summaries.record(patient.pk, [
+            (metric_type, recorded_at, *unique[metric_type, recorded_at]) for metric_type, recorded_at in inserted
+        ])
+    return len(inserted), duplicates + len(params) - len(inserted)
+
+
+def ingest(patient, lines, fmt, defaults=None, batch_size=BATCH_SIZE, max_rows=None):
+    """
+    Validate and store a stream of readings in batches. Returns a report
+    dict with totals, per-batch counts and the first rejected rows.
+    """
+    defaults = defaults or {}
+    max_rows = max_rows or getattr(settings, 'HEALTH_METRIC_INGEST_MAX_ROWS', 500000)
+    latest = timezone.now() + MAX_CLOCK_SKEW
+    report = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'truncated': False, 'batches': [], 'errors': []}
+
+    parsed = parse_rows(lines, fmt, defaults)
+    seen = 0
+    while True:
+        batch = list(islice(parsed, min(batch_size, max_rows - seen)))
+        if not batch:
+            if seen >= max_rows and next(parsed, None) is not None:
+                report['truncated'] = True
+            break
+        seen += len(batch)
+
+        rows, rejected = [], 0
+        for number, row in batch:
+            if not isinstance(row, RowError) and row[1] > latest:
+                row = RowError('recorded_at is in the future')
+            if isinstance(row, RowError):
+                rejected += 1
+                if len(report['errors']) < MAX_ERRORS:
+                    report['errors'].append({'line': number, 'error': str(row)})
+            else:
+                rows.append(row)
+
+        accepted, duplicates = store_batch(patient, rows)
+        report['batches'].append({
+            'rows': len(batch), 'accepted': accepted, 'duplicates': duplicates, 'rejected': rejected,
+        })
+        report['accepted'] += accepted
+        report['duplicates'] += duplicates
+        report['rejected'] += rejected
+    return report
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from patient import archive
+
+
+class Command(BaseCommand):
+    help = ('Move device health metric readings older than HEALTH_METRIC_ARCHIVE_AGE '
+            'from the database to the cold archive')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            help='Archive readings older than this many days instead')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the readings that would move')
+
+    def handle(self, *args, **options):
+        days = options['older_than_days']
+        before = archive.cutoff(age=timedelta(days=days) if days is not None else None)
+
+        total = 0
+        for patient_id, metric_type in archive.candidates(before):
+            moved = archive.archive(patient_id, metric_type, before, dry_run=options['dry_run'])
+            total += moved
+            self.stdout.write(f'Patient {patient_id} {metric_type}: {moved} readings')
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {total} readings recorded before {before:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import benchmarking
+from patient import anomaly, ingest
+from patient.models import AnomalyScan, HealthMetric
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the health metric anomaly scan over generated readings. ' + benchmarking.ROLLED_BACK
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--readings', type=int, default=250, help='Readings per patient and metric')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        patients, readings = options['patients'], options['readings']
+        metrics = ['blood_pressure_systolic', 'blood_pressure_diastolic', 'blood_sugar', 'oxygen_saturation']
+        baselines = {'blood_pressure_systolic': (120, 6), 'blood_pressure_diastolic': (80, 4),
+                     'blood_sugar': (110, 12), 'oxygen_saturation': (97, 1)}
+
+        with transaction.atomic():
+            profiles = benchmarking.make_patients('anomaly', patients)
+            start = timezone.now() - timedelta(days=3)
+            times = [start + timedelta(minutes=15 * i) for i in range(readings)]
+            begin = time.perf_counter()
+            for profile in profiles:
+                rows = []
+                for metric_type in metrics:
+                    mean, std = baselines[metric_type]
+                    values = np.round(rng.normal(mean, std, readings), 1)
+                    rows.extend((metric_type, moment, float(value), '') for moment, value in zip(times, values))
+                ingest.store_batch(profile, rows)
+            total = HealthMetric.objects.filter(patient__in=profiles).count()
+            self.stdout.write(f'Stored {total} readings in {time.perf_counter() - begin:.1f}s')
+
+            # Only the generated readings are new
+            first = HealthMetric.objects.filter(patient__in=profiles).order_by('pk').values_list('pk', flat=True)[0]
+            AnomalyScan.objects.update_or_create(name=anomaly.SCAN_NAME, defaults={'last_metric_id': first - 1})
+
+            begin = time.perf_counter()
+            up_to = HealthMetric.objects.latest('pk').pk
+            loaded = anomaly.load(first - 1, up_to)
+            loaded_at = time.perf_counter()
+            found = anomaly.findings(*loaded)
+            scored_at = time.perf_counter()
+            summaries = anomaly.scan(batch_size=total)
+            done = time.perf_counter()
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'load {loaded_at - begin:.2f}s, score {scored_at - loaded_at:.3f}s '
+            f'({len(loaded[0]) / (scored_at - loaded_at):,.0f} readings/s), {len(found)} series flagged; '
+            f'full scan with notifications {done - scored_at:.2f}s over {sum(s["scanned"] for s in summaries)} readings'
+        )
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import benchmarking
+from patient import schedule
+from patient.models import MedicationIntake, MedicationReminder, Prescription
+
+FREQUENCIES = ['once daily', 'twice daily', 'tds', 'every 6 hours', 'every other day', 'at bedtime']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark materializing medication intakes for generated reminders. ' + benchmarking.ROLLED_BACK
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patients', type=int, default=2000)
+        parser.add_argument('--reminders', type=int, default=3, help='Reminders per patient')
+        parser.add_argument('--days', type=int, default=schedule.HORIZON_DAYS)
+
+    def handle(self, *args, **options):
+        patients, per_patient, days = options['patients'], options['reminders'], options['days']
+        today = timezone.localdate()
+
+        with transaction.atomic():
+            doctor, clinic = benchmarking.make_clinic('schedule')
+            profiles = benchmarking.make_patients('schedule', patients)
+            prescriptions = Prescription.objects.bulk_create([
+                Prescription(patient=profile, clinic=clinic, doctor=doctor, diagnosis='Benchmark')
+                for profile in profiles
+            ])
+            MedicationReminder.objects.bulk_create([
+                MedicationReminder(prescription=prescription, medication_name=f'Drug {i}', dosage='1 tablet',
+                                   frequency=FREQUENCIES[(n + i) % len(FREQUENCIES)],
+                                   start_date=today - timedelta(days=i))
+                for n, prescription in enumerate(prescriptions) for i in range(per_patient)
+            ], batch_size=1000)
+            reminders = MedicationReminder.objects.filter(prescription__in=prescriptions).select_related('prescription')
+
+            self.stdout.write(f"{'run':>10} {'reminders':>10} {'created':>9} {'seconds':>8} {'reminders/s':>12}")
+            for label, day in [('first', today), ('again', today), ('next day', today + timedelta(days=1))]:
+                begin = time.perf_counter()
+                summary = schedule.materialize(today=day, days=days, reminders=reminders.iterator(chunk_size=1000))
+                seconds = time.perf_counter() - begin
+                self.stdout.write(f"{label:>10} {summary['reminders']:>10} {summary['created']:>9} "
+                                  f"{seconds:>8.2f} {summary['reminders'] / seconds:>12.0f}")
+            total = MedicationIntake.objects.filter(reminder__prescription__in=prescriptions).count()
+            self.stdout.write(f'{total} intakes stored')
+            transaction.set_rollback(True)
@@ -0,0 +1,51 @@
+import json
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core import benchmarking
+from patient import ingest
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bulk health metric ingestion from NDJSON and CSV streams. ' + benchmarking.ROLLED_BACK
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Samples per stream')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        rows = options['rows']
+        start = 1767225600  # 2026-01-01T00:00:00Z
+        times = start + np.arange(rows)  # One sample a second
+        values = np.round(rng.normal(72, 8, rows), 1)
+
+        streams = {
+            'ndjson': [
+                json.dumps({'metric_type': 'heart_rate', 'recorded_at': int(t), 'value': float(v)})
+                for t, v in zip(times, values)
+            ],
+            'csv': ['recorded_at,value'] + [f'{t},{v}' for t, v in zip(times, values)],
+        }
+
+        self.stdout.write(f"{'format':>8} {'rows':>9} {'seconds':>8} {'rows/s':>9} {'resend rows/s':>14}")
+        for fmt, lines in streams.items():
+            with transaction.atomic():
+                patient = benchmarking.make_patient(f'ingest-{fmt}')
+                defaults = {'metric_type': 'heart_rate'}
+
+                begin = time.perf_counter()
+                report = ingest.ingest(patient, iter(lines), fmt, defaults, max_rows=rows)
+                seconds = time.perf_counter() - begin
+                # The same stream again: everything is a duplicate
+                begin = time.perf_counter()
+                ingest.ingest(patient, iter(lines), fmt, defaults, max_rows=rows)
+                resend_seconds = time.perf_counter() - begin
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{fmt:>8} {report['accepted']:>9} {seconds:>8.2f} {rows / seconds:>9.0f} {rows / resend_seconds:>14.0f}"
+            )
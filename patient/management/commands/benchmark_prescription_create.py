@@ -0,0 +1,74 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import benchmarking
+from patient import prescriptions, schedule
+from patient.models import MedicationIntake, MedicationReminder, Prescription
+
+FREQUENCIES = ['once daily', 'twice daily', 'tds', 'every 6 hours', 'every other day', 'at bedtime']
+
+
+class Command(BaseCommand):
+    help = ('Benchmark writing prescriptions with many drugs, one row at a time and with '
+            'prescriptions.create(). ' + benchmarking.ROLLED_BACK)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prescriptions', type=int, default=50)
+        parser.add_argument('--drugs', type=int, default=40, help='Medications per prescription')
+        parser.add_argument('--days', type=int, default=schedule.HORIZON_DAYS)
+
+    def row_by_row(self, patient, clinic, doctor, plan, days, today):
+        """The writes add_treatment_record used to make, over the same horizon"""
+        prescription = Prescription.objects.create(
+            patient=patient, clinic=clinic, doctor=doctor, diagnosis=plan.diagnosis,
+            medications=[{'name': medication.name, 'dosage': medication.dosage} for medication in plan.medications],
+        )
+        for medication in plan.medications:
+            reminder = MedicationReminder.objects.create(
+                prescription=prescription, medication_name=medication.name, dosage=medication.dosage,
+                frequency=medication.frequency, start_date=plan.start_date, end_date=plan.end_date,
+            )
+            rule = schedule.rule_for(reminder)
+            for day, moment in schedule.occurrences(rule, plan.start_date, plan.end_date, today,
+                                                    today + timedelta(days=days - 1)):
+                MedicationIntake.objects.create(reminder=reminder, intake_date=day, intake_time=moment)
+
+    def batched(self, patient, clinic, doctor, plan, days, today):
+        prescriptions.create(patient, clinic, doctor, plan, today=today, days=days)
+
+    def handle(self, *args, **options):
+        count, drugs, days = options['prescriptions'], options['drugs'], options['days']
+        today = timezone.localdate()
+        plan = prescriptions.parse(
+            'Benchmark',
+            [f'Drug {i}' for i in range(drugs)],
+            ['1 tablet'] * drugs,
+            [FREQUENCIES[i % len(FREQUENCIES)] for i in range(drugs)],
+            [''] * drugs,
+            today=today,
+        )
+
+        with transaction.atomic():
+            doctor, clinic = benchmarking.make_clinic('prescription')
+            patients = benchmarking.make_patients('prescription', count)
+
+            self.stdout.write(f"{'method':>12} {'prescriptions':>14} {'intakes':>8} {'queries':>8} "
+                              f"{'seconds':>8} {'ms/prescription':>16}")
+            for label, write in [('row by row', self.row_by_row), ('batched', self.batched)]:
+                with transaction.atomic():
+                    before = MedicationIntake.objects.count()
+                    queries = []
+                    with connection.execute_wrapper(lambda execute, *query: queries.append(1) or execute(*query)):
+                        begin = time.perf_counter()
+                        for patient in patients:
+                            write(patient, clinic, doctor, plan, days, today)
+                        seconds = time.perf_counter() - begin
+                    intakes = MedicationIntake.objects.count() - before
+                    self.stdout.write(f"{label:>12} {count:>14} {intakes:>8} {len(queries):>8} "
+                                      f"{seconds:>8.2f} {seconds / count * 1000:>16.1f}")
+                    transaction.set_rollback(True)
+            transaction.set_rollback(True)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from patient import retention
+
+
+class Command(BaseCommand):
+    help = 'Fold old read notifications into daily digests and purge expired digests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count what would be compacted and purged')
+
+    def handle(self, *args, **options):
+        summary = retention.compact(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(
+                f"Would compact {summary['compacted']} notifications of {summary['patients']} patients "
+                f"and purge {summary['purged']} digests"
+            )
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {summary['compacted']} notifications of {summary['patients']} patients "
+            f"into {summary['digests']} new digests; purged {summary['purged']} digests"
+        ))
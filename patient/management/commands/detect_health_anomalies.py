@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from patient import anomaly
+
+
+class Command(BaseCommand):
+    help = ('Scan the health metric readings stored since the last run for anomalies '
+            'and notify the patients concerned')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emergency-alerts', action='store_true',
+                            help='Also raise an automatic emergency alert for critical readings')
+        parser.add_argument('--batch-size', type=int, default=anomaly.BATCH_SIZE,
+                            help='Readings scored per transaction')
+
+    def handle(self, *args, **options):
+        summaries = anomaly.scan(options['emergency_alerts'], options['batch_size'])
+        for summary in summaries:
+            self.stdout.write(
+                f"Readings {summary['from_id']}-{summary['to_id']}: {summary['scanned']} scanned, "
+                f"{summary['flagged']} flagged, {summary['notifications']} notifications, {summary['alerts']} alerts"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {sum(s['scanned'] for s in summaries)} readings, "
+            f"sent {sum(s['notifications'] for s in summaries)} notifications"
+        ))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from patient import dispatch
+
+
+class Command(BaseCommand):
+    help = 'Deliver scheduled notifications that are due. Several can run at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=dispatch.BATCH_SIZE, help='Notifications per claim')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for due notifications')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to sleep when nothing is due')
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            started = time.perf_counter()
+            delivered = dispatch.dispatch_batch(options['batch_size'])
+            total += delivered
+            if delivered:
+                seconds = time.perf_counter() - started
+                self.stdout.write(f'Delivered {delivered} notifications ({delivered / seconds:.0f}/s)')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully delivered {total} notifications'))
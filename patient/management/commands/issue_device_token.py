@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from patient import device_auth
+from patient.models import PatientProfile
+
+
+class Command(BaseCommand):
+    help = ("Create an API key a patient's device uploads health metrics with. "
+            "The key is printed once and cannot be shown again.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="The patient's username")
+        parser.add_argument('--name', default='Device', help='Label of the device, e.g. "Glucose meter"')
+
+    def handle(self, *args, **options):
+        try:
+            patient = PatientProfile.objects.get(user__username=options['username'])
+        except PatientProfile.DoesNotExist:
+            raise CommandError(f"No patient with username {options['username']!r}")
+
+        token, key = device_auth.issue(patient, options['name'])
+        self.stdout.write(self.style.SUCCESS(f'Created device token {token.pk} ({token.name})'))
+        self.stdout.write(f'Authorization: Token {key}')
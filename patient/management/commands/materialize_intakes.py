@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from patient import schedule
+
+
+class Command(BaseCommand):
+    help = 'Create the medication intakes of every active reminder over the coming days (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=schedule.HORIZON_DAYS,
+                            help='Days ahead to schedule, from today')
+        parser.add_argument('--batch-size', type=int, default=schedule.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        summary = schedule.materialize(days=options['days'], batch_size=options['batch_size'])
+        seconds = time.perf_counter() - started
+
+        if summary['unreadable']:
+            ids = ', '.join(str(pk) for pk in summary['unreadable'][:20])
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(summary['unreadable'])} reminders with unreadable frequencies: {ids}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']} intakes for {summary['reminders']} reminders in {seconds:.2f}s"))
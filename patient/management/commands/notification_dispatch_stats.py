@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from patient import dispatch
+
+
+class Command(BaseCommand):
+    help = ('Show scheduled notification throughput, lag and queue depth. The counters live in the cache, '
+            'so this only sees the workers\' figures with a shared cache backend (Redis, Memcached)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+
+    def handle(self, *args, **options):
+        for name, value in dispatch.stats().items():
+            self.stdout.write(f"{name:<24} {'-' if value is None else value}")
+
+        if options['reset']:
+            dispatch.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Notification dispatch counters reset'))
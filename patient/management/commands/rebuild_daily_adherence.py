@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from patient import adherence
+
+
+class Command(BaseCommand):
+    help = 'Recount the daily medication adherence rollup from the medication intakes'
+
+    def handle(self, *args, **options):
+        rows = adherence.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} daily adherence rows'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from patient import metric_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-patient health metric summaries from the stored and archived readings'
+
+    def handle(self, *args, **options):
+        rows = metric_summaries.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} metric summaries'))
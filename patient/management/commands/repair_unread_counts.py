@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from patient import unread
+
+
+class Command(BaseCommand):
+    help = "Recount every patient's unread notifications and fix drifted counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report drift, leave the stored counters unchanged')
+
+    def handle(self, *args, **options):
+        drift = unread.repair(apply=not options['dry_run'])
+
+        for patient_id, stored, expected in drift:
+            self.stdout.write(
+                f'patient {patient_id:>8} stored {stored:>6} expected {expected:>6} ({expected - stored:+d})'
+            )
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Unread notification counts are consistent'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} patients have drifted counts'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Corrected {len(drift)} drifted counts'))
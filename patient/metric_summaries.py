@@ -0,0 +1,235 @@
+"""
+Per-patient summaries of health metrics.
+
+Clinicians reviewing a patient want, for every metric, the latest value,
+the 7/30/90-day averages with their min and max, and the trend. Computing
+these from HealthMetric scans every reading, so MetricSummary keeps them
+per (patient, metric_type) instead:
+
+* all-time count, mean and sum of squared deviations (Welford's running
+  variance), min and max;
+* the latest reading;
+* day buckets of [count, sum, min, max] for the last WINDOW_DAYS days,
+  from which the windowed figures and the trend are computed on read. A
+  bucket expires by being dropped from the row once it falls out of the
+  window.
+
+A new reading updates its summary with a fixed amount of work; batches of
+readings (ingest.py) are merged in one update per series. Deleting or
+editing a reading recomputes its series from the stored and archived
+readings. Archiving readings leaves the summaries as they are. The
+rebuild_metric_summaries command recomputes everything.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from threading import local
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from . import archive, timeseries
+from .models import HealthMetric, MetricSummary, PatientProfile
+
+WINDOWS = (7, 30, 90)
+WINDOW_DAYS = max(WINDOWS)
+TREND_DAYS = 30
+LABELS = dict(HealthMetric.METRIC_TYPES)
+
+_pending = local()  # Series waiting for refresh() once their change commits
+
+
+def _merge(summary, count, mean, m2, low, high):
+    """Combine the running statistics of a batch of readings into a summary (Chan et al.)"""
+    total = summary.count + count
+    delta = mean - summary.mean
+    summary.mean += delta * count / total
+    summary.m2 += m2 + delta ** 2 * summary.count * count / total
+    summary.count = total
+    summary.min_value = low if summary.min_value is None else min(summary.min_value, low)
+    summary.max_value = high if summary.max_value is None else max(summary.max_value, high)
+
+
+def _expire(days, today):
+    oldest = (today - timedelta(days=WINDOW_DAYS - 1)).isoformat()
+    return {day: bucket for day, bucket in days.items() if day >= oldest}
+
+
+def add(summary, readings, today=None):
+    """Add [(recorded_at, value, unit)] to a summary, without saving it"""
+    today = today or timezone.localdate()
+    tz = timezone.get_current_timezone()
+    by_day = defaultdict(list)
+    for recorded_at, value, _ in readings:
+        by_day[recorded_at.astimezone(tz).date().isoformat()].append(float(value))
+    values = np.fromiter((value for day in by_day.values() for value in day), dtype=float, count=len(readings))
+    _merge(summary, len(values), values.mean(), ((values - values.mean()) ** 2).sum(), values.min(), values.max())
+
+    latest = max(readings, key=lambda reading: reading[0])
+    if summary.latest_at is None or latest[0] >= summary.latest_at:
+        summary.latest_at, summary.latest_value, summary.unit = latest[0], float(latest[1]), latest[2]
+
+    days = dict(summary.days)
+    for day, day_values in by_day.items():
+        bucket = days.get(day, [0, 0.0, min(day_values), max(day_values)])
+        days[day] = [bucket[0] + len(day_values), bucket[1] + sum(day_values),
+                     min(bucket[2], *day_values), max(bucket[3], *day_values)]
+    summary.days = _expire(days, today)
+
+
+def record(patient_id, readings):
+    """
+    Count new readings, given as [(metric_type, recorded_at, value, unit)],
+    in the patient's summaries: one locked read and one write per metric
+    """
+    by_metric = defaultdict(list)
+    for metric_type, recorded_at, value, unit in readings:
+        by_metric[metric_type].append((recorded_at, value, unit))
+    with transaction.atomic():
+        for metric_type, metric_readings in by_metric.items():
+            summary, _ = MetricSummary.objects.select_for_update().get_or_create(
+                patient_id=patient_id, metric_type=metric_type)
+            add(summary, metric_readings)
+            summary.save()
+
+
+def record_created(metric):
+    record(metric.patient_id, [(metric.metric_type, metric.recorded_at, metric.value, metric.unit)])
+
+
+def compute(patient, metric_type, today=None):
+    """A fresh, unsaved summary of every stored and archived reading of a metric"""
+    today = today or timezone.localdate()
+    summary = MetricSummary(patient=patient, metric_type=metric_type)
+    start = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    times, values = timeseries.readings(patient, metric_type, start, timezone.now() + timedelta(days=365))
+    if not len(times):
+        return summary
+
+    _merge(summary, len(values), values.mean(), ((values - values.mean()) ** 2).sum(), values.min(), values.max())
+    latest = HealthMetric.objects.filter(patient=patient, metric_type=metric_type).order_by('-recorded_at').first()
+    if latest is not None and timeseries._milliseconds(latest.recorded_at) == times[-1]:
+        summary.latest_at, summary.latest_value, summary.unit = latest.recorded_at, latest.value, latest.unit
+    else:
+        # Only archived readings are newer
+        summary.latest_at = datetime.fromtimestamp(times[-1] / 1000, tz=dt_timezone.utc)
+        summary.latest_value = float(values[-1])
+
+    oldest = timezone.make_aware(datetime.combine(today - timedelta(days=WINDOW_DAYS - 1), time.min))
+    recent = times >= timeseries._milliseconds(oldest)
+    times, values = times[recent], values[recent]
+    if len(times):
+        edges = timeseries.bucket_starts(datetime.fromtimestamp(times[0] / 1000, tz=dt_timezone.utc),
+                                         datetime.fromtimestamp(times[-1] / 1000, tz=dt_timezone.utc), 'day')
+        index = np.searchsorted(edges, times, side='right') - 1
+        for i in np.unique(index):
+            day_values = values[index == i]
+            day = timezone.localdate(datetime.fromtimestamp(edges[i] / 1000, tz=dt_timezone.utc))
+            summary.days[day.isoformat()] = [
+                len(day_values), float(day_values.sum()), float(day_values.min()), float(day_values.max())]
+    return summary
+
+
+def refresh(patient_id, metric_type):
+    """Recompute one series, e.g. after a reading was edited or deleted"""
+    patient = PatientProfile.objects.filter(pk=patient_id).first()
+    if patient is None:
+        return
+    summary = compute(patient, metric_type)
+    with transaction.atomic():
+        MetricSummary.objects.filter(patient_id=patient_id, metric_type=metric_type).delete()
+        if summary.count:
+            summary.save()
+
+
+def _refresh_pending(key):
+    pending = getattr(_pending, 'series', set())
+    if key in pending:
+        pending.discard(key)
+        refresh(*key)
+
+
+def schedule_refresh(metric):
+    """
+    Refresh a reading's series once the current transaction commits.
+    Deleting many readings of a series (e.g. with their patient) refreshes
+    it once.
+    """
+    if not hasattr(_pending, 'series'):
+        _pending.series = set()
+    key = (metric.patient_id, metric.metric_type)
+    _pending.series.add(key)
+    transaction.on_commit(lambda: _refresh_pending(key))
+
+
+def rebuild():
+    """Recompute every summary, including archived-only series; returns the number of rows"""
+    series = set(HealthMetric.objects.values_list('patient_id', 'metric_type').distinct().order_by())
+    series |= set(archive.archived_series())
+    patients = PatientProfile.objects.in_bulk({patient_id for patient_id, _ in series})
+    summaries = [
+        compute(patients[patient_id], metric_type)
+        for patient_id, metric_type in sorted(series) if patient_id in patients
+    ]
+    with transaction.atomic():
+        MetricSummary.objects.all().delete()
+        MetricSummary.objects.bulk_create([summary for summary in summaries if summary.count], batch_size=500)
+    return len(summaries)
+
+
+def _window(days, today, length):
+    oldest = (today - timedelta(days=length - 1)).isoformat()
+    buckets = [bucket for day, bucket in days.items() if day >= oldest]
+    count = sum(bucket[0] for bucket in buckets)
+    if not count:
+        return None
+    return {
+        'count': count,
+        'avg': round(sum(bucket[1] for bucket in buckets) / count, 2),
+        'min': min(bucket[2] for bucket in buckets),
+        'max': max(bucket[3] for bucket in buckets),
+    }
+
+
+def trend(days, today, length=TREND_DAYS):
+    """Least-squares slope of the readings over the last `length` days, in units per day"""
+    n = sx = sxx = sy = sxy = 0
+    for day, (count, total, _, _) in days.items():
+        x = (datetime.fromisoformat(day).date() - today).days
+        if x <= -length:
+            continue
+        n += count
+        sx += count * x
+        sxx += count * x * x
+        sy += total
+        sxy += total * x
+    denominator = n * sxx - sx * sx
+    if not denominator:
+        return None  # Fewer than two days of readings
+    return round((n * sxy - sx * sy) / denominator, 3)
+
+
+def describe(summary, today):
+    return {
+        'metric_type': summary.metric_type,
+        'label': LABELS.get(summary.metric_type, summary.metric_type),
+        'unit': summary.unit,
+        'latest_value': summary.latest_value,
+        'latest_at': summary.latest_at,
+        'count': summary.count,
+        'mean': round(summary.mean, 2),
+        'std': round((summary.m2 / summary.count) ** 0.5, 2) if summary.count else None,
+        'min': summary.min_value,
+        'max': summary.max_value,
+        'windows': {length: _window(summary.days, today, length) for length in WINDOWS},
+        'trend': trend(summary.days, today),
+    }
+
+
+def for_patient(patient, today=None):
+    """Summaries of every metric a patient has readings of, from one query"""
+    today = today or timezone.localdate()
+    return [
+        describe(summary, today)
+        for summary in MetricSummary.objects.filter(patient=patient).order_by('metric_type')
+    ]
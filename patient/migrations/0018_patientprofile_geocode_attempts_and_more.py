@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_located_profiles_geocoded(apps, schema_editor):
+    PatientProfile = apps.get_model('patient', 'PatientProfile')
+    PatientProfile.objects.filter(latitude__isnull=False, longitude__isnull=False).update(geocode_status='geocoded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0009_clinicprofile_geocode_attempts_and_more'),
+        ('patient', '0017_remove_medicationreminder_intake_times_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientprofile',
+            name='geocode_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='patientprofile',
+            name='geocode_retry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patientprofile',
+            name='geocode_status',
+            field=models.CharField(choices=[('pending', 'Pending Geocode'), ('geocoded', 'Geocoded'), ('failed', 'Geocode Failed')], default='pending', help_text='Filled in by the geocode_pending worker', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='patientprofile',
+            index=models.Index(fields=['geocode_status', 'geocode_retry_at'], name='patient_pat_geocode_87ab55_idx'),
+        ),
+        migrations.RunPython(mark_located_profiles_geocoded, migrations.RunPython.noop),
+    ]
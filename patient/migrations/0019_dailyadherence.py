@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:19
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_daily_adherence(apps, schema_editor):
+    MedicationIntake = apps.get_model('patient', 'MedicationIntake')
+    DailyAdherence = apps.get_model('patient', 'DailyAdherence')
+    rows = defaultdict(lambda: [0, 0])
+    days = (
+        MedicationIntake.objects.filter(reminder__is_active=True)
+        .values_list('reminder__prescription__patient_id', 'intake_date')
+        .annotate(scheduled=models.Count('pk'), taken=models.Count('pk', filter=models.Q(has_taken=True)))
+        .order_by()
+    )
+    for patient_id, date, scheduled, taken in days:
+        for key in ((patient_id, date), (None, date)):
+            rows[key][0] += scheduled
+            rows[key][1] += taken
+    DailyAdherence.objects.bulk_create([
+        DailyAdherence(patient_id=patient_id, date=date, scheduled=scheduled, taken=taken)
+        for (patient_id, date), (scheduled, taken) in rows.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0018_patientprofile_geocode_attempts_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAdherence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('scheduled', models.IntegerField(default=0)),
+                ('taken', models.IntegerField(default=0)),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_adherence', to='patient.patientprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('patient__isnull', False)), fields=('patient', 'date'), name='unique_patient_daily_adherence'), models.UniqueConstraint(condition=models.Q(('patient__isnull', True)), fields=('date',), name='unique_platform_daily_adherence')],
+            },
+        ),
+        migrations.RunPython(populate_daily_adherence, migrations.RunPython.noop),
+    ]
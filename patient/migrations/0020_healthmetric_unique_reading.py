@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+def delete_duplicate_readings(apps, schema_editor):
+    # Keep the first stored reading per patient, metric and instant
+    HealthMetric = apps.get_model('patient', 'HealthMetric')
+    duplicated = (
+        HealthMetric.objects.values('patient_id', 'metric_type', 'recorded_at')
+        .annotate(count=models.Count('id'), keep=models.Min('id'))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    for row in duplicated.iterator():
+        HealthMetric.objects.filter(
+            patient_id=row['patient_id'], metric_type=row['metric_type'], recorded_at=row['recorded_at']
+        ).exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0019_dailyadherence'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='healthmetric',
+            constraint=models.UniqueConstraint(fields=('patient', 'metric_type', 'recorded_at'), name='unique_health_metric_reading'),
+        ),
+        # The constraint's unique index covers the same columns
+        migrations.RemoveIndex(
+            model_name='healthmetric',
+            name='patient_hea_patient_5dea9b_idx',
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0020_healthmetric_unique_reading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_metric_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('appointment_reminder', 'Appointment Reminder'), ('medication_reminder', 'Medication Reminder'), ('emergency_alert', 'Emergency Alert'), ('transfer_request', 'Transfer Request'), ('health_alert', 'Health Metric Alert'), ('general', 'General Notification')], max_length=50),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:43
+
+from collections import defaultdict
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def populate_metric_summaries(apps, schema_editor):
+    # Archived readings are added by the rebuild_metric_summaries command
+    HealthMetric = apps.get_model('patient', 'HealthMetric')
+    MetricSummary = apps.get_model('patient', 'MetricSummary')
+    oldest = timezone.localdate() - timedelta(days=89)
+    days = defaultdict(dict)
+    recent = (
+        HealthMetric.objects.filter(recorded_at__date__gte=oldest)
+        .annotate(day=TruncDate('recorded_at')).values_list('patient_id', 'metric_type', 'day')
+        .annotate(count=models.Count('pk'), total=models.Sum('value'), low=models.Min('value'), high=models.Max('value'))
+        .order_by()
+    )
+    for patient_id, metric_type, day, count, total, low, high in recent:
+        days[patient_id, metric_type][day.isoformat()] = [count, total, low, high]
+
+    series = (
+        HealthMetric.objects.values_list('patient_id', 'metric_type')
+        .annotate(count=models.Count('pk'), mean=models.Avg('value'), variance=models.Variance('value'),
+                  low=models.Min('value'), high=models.Max('value'))
+        .order_by()
+    )
+    summaries = []
+    for patient_id, metric_type, count, mean, variance, low, high in series:
+        latest = (HealthMetric.objects.filter(patient_id=patient_id, metric_type=metric_type)
+                  .order_by('-recorded_at').first())
+        summaries.append(MetricSummary(
+            patient_id=patient_id, metric_type=metric_type, unit=latest.unit, latest_value=latest.value,
+            latest_at=latest.recorded_at, count=count, mean=mean, m2=variance * count, min_value=low,
+            max_value=high, days=days[patient_id, metric_type],
+        ))
+    MetricSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0021_anomaly_scan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric_type', models.CharField(choices=[('weight', 'Weight (kg)'), ('blood_pressure_systolic', 'Blood Pressure Systolic'), ('blood_pressure_diastolic', 'Blood Pressure Diastolic'), ('heart_rate', 'Heart Rate (bpm)'), ('temperature', 'Temperature (°C)'), ('blood_sugar', 'Blood Sugar (mg/dL)'), ('oxygen_saturation', 'Oxygen Saturation (%)'), ('steps', 'Daily Steps'), ('sleep_hours', 'Sleep Hours')], max_length=50)),
+                ('unit', models.CharField(blank=True, max_length=20)),
+                ('latest_value', models.FloatField(blank=True, null=True)),
+                ('latest_at', models.DateTimeField(blank=True, null=True)),
+                ('count', models.BigIntegerField(default=0)),
+                ('mean', models.FloatField(default=0)),
+                ('m2', models.FloatField(default=0)),
+                ('min_value', models.FloatField(blank=True, null=True)),
+                ('max_value', models.FloatField(blank=True, null=True)),
+                ('days', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metric_summaries', to='patient.patientprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('patient', 'metric_type'), name='unique_metric_summary')],
+            },
+        ),
+        migrations.RunPython(populate_metric_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:52
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_unread_notifications(apps, schema_editor):
+    Notification = apps.get_model('patient', 'Notification')
+    PatientProfile = apps.get_model('patient', 'PatientProfile')
+    delivered = Q(scheduled_at__isnull=True) | Q(delivered_at__isnull=False)
+    counts = (
+        Notification.objects.filter(delivered, is_read=False)
+        .values_list('patient_id').annotate(unread=Count('pk')).order_by()
+    )
+    for patient_id, unread in counts:
+        PatientProfile.objects.filter(pk=patient_id).update(unread_notifications=unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0023_notification_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientprofile',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Maintained by patient/unread.py; never written by save()'),
+        ),
+        migrations.RunPython(count_unread_notifications, migrations.RunPython.noop),
+    ]
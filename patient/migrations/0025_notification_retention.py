@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0024_patient_unread_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='coalesced_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='digest_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('appointment_reminder', 'Appointment Reminder'), ('medication_reminder', 'Medication Reminder'), ('emergency_alert', 'Emergency Alert'), ('transfer_request', 'Transfer Request'), ('health_alert', 'Health Metric Alert'), ('general', 'General Notification'), ('digest', 'Daily Digest')], max_length=50),
+        ),
+    ]
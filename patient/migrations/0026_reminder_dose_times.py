@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:01
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def copy_intake_times(apps, schema_editor):
+    # Reminders keep the times their intakes were created at
+    MedicationIntake = apps.get_model('patient', 'MedicationIntake')
+    MedicationReminder = apps.get_model('patient', 'MedicationReminder')
+    times = defaultdict(set)
+    for reminder_id, intake_time in MedicationIntake.objects.values_list('reminder_id', 'intake_time').distinct():
+        times[reminder_id].add(intake_time.strftime('%H:%M'))
+    reminders = list(MedicationReminder.objects.filter(pk__in=times))
+    for reminder in reminders:
+        reminder.dose_times = sorted(times[reminder.pk])
+    MedicationReminder.objects.bulk_update(reminders, ['dose_times'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0025_notification_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationreminder',
+            name='dose_times',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(copy_intake_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0028_device_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patientprofile',
+            name='unread_notifications',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Maintained by patient/unread.py; saves of a loaded profile pass update_fields'),
+        ),
+    ]
@@ -5,6 +5,11 @@ from datetime import timedelta
 
 
 class PatientProfile(models.Model):
+    GEOCODE_STATUS_CHOICES = [
+        ('pending', 'Pending Geocode'),
+        ('geocoded', 'Geocoded'),
+        ('failed', 'Geocode Failed'),
+    ]
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     date_of_birth = models.DateField()
     phone_number = models.CharField(max_length=15)
@@ -12,11 +17,22 @@ class PatientProfile(models.Model):
     current_location = models.CharField(max_length=100)  # City/State
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    geocode_status = models.CharField(max_length=10, choices=GEOCODE_STATUS_CHOICES, default='pending',
+                                      help_text="Filled in by the geocode_pending worker")
+    geocode_attempts = models.PositiveSmallIntegerField(default=0)
+    geocode_retry_at = models.DateTimeField(null=True, blank=True)
     current_clinic = models.ForeignKey(
         'clinic.ClinicProfile', on_delete=models.SET_NULL, null=True, blank=True)
     consent_given = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True, help_text="Whether this patient profile is active")
     created_at = models.DateTimeField(default=timezone.now)
+    unread_notifications = models.PositiveIntegerField(
+        default=0, editable=False, help_text="Maintained by patient/unread.py; saves of a loaded profile pass update_fields")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['geocode_status', 'geocode_retry_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.current_location}"
@@ -275,6 +291,9 @@ class MedicationReminder(models.Model):
         max_length=50,
         help_text="e.g. once daily, twice daily, every 8 hours"
     )
+    # "HH:MM" clock times of the doses; empty for the defaults of the
+    # frequency (see patient/schedule.py)
+    dose_times = models.JSONField(default=list, blank=True)
 
     
 
@@ -339,6 +358,31 @@ class MedicationIntake(models.Model):
         return f"{self.reminder.medication_name} at {self.intake_time} ({status})"
 
 
+class DailyAdherence(models.Model):
+    """
+    Doses scheduled and taken per patient and day, for reminders that are
+    active. Maintained from MedicationIntake by patient/adherence.py; rows
+    without a patient hold the platform-wide totals.
+    """
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, null=True, blank=True,
+                                related_name='daily_adherence')
+    date = models.DateField()
+    scheduled = models.IntegerField(default=0)
+    taken = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'date'], condition=models.Q(patient__isnull=False),
+                                    name='unique_patient_daily_adherence'),
+            models.UniqueConstraint(fields=['date'], condition=models.Q(patient__isnull=True),
+                                    name='unique_platform_daily_adherence'),
+        ]
+
+    def __str__(self):
+        owner = self.patient_id or 'platform'
+        return f"{owner} {self.date}: {self.taken}/{self.scheduled}"
+
+
 
 class TelemedicineSession(models.Model):
     STATUS_CHOICES = [
@@ -398,21 +442,80 @@ class HealthMetric(models.Model):
 
     class Meta:
         ordering = ['-recorded_at']
-        indexes = [
-            models.Index(fields=['patient', 'metric_type', 'recorded_at']),
+        constraints = [
+            # One reading per patient, metric and instant; its index also
+            # serves the per-metric time range queries
+            models.UniqueConstraint(fields=['patient', 'metric_type', 'recorded_at'],
+                                    name='unique_health_metric_reading'),
         ]
 
     def __str__(self):
         return f"{self.metric_type}: {self.value} for {self.patient.user.username}"
 
 
+class MetricSummary(models.Model):
+    """
+    Running statistics of a patient's readings of one metric, maintained
+    from HealthMetric by patient/metric_summaries.py
+    """
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name='metric_summaries')
+    metric_type = models.CharField(max_length=50, choices=HealthMetric.METRIC_TYPES)
+    unit = models.CharField(max_length=20, blank=True)
+    latest_value = models.FloatField(null=True, blank=True)
+    latest_at = models.DateTimeField(null=True, blank=True)
+    count = models.BigIntegerField(default=0)
+    mean = models.FloatField(default=0)
+    m2 = models.FloatField(default=0)  # Sum of squared deviations from the mean
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    # {'YYYY-MM-DD': [count, sum, min, max]} for the last 90 days
+    days = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'metric_type'], name='unique_metric_summary'),
+        ]
+
+    def __str__(self):
+        return f"{self.metric_type} summary for patient {self.patient_id}: {self.count} readings"
+
+
+class DeviceToken(models.Model):
+    """
+    API key a patient's device or script uploads health metrics with (see
+    patient/device_auth.py). Only a SHA-256 digest of the key is stored.
+    """
+    patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name='device_tokens')
+    name = models.CharField(max_length=100)
+    key_digest = models.CharField(max_length=64, unique=True, editable=False)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Device token {self.name} for patient {self.patient_id}"
+
+
+class AnomalyScan(models.Model):
+    """High-water mark of the health metric anomaly scan (see patient/anomaly.py)"""
+    name = models.CharField(max_length=50, unique=True)
+    last_metric_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: up to metric {self.last_metric_id}"
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('appointment_reminder', 'Appointment Reminder'),
         ('medication_reminder', 'Medication Reminder'),
         ('emergency_alert', 'Emergency Alert'),
         ('transfer_request', 'Transfer Request'),
+        ('health_alert', 'Health Metric Alert'),
         ('general', 'General Notification'),
+        ('digest', 'Daily Digest'),
     ]
 
     patient = models.ForeignKey(PatientProfile, on_delete=models.CASCADE, related_name='notifications')
@@ -420,14 +523,33 @@ class Notification(models.Model):
     title = models.CharField(max_length=200)
     message = models.TextField()
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now)
     scheduled_at = models.DateTimeField(null=True, blank=True)  # For scheduled notifications
+    # Set by the dispatcher (patient/dispatch.py) when a scheduled
+    # notification is delivered; until then the patient does not see it
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_until = models.DateTimeField(null=True, blank=True)
+    # How many notifications this row stands for: a burst of the same type
+    # and coalesce_key (patient/notify.py) or the day a digest replaced
+    # (patient/retention.py)
+    coalesced_count = models.PositiveIntegerField(default=1)
+    # Narrows coalescing within a type, e.g. the metric of a health alert
+    coalesce_key = models.CharField(max_length=50, blank=True)
+    # A coalesced row keeps the message of its most severe notification
+    severity = models.PositiveSmallIntegerField(default=0)
+    digest_counts = models.JSONField(default=dict, blank=True)  # Digests: {notification_type: count}
+
+    # Notifications the patient can see
+    DELIVERED = models.Q(scheduled_at__isnull=True) | models.Q(delivered_at__isnull=False)
 
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['patient', 'is_read', 'created_at']),
-            models.Index(fields=['scheduled_at']),
+            # The dispatch queue: only scheduled notifications not yet delivered
+            models.Index(fields=['scheduled_at'], condition=models.Q(delivered_at__isnull=True),
+                         name='notification_due_idx'),
         ]
 
     def __str__(self):
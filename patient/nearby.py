@@ -0,0 +1,132 @@
+"""
+Nearby clinic search shared by the nearby_clinics page and the JSON feed
+that the clinic map script renders.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from clinic import disease_mask, spatial
+from clinic.clustering import ClusterIndex
+from clinic.models import ClinicProfile
+from .models import TreatmentRecord
+
+logger = logging.getLogger(__name__)
+
+NEARBY_CLINIC_RADIUS_KM = 50
+
+MAP_FIELDS = ['id', 'lat', 'lng', 'distance_km', 'category']
+
+
+def patient_diseases(patient):
+    """Names of the diseases the patient has treatment records for"""
+    try:
+        diseases = set(
+            TreatmentRecord.objects.filter(patient=patient)
+            .values_list('disease', flat=True)
+        )
+    except Exception as e:
+        logger.warning(f"Error fetching diseases: {e}")
+        diseases = set()
+    return diseases or {'HIV'}
+
+
+def search(patient, location=None, diseases=None):
+    """
+    Return (current_clinics, other_clinics) relevant to the patient's
+    diseases. With a (lat, lng) location only clinics within
+    NEARBY_CLINIC_RADIUS_KM are returned, nearest first, each with a
+    ``distance`` in km rounded to 2 decimals.
+
+    Relevance is checked against each clinic's stored disease bitmask, so
+    diseases_treated is not loaded; callers that display it should prefetch
+    it for the clinics returned.
+    """
+    clinics = ClinicProfile.objects.filter(
+        is_approved=True,
+        is_active=True,
+        latitude__isnull=False,
+        longitude__isnull=False
+    )
+    if diseases is None:
+        diseases = patient_diseases(patient)
+    mask = disease_mask.patient_mask(diseases)
+
+    if location:
+        # Only clinics the spatial index places inside the search radius are
+        # loaded and measured
+        clinics = spatial.clinics_within(location[0], location[1], NEARBY_CLINIC_RADIUS_KM, queryset=clinics)
+
+    current_clinics = []
+    other_clinics = []
+    for clinic in clinics:
+        if not disease_mask.is_relevant(clinic, mask):
+            continue
+        if location:
+            clinic.distance = round(clinic.distance, 2)
+        if patient.current_clinic_id and clinic.id == patient.current_clinic_id:
+            current_clinics.append(clinic)
+        else:
+            other_clinics.append(clinic)
+    return current_clinics, other_clinics
+
+
+def _map_rows(current_clinics, other_clinics):
+    return [
+        [clinic.id, round(clinic.latitude, 5), round(clinic.longitude, 5), clinic.distance, category]
+        for category, group in (('current', current_clinics), ('other', other_clinics))
+        for clinic in group
+    ]
+
+
+def map_payload(location, current_clinics, other_clinics):
+    """
+    Compact map data: one [id, lat, lng, distance_km, category] row per
+    clinic, with coordinates trimmed to ~1 m precision.
+    """
+    return {
+        'origin': [round(location[0], 5), round(location[1], 5)],
+        'fields': MAP_FIELDS,
+        'clinics': _map_rows(current_clinics, other_clinics),
+    }
+
+
+def cluster_index(patient, location):
+    """
+    Return the ClusterIndex for a patient's search around location.
+
+    The hierarchy is cached per region: the origin rounded to ~100 m plus
+    everything that changes which clinics are relevant (the patient's
+    diseases and registered clinic). Zooming and panning the map reuses it.
+    """
+    diseases = patient_diseases(patient)
+    signature = hashlib.md5(','.join(sorted(diseases)).encode()).hexdigest()[:12]
+    key = (f"clinic-clusters:{location[0]:.3f}:{location[1]:.3f}:"
+           f"{patient.current_clinic_id}:{signature}")
+
+    index = cache.get(key)
+    if index is None:
+        current_clinics, other_clinics = search(patient, location, diseases)
+        rows = _map_rows(current_clinics, other_clinics)
+        index = ClusterIndex([row[1] for row in rows], [row[2] for row in rows], rows)
+        cache.set(key, index, getattr(settings, 'CLINIC_CLUSTER_CACHE_TTL', 300))
+    return index
+
+
+def clustered_payload(location, index, zoom, bbox=None):
+    """
+    Map data for one zoom level: clinics shown on their own as in
+    map_payload, plus [lat, lng, count] rows for clusters.
+    """
+    clusters, rows = index.query(zoom, bbox)
+    return {
+        'origin': [round(location[0], 5), round(location[1], 5)],
+        'zoom': zoom,
+        'bounds': index.bounds,
+        'fields': MAP_FIELDS,
+        'clinics': rows,
+        'cluster_fields': ['lat', 'lng', 'count'],
+        'clusters': clusters,
+    }
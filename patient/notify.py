@@ -0,0 +1,104 @@
+"""
+Sending notifications with write-time coalescing.
+
+Reminders and alerts come in bursts: a patient with several medications
+gets a reminder per dose, and an anomaly scan can flag a metric on every
+run. send_many() merges a new notification into the patient's latest
+unread, already shown notification of the same type and coalesce_key from
+the last NOTIFICATION_COALESCE_WINDOW instead of adding a row: the row
+takes the newest time, counts the burst in coalesced_count, and takes the
+newest title and message unless they are less severe than its own, so a
+critical alert is never replaced by a milder one. Health alerts use the
+metric as coalesce_key, so each metric keeps its own notification.
+
+Scheduled notifications are not coalesced, since they are only shown once
+the dispatcher delivers them (see dispatch.py), nor are the types in
+NEVER_COALESCED.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from admin_app import rollup
+
+from . import unread
+from .models import Notification
+
+NEVER_COALESCED = {'emergency_alert', 'digest'}
+
+
+def coalesce_window():
+    return getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', timedelta(minutes=30))
+
+
+def coalescable(notification):
+    return notification.scheduled_at is None and notification.notification_type not in NEVER_COALESCED
+
+
+def _key(notification):
+    return notification.patient_id, notification.notification_type, notification.coalesce_key
+
+
+def _open(keys, since):
+    """{(patient id, notification_type, coalesce_key): latest unread shown notification since `since`} for the keys"""
+    candidates = Notification.objects.select_for_update().filter(
+        Notification.DELIVERED,
+        patient_id__in={patient_id for patient_id, _, _ in keys},
+        notification_type__in={notification_type for _, notification_type, _ in keys},
+        coalesce_key__in={coalesce_key for _, _, coalesce_key in keys},
+        is_read=False,
+        created_at__gte=since,
+    ).order_by('created_at', 'pk')
+    # Later rows overwrite earlier ones
+    return {_key(n): n for n in candidates if _key(n) in keys}
+
+
+def send_many(notifications, now=None):
+    """
+    Store unsaved notifications, coalescing bursts. Returns the rows
+    written, one per burst: new rows and the existing rows that absorbed
+    notifications.
+    """
+    now = now or timezone.now()
+    bursts = defaultdict(list)
+    created = []
+    for notification in notifications:
+        notification.created_at = now
+        if coalescable(notification):
+            bursts[_key(notification)].append(notification)
+        else:
+            created.append(notification)
+
+    with transaction.atomic():
+        existing = _open(set(bursts), now - coalesce_window()) if bursts else {}
+        merged = []
+        for key, burst in bursts.items():
+            # The latest of the most severe notifications speaks for the burst
+            lead = max(reversed(burst), key=lambda n: n.severity)
+            row = existing.get(key)
+            if row is None:
+                lead.coalesced_count = sum(n.coalesced_count for n in burst)
+                created.append(lead)
+                continue
+            if lead.severity >= row.severity:
+                row.title, row.message, row.severity = lead.title, lead.message, lead.severity
+            row.created_at = now
+            row.coalesced_count += sum(n.coalesced_count for n in burst)
+            merged.append(row)
+
+        # Merged rows stay unread and shown, so only new rows are counted
+        Notification.objects.bulk_create(created)
+        rollup.record_created(created)
+        unread.record_created(created)
+        if merged:
+            Notification.objects.bulk_update(merged, ['title', 'message', 'severity', 'created_at', 'coalesced_count'])
+    return created + merged
+
+
+def send(patient, notification_type, title, message, scheduled_at=None):
+    """Store one notification, or fold it into a recent one of the same type; returns the row"""
+    return send_many([Notification(patient=patient, notification_type=notification_type, title=title,
+                                   message=message, scheduled_at=scheduled_at)])[0]
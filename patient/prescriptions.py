@@ -0,0 +1,134 @@
+"""
+Writing prescriptions.
+
+add_treatment_record used to create the Prescription, then each
+MedicationReminder and each of its MedicationIntake rows with an INSERT of
+its own, reading the rows of the medication table with mismatched indexes.
+A prescription is now written in two steps:
+
+1. parse() validates the whole medication table of the form (name, dosage,
+   frequency and dose times of every row, and the dates) and reports every
+   problem at once in a PrescriptionError, before anything is written;
+2. create() writes the prescription, its reminders with one bulk_create()
+   and the doses of the coming days through schedule.materialize(), which
+   inserts them with one bulk_create() and updates the adherence rollup.
+
+The benchmark_prescription_create command compares it with the old
+row-by-row writes.
+"""
+from collections import namedtuple
+from itertools import zip_longest
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core import dashboard_cache
+
+from . import schedule
+from .models import MedicationReminder, Prescription
+
+DEFAULT_FREQUENCY = 'once daily'
+
+# times: the clinician's dose times, empty for the defaults of the frequency
+Medication = namedtuple('Medication', ['name', 'dosage', 'frequency', 'times'])
+Plan = namedtuple('Plan', ['diagnosis', 'medications', 'start_date', 'end_date'])
+
+
+class PrescriptionError(ValueError):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def _limit(errors, row, label, value, field):
+    max_length = MedicationReminder._meta.get_field(field).max_length
+    if len(value) > max_length:
+        errors.append(f"Medication {row}: {label} must be at most {max_length} characters")
+
+
+def parse_medication(row, name, dosage, frequency, intake_times, errors):
+    """Medication of one row of the form, or None; problems are added to errors"""
+    name, dosage, frequency, intake_times = (value.strip() for value in (name, dosage, frequency, intake_times))
+    if not name:
+        if dosage or frequency or intake_times:
+            errors.append(f"Medication {row}: enter the medication name")
+        return None
+    frequency = frequency or DEFAULT_FREQUENCY
+    _limit(errors, row, 'the name', name, 'medication_name')
+    _limit(errors, row, 'the dosage', dosage, 'dosage')
+    _limit(errors, row, 'the frequency', frequency, 'frequency')
+    try:
+        times = schedule.parse_times(intake_times)
+        schedule.parse(frequency, times)
+    except schedule.FrequencyError as e:
+        errors.append(f"Medication {row}: {e}")
+        return None
+    return Medication(name, dosage, frequency, times)
+
+
+def _date(value, label, errors):
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        errors.append(f"Invalid {label} {value!r}")
+    return day
+
+
+def parse(diagnosis, names, dosages, frequencies, intake_times, start_date='', end_date='', today=None):
+    """
+    Validate the prescription part of the treatment form: the diagnosis,
+    the per-row medication lists (rows without any value are ignored) and
+    the start and end dates shared by the medications. Returns a Plan, or
+    raises PrescriptionError listing every problem.
+    """
+    errors = []
+    rows = zip_longest(names, dosages, frequencies, intake_times, fillvalue='')
+    medications = [
+        medication for row, values in enumerate(rows, 1)
+        if (medication := parse_medication(row, *values, errors)) is not None
+    ]
+    start = _date(start_date, 'start date', errors) or today or timezone.localdate()
+    end = _date(end_date, 'end date', errors)
+    if end and end < start:
+        errors.append('The end date is before the start date')
+    if medications and not diagnosis:
+        errors.append('Enter a diagnosis to prescribe medications')
+    if errors:
+        raise PrescriptionError(errors)
+    return Plan(diagnosis, medications, start, end)
+
+
+def create(patient, clinic, doctor, plan, instructions='', follow_up_date=None, today=None,
+           days=schedule.HORIZON_DAYS):
+    """
+    Write a parsed prescription: the Prescription, its reminders and the
+    intakes of the next `days` days. Returns the prescription.
+    """
+    with transaction.atomic():
+        prescription = Prescription.objects.create(
+            patient=patient, clinic=clinic, doctor=doctor, diagnosis=plan.diagnosis,
+            medications=[{'name': medication.name, 'dosage': medication.dosage} for medication in plan.medications],
+            instructions=instructions, follow_up_date=follow_up_date or None,
+        )
+        reminders = MedicationReminder.objects.bulk_create([
+            MedicationReminder(
+                prescription=prescription, medication_name=medication.name, dosage=medication.dosage,
+                frequency=medication.frequency, dose_times=[moment.strftime('%H:%M') for moment in medication.times],
+                start_date=plan.start_date, end_date=plan.end_date,
+            )
+            for medication in plan.medications
+        ])
+        if reminders and reminders[0].pk is None:
+            # Databases that cannot return ids from a bulk insert
+            reminders = list(prescription.medication_reminders.order_by('pk'))
+
+        # bulk_create() sends no signals: refresh the dashboards here, and
+        # let materialize() count the new doses
+        transaction.on_commit(lambda: dashboard_cache.invalidate_model('patient.MedicationReminder', {patient.pk}))
+        schedule.materialize(today=today, days=days, reminders=reminders)
+    return prescription
@@ -0,0 +1,180 @@
+"""
+Notification retention.
+
+Notifications are only useful while they are fresh, but they used to stay
+in the table forever. The compact_notifications command keeps it bounded:
+
+* read notifications older than NOTIFICATION_RETENTION, or beyond the
+  newest NOTIFICATION_MAX_PER_PATIENT rows of a patient, are folded into
+  one read 'digest' notification per patient and local day, which counts
+  them by type in digest_counts and its message ("14 × Medication
+  Reminder, 1 × Appointment Reminder"), and then deleted;
+* digests older than NOTIFICATION_DIGEST_RETENTION are deleted.
+
+Unread notifications are never compacted. Rows are handled COMPACT_BATCH
+at a time, each batch in its own transaction, and deleted by primary key
+in DELETE_BATCH chunks without loading model instances, so a first run
+over years of history holds no long locks. A later run adds to the digests
+of days it already compacted.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from admin_app import rollup
+
+from .models import Notification
+
+COMPACT_BATCH = 2000
+DELETE_BATCH = 500
+DIGEST = 'digest'
+LABELS = dict(Notification.NOTIFICATION_TYPES)
+
+
+def retention():
+    return getattr(settings, 'NOTIFICATION_RETENTION', timedelta(days=30))
+
+
+def digest_retention():
+    return getattr(settings, 'NOTIFICATION_DIGEST_RETENTION', timedelta(days=365))
+
+
+def max_per_patient():
+    return getattr(settings, 'NOTIFICATION_MAX_PER_PATIENT', 500)
+
+
+def compactable(patient_id=None):
+    """Read, shown notifications other than digests"""
+    queryset = Notification.objects.filter(Notification.DELIVERED, is_read=True).exclude(notification_type=DIGEST)
+    return queryset.filter(patient_id=patient_id) if patient_id is not None else queryset
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def describe(counts):
+    """'14 × Medication Reminder, 1 × Appointment Reminder', largest first"""
+    return ', '.join(
+        f"{count} × {LABELS.get(notification_type, notification_type)}"
+        for notification_type, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    )
+
+
+def _delete(ids):
+    """Delete notifications by id, without loading instances or sending signals"""
+    table = connection.ops.quote_name(Notification._meta.db_table)
+    pk = connection.ops.quote_name(Notification._meta.pk.column)
+    with connection.cursor() as cursor:
+        for i in range(0, len(ids), DELETE_BATCH):
+            batch = ids[i:i + DELETE_BATCH]
+            cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({', '.join(['%s'] * len(batch))})", batch)
+    # Only read notifications are deleted here, so only the total changes
+    rollup.adjust('notifications', 'total', -len(ids))
+
+
+def _fold(patient_id, rows):
+    """Add [(id, created_at, notification_type, coalesced_count)] rows to the patient's daily digests"""
+    days = defaultdict(Counter)
+    for _, created_at, notification_type, count in rows:
+        days[timezone.localdate(created_at)][notification_type] += count
+
+    starts = {_day_start(day): counts for day, counts in days.items()}
+    existing = Notification.objects.filter(
+        patient_id=patient_id, notification_type=DIGEST, created_at__in=list(starts))
+    updated = []
+    for digest in existing:
+        counts = starts.pop(digest.created_at)
+        counts.update(digest.digest_counts)
+        digest.digest_counts = dict(counts)
+        digest.coalesced_count = sum(counts.values())
+        digest.message = describe(counts)
+        updated.append(digest)
+    if updated:
+        Notification.objects.bulk_update(updated, ['digest_counts', 'coalesced_count', 'message'])
+
+    created = [
+        Notification(
+            patient_id=patient_id, notification_type=DIGEST, is_read=True, created_at=start,
+            title=f"Notifications of {timezone.localtime(start):%d %b %Y}", message=describe(counts),
+            digest_counts=dict(counts), coalesced_count=sum(counts.values()),
+        )
+        for start, counts in starts.items()
+    ]
+    Notification.objects.bulk_create(created)
+    rollup.record_created(created)
+    return len(created)
+
+
+def expired(patient_id, cutoff):
+    """Q of a patient's rows to compact: older than the cutoff, or not among the newest max_per_patient()"""
+    condition = Q(created_at__lt=cutoff)
+    overflow = list(
+        Notification.objects.filter(patient_id=patient_id).order_by('-created_at', '-pk')
+        .values_list('created_at', flat=True)[max_per_patient():max_per_patient() + 1]
+    )
+    if overflow:
+        condition |= Q(created_at__lte=overflow[0])
+    return condition
+
+
+def compact_patient(patient_id, cutoff, dry_run=False):
+    """Fold one patient's expired read notifications into digests; returns (compacted, digests)"""
+    rows = compactable(patient_id).filter(expired(patient_id, cutoff)).order_by('created_at', 'pk')
+    if dry_run:
+        return rows.count(), 0
+    compacted = digests = 0
+    while True:
+        with transaction.atomic():
+            batch = list(rows.values_list('pk', 'created_at', 'notification_type', 'coalesced_count')[:COMPACT_BATCH])
+            if not batch:
+                return compacted, digests
+            digests += _fold(patient_id, batch)
+            _delete([row[0] for row in batch])
+        compacted += len(batch)
+        if len(batch) < COMPACT_BATCH:
+            return compacted, digests
+
+
+def candidates(cutoff):
+    """Ids of patients with read notifications past the retention or more rows than the limit"""
+    old = compactable().filter(created_at__lt=cutoff).values_list('patient_id', flat=True).distinct().order_by()
+    crowded = (
+        Notification.objects.values('patient_id').annotate(rows=Count('pk'))
+        .filter(rows__gt=max_per_patient()).values_list('patient_id', flat=True).order_by()
+    )
+    return sorted(set(old) | set(crowded))
+
+
+def purge_digests(before, dry_run=False):
+    """Delete digests older than `before`; returns how many"""
+    digests = Notification.objects.filter(notification_type=DIGEST, created_at__lt=before)
+    if dry_run:
+        return digests.count()
+    purged = 0
+    while True:
+        with transaction.atomic():
+            ids = list(digests.values_list('pk', flat=True)[:COMPACT_BATCH])
+            if ids:
+                _delete(ids)
+        purged += len(ids)
+        if len(ids) < COMPACT_BATCH:
+            return purged
+
+
+def compact(now=None, dry_run=False):
+    """Apply the retention policy to every patient; returns a summary dict"""
+    now = now or timezone.now()
+    cutoff = now - retention()
+    summary = {'patients': 0, 'compacted': 0, 'digests': 0, 'purged': 0}
+    for patient_id in candidates(cutoff):
+        compacted, digests = compact_patient(patient_id, cutoff, dry_run)
+        summary['patients'] += 1 if compacted else 0
+        summary['compacted'] += compacted
+        summary['digests'] += digests
+    summary['purged'] = purge_digests(now - digest_retention(), dry_run)
+    return summary
@@ -0,0 +1,287 @@
+"""
+Medication dose schedules.
+
+MedicationReminder.frequency is free text written by clinicians ("twice
+daily", "every 8 hours", "tds", "every other day at bedtime"). parse()
+turns it into a Rule: the clock times of the day's doses and how many days
+apart dosing days are, counted from the reminder's start_date. The
+"1-0-1" notation (doses in the morning, at noon and at night, with an
+optional evening slot as in "1-0-1-1") and meal-relative text ("after
+meals") map to the same default times as "morning", "lunch" and so on. Times the
+clinician entered (MedicationReminder.dose_times) replace the rule's
+default times. "As needed" reminders have no times and are never
+scheduled.
+
+materialize() creates the MedicationIntake rows of every active reminder
+for the next HORIZON_DAYS days, within the reminder's start_date and
+end_date. The materialize_intakes command runs it nightly. Runs are
+idempotent: rows that already exist under the (reminder, intake_date,
+intake_time) unique constraint are skipped, so only the newest day of the
+horizon is normally inserted. Reminders are handled BATCH_SIZE at a time
+with one read of their existing rows and one bulk_create() per batch,
+which also updates the adherence rollup and the dashboards.
+"""
+import re
+from collections import defaultdict, namedtuple
+from datetime import time, timedelta
+from fractions import Fraction
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import dashboard_cache
+
+from . import adherence
+from .models import MedicationIntake, MedicationReminder
+
+HORIZON_DAYS = 7
+BATCH_SIZE = 250
+FIRST_DOSE = 8 * 60  # Minutes after midnight of the first dose of evenly spaced schedules
+
+# times: dose times of a dosing day, empty for "as needed";
+# interval_days: 1 daily, 2 every other day, 7 weekly
+Rule = namedtuple('Rule', ['times', 'interval_days'])
+
+
+class FrequencyError(ValueError):
+    pass
+
+
+WORDS = {'once': 1, 'one': 1, 'twice': 2, 'two': 2, 'thrice': 3, 'three': 3, 'four': 4, 'five': 5, 'six': 6}
+ABBREVIATIONS = {'od': 1, 'qd': 1, 'bd': 2, 'bid': 2, 'tds': 3, 'tid': 3, 'qds': 4, 'qid': 4}
+AS_NEEDED = re.compile(r'\b(as needed|as required|when required|if needed|prn|sos)\b')
+MORNING, NOON, EVENING, NIGHT = time(8), time(13), time(19), time(21)
+TIMES_OF_DAY = [
+    (re.compile(r'\b(morning|breakfast|am)\b'), MORNING),
+    (re.compile(r'\b(noon|lunch|afternoon)\b'), NOON),
+    (re.compile(r'\b(evening|dinner|supper|pm)\b'), EVENING),
+    (re.compile(r'\b(bedtime|night|nightly|hs)\b'), NIGHT),
+]
+# Dose slots of the "1-0-1" notation: morning-noon-night, or with an evening dose
+SLOT_TIMES = {3: (MORNING, NOON, NIGHT), 4: (MORNING, NOON, EVENING, NIGHT)}
+SLOTS = re.compile(r'(?<![\d./])(\d(?:[./]\d)?(?:\s*[-\u2013]\s*\d(?:[./]\d)?){2,3})(?![\d./-])')
+MEALS = re.compile(r'\b(meals?|food)\b')
+# Meal-relative doses by doses a day: breakfast, then dinner, then lunch
+MEAL_TIMES = {1: (MORNING,), 2: (MORNING, EVENING), 3: (MORNING, NOON, EVENING)}
+DEFAULT_TIMES = {
+    1: (time(9),),
+    2: (time(9), time(21)),
+    3: (time(8), time(14), time(20)),
+    4: (time(8), time(12), time(16), time(20)),
+}
+
+
+def spaced(doses, hours=None):
+    """Dose times spread over the day from FIRST_DOSE, `hours` apart or evenly"""
+    step = hours * 60 if hours else 24 * 60 // doses
+    return tuple(sorted(time(*divmod((FIRST_DOSE + i * step) % (24 * 60), 60)) for i in range(doses)))
+
+
+def _count(word):
+    return int(word) if word.isdigit() else WORDS.get(word)
+
+
+def _doses_per_day(text):
+    """Doses a day stated by the text, or None"""
+    match = re.search(r'\b(\w+)\s*(?:x|times?)\s*(?:a|per|each|every)?\s*(?:day|daily)\b', text)
+    if match and _count(match.group(1)):
+        return _count(match.group(1))
+    match = re.search(r'\b(once|twice|thrice)\b', text)
+    if match and not re.search(r'\b(week|weekly)\b', text):
+        return WORDS[match.group(1)]
+    for token in re.findall(r'[a-z]+', text):
+        if token in ABBREVIATIONS:
+            return ABBREVIATIONS[token]
+    if re.search(r'\bevery day\b|\bdaily\b|\ba day\b', text):
+        return 1
+    return None
+
+
+def _slot_times(frequency):
+    """Dose times of "1-0-1" style text, or None"""
+    match = SLOTS.search((frequency or '').lower())
+    if not match:
+        return None
+    try:
+        amounts = [Fraction(amount.strip()) for amount in re.split(r'[-\u2013]', match.group(1))]
+    except ZeroDivisionError:
+        raise FrequencyError(f'invalid dose in {frequency!r}')
+    return tuple(moment for amount, moment in zip(amounts, SLOT_TIMES[len(amounts)]) if amount)
+
+
+def parse(frequency, times=()):
+    """
+    Rule for a frequency text. times, if given, are the clinician's dose
+    times and replace the defaults. Raises FrequencyError for text it
+    cannot read.
+    """
+    text = ' '.join(re.sub(r'[^a-z0-9]+', ' ', (frequency or '').lower()).split())
+    times = tuple(sorted(set(times)))
+    if AS_NEEDED.search(text):
+        return Rule((), 1)
+
+    interval_days = 1
+    doses, default_times = None, None
+    if re.search(r'\b(twice|thrice|two|three|four|\d+) (?:times )?(?:a |per )?week(?:ly)?\b', text):
+        raise FrequencyError(f'several doses a week are not supported: {frequency!r}')
+    if re.search(r'\b(every other day|alternate days?|every second day)\b', text):
+        interval_days = 2
+    elif match := re.search(r'\bevery (\d+) days?\b', text):
+        interval_days = int(match.group(1))
+    elif re.search(r'\b(weekly|once a week|every week)\b', text):
+        interval_days = 7
+
+    if match := re.search(r'\b(?:every|q) ?(\d+)? ?(?:hours?|hrs?|h)\b', text):
+        hours = int(match.group(1) or 1)
+        if hours % 24 == 0:
+            interval_days = hours // 24
+            doses = 1
+        elif 24 % hours == 0:
+            doses = 24 // hours
+            default_times = spaced(doses, hours)
+        else:
+            raise FrequencyError(f'every {hours} hours does not repeat daily')
+    elif (slots := _slot_times(frequency)) is not None:
+        if not slots:
+            raise FrequencyError(f'no doses in {frequency!r}')
+        doses, default_times = len(slots), slots
+    else:
+        named = tuple(sorted({moment for pattern, moment in TIMES_OF_DAY if pattern.search(text)}))
+        doses = _doses_per_day(text)
+        if not named and MEALS.search(text) and (doses or 3) in MEAL_TIMES:
+            doses = doses or 3
+            default_times = MEAL_TIMES[doses]
+        elif named and (doses is None or doses == len(named)):
+            doses, default_times = len(named), named
+        elif doses is None and interval_days > 1:
+            doses = 1
+
+    if doses is None and not times:
+        raise FrequencyError(f'unrecognized frequency {frequency!r}')
+    if not 0 < (doses or len(times)) <= 24 or interval_days < 1:
+        raise FrequencyError(f'unrecognized frequency {frequency!r}')
+    return Rule(times or default_times or DEFAULT_TIMES.get(doses) or spaced(doses), interval_days)
+
+
+def parse_times(text):
+    """Clock times from '09:00, 21:00'; raises FrequencyError"""
+    times = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d{1,2})(?::(\d{2}))?\s*(am|pm)?', part.lower())
+        if not match:
+            raise FrequencyError(f'invalid time {part!r}')
+        hour, minute = int(match.group(1)), int(match.group(2) or 0)
+        if match.group(3):
+            if not 1 <= hour <= 12:
+                raise FrequencyError(f'invalid time {part!r}')
+            hour = hour % 12 + (12 if match.group(3) == 'pm' else 0)
+        if hour > 23 or minute > 59:
+            raise FrequencyError(f'invalid time {part!r}')
+        times.append(time(hour, minute))
+    return tuple(sorted(set(times)))
+
+
+def rule_for(reminder):
+    return parse(reminder.frequency, [time.fromisoformat(value) for value in reminder.dose_times])
+
+
+def occurrences(rule, start_date, end_date, first, last):
+    """(date, time) of every dose of a rule in [first, last] for a reminder running start_date..end_date"""
+    first = max(first, start_date)
+    last = min(last, end_date) if end_date else last
+    day = first + timedelta(days=-(first - start_date).days % rule.interval_days)
+    while day <= last:
+        for moment in rule.times:
+            yield day, moment
+        day += timedelta(days=rule.interval_days)
+
+
+def _counted(reminder):
+    # Intakes of inactive reminders are not counted in adherence (see adherence.py)
+    return reminder.is_active and reminder.prescription.is_active
+
+
+def _materialize_batch(reminders, first, last):
+    """
+    Insert the missing intakes of a batch of reminders; returns (created,
+    unreadable reminder ids). bulk_create() sends no signals, so the new
+    rows are counted in the adherence rollup here.
+    """
+    wanted, unreadable = [], []
+    for reminder in reminders:
+        if not _counted(reminder):
+            continue
+        try:
+            rule = rule_for(reminder)
+        except ValueError:  # Including FrequencyError and malformed dose_times
+            unreadable.append(reminder.pk)
+            continue
+        wanted.extend((reminder.pk, reminder.prescription.patient_id, day, moment) for day, moment in occurrences(
+            rule, reminder.start_date, reminder.end_date, first, last))
+    if not wanted:
+        return 0, unreadable
+
+    reminder_ids = {row[0] for row in wanted}
+    with transaction.atomic():
+        # Concurrent runs over the same reminders wait here, so the rows read
+        # below are all that exist and the new ones are counted once
+        list(MedicationReminder.objects.select_for_update().filter(pk__in=reminder_ids).values_list('pk'))
+        existing = set(
+            MedicationIntake.objects.filter(
+                reminder_id__in=reminder_ids, intake_date__range=(first, last),
+            ).values_list('reminder_id', 'intake_date', 'intake_time')
+        )
+        new = [row for row in wanted if (row[0], row[2], row[3]) not in existing]
+        if not new:
+            return 0, unreadable
+        MedicationIntake.objects.bulk_create([
+            MedicationIntake(reminder_id=reminder_id, intake_date=day, intake_time=moment)
+            for reminder_id, _, day, moment in new
+        ], batch_size=1000, ignore_conflicts=True)
+
+        # Nothing sends signals here: count the new doses and refresh the
+        # patients' dashboards
+        deltas = defaultdict(lambda: [0, 0])
+        for _, patient_id, day, _ in new:
+            deltas[patient_id, day][0] += 1
+            deltas[None, day][0] += 1
+        adherence.apply(deltas)
+        patients = {row[1] for row in new}
+        transaction.on_commit(lambda: dashboard_cache.invalidate_model('patient.MedicationIntake', patients))
+    return len(new), unreadable
+
+
+def active_reminders(first, last):
+    """Active reminders of active prescriptions running at some point in [first, last]"""
+    return (
+        MedicationReminder.objects.filter(
+            Q(end_date__isnull=True) | Q(end_date__gte=first),
+            is_active=True, prescription__is_active=True, start_date__lte=last,
+        ).select_related('prescription').only(
+            'frequency', 'dose_times', 'start_date', 'end_date', 'is_active',
+            'prescription__patient_id', 'prescription__is_active',
+        ).order_by('pk')
+    )
+
+
+def materialize(today=None, days=HORIZON_DAYS, reminders=None, batch_size=BATCH_SIZE):
+    """
+    Create the missing intakes from today over the next `days` days, for
+    the given reminders (with their prescription loaded) or every active
+    one. Returns a summary dict.
+    """
+    first = today or timezone.localdate()
+    last = first + timedelta(days=days - 1)
+    reminders = iter(active_reminders(first, last).iterator(chunk_size=batch_size) if reminders is None else reminders)
+    summary = {'reminders': 0, 'created': 0, 'unreadable': []}
+    while batch := list(islice(reminders, batch_size)):
+        created, unreadable = _materialize_batch(batch, first, last)
+        summary['reminders'] += len(batch)
+        summary['created'] += created
+        summary['unreadable'] += unreadable
+    return summary
@@ -0,0 +1,83 @@
+"""
+Data for the patient dashboard.
+
+dashboard_context() assembles everything patient/dashboard.html shows in a
+fixed number of queries: one per block, whatever the number of records,
+appointments or medications. Related rows the template reads (an
+appointment's clinic, a dose's reminder) are joined in with
+select_related, adherence is summed from the DailyAdherence rollup
+(see adherence.py) and the unread count is a column of the profile (see
+unread.py). Each block is cached per patient (see core/dashboard_cache.py),
+so a warm page load only reads the cache.
+"""
+from django.utils import timezone
+
+from core import dashboard_cache
+
+from . import adherence
+from .models import Appointment, MedicationIntake, TransferRequest, TreatmentRecord
+
+RECENT_TREATMENT_RECORDS = 5
+UPCOMING_APPOINTMENTS = 3
+# The block holds more appointments than are shown, so the list stays full
+# when some of them pass while it is cached
+UPCOMING_APPOINTMENTS_CACHED = 2 * UPCOMING_APPOINTMENTS
+
+
+def treatment_records(patient):
+    return list(TreatmentRecord.objects.filter(patient=patient).order_by('-record_date')[:RECENT_TREATMENT_RECORDS])
+
+
+def unread_count(patient):
+    return patient.unread_notifications
+
+
+def upcoming_appointments(patient, now, limit=UPCOMING_APPOINTMENTS):
+    return list(
+        Appointment.objects.filter(
+            patient=patient,
+            appointment_date__gte=now,
+            status__in=['scheduled', 'confirmed']
+        ).select_related('clinic').order_by('appointment_date')[:limit]
+    )
+
+
+def cached_upcoming_appointments(patient, now):
+    """The upcoming appointments block, without those that have passed since it was cached"""
+    appointments = dashboard_cache.get_block(
+        'patient.upcoming_appointments', patient.id,
+        lambda: upcoming_appointments(patient, now, UPCOMING_APPOINTMENTS_CACHED))
+    return [appointment for appointment in appointments if appointment.appointment_date >= now][:UPCOMING_APPOINTMENTS]
+
+
+def todays_medications(patient, today):
+    return list(
+        MedicationIntake.objects.filter(
+            reminder__prescription__patient=patient,
+            intake_date=today,
+            reminder__is_active=True
+        ).select_related('reminder')
+    )
+
+
+def dashboard_context(patient):
+    """Template context for patient/dashboard.html"""
+    now = timezone.now()
+    today = timezone.localdate(now)
+    get_block = dashboard_cache.get_block
+    # Adherence and today's doses change with the date as well as with intakes
+    medication_adherence = get_block(
+        'patient.adherence', patient.id, lambda: adherence.patient_summary(patient, today), vary=today)
+
+    return {
+        'patient': patient,
+        # Not shown on the page; left lazy so it costs no query
+        'transfer_requests': TransferRequest.objects.filter(patient=patient).select_related('from_clinic', 'to_clinic'),
+        'treatment_records': get_block('patient.treatment_records', patient.id, lambda: treatment_records(patient)),
+        'unread_count': unread_count(patient),
+        'adherence_percentage': round(medication_adherence['percentage'], 1),
+        'adherence_trend': medication_adherence['trend'],
+        'upcoming_appointments': cached_upcoming_appointments(patient, now),
+        'medications': get_block(
+            'patient.medications', patient.id, lambda: todays_medications(patient, today), vary=today),
+    }
@@ -0,0 +1,71 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import adherence, metric_summaries, unread
+from .models import HealthMetric, MedicationIntake, MedicationReminder, Notification
+
+
+@receiver(post_init, sender=MedicationIntake)
+def snapshot_intake(sender, instance, **kwargs):
+    adherence.snapshot(instance)
+
+
+@receiver(post_save, sender=MedicationIntake)
+def update_daily_adherence(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    adherence.record_change(instance, created)
+
+
+@receiver(post_delete, sender=MedicationIntake)
+def remove_from_daily_adherence(sender, instance, **kwargs):
+    adherence.record_deleted(instance)
+
+
+@receiver(post_init, sender=MedicationReminder)
+def snapshot_reminder_active(sender, instance, **kwargs):
+    if 'is_active' not in instance.get_deferred_fields():
+        instance._was_active = instance.is_active if instance.pk else None
+
+
+@receiver(post_save, sender=MedicationReminder)
+def move_reminder_intakes(sender, instance, created, raw=False, **kwargs):
+    # A new reminder has no intakes yet
+    if raw or created:
+        return
+    was_active = getattr(instance, '_was_active', None)
+    if was_active is not None and was_active != instance.is_active:
+        adherence.record_reminder_toggled(instance)
+    instance._was_active = instance.is_active
+
+
+@receiver(post_save, sender=HealthMetric)
+def update_metric_summary(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        metric_summaries.record_created(instance)
+    else:
+        metric_summaries.schedule_refresh(instance)
+
+
+@receiver(post_delete, sender=HealthMetric)
+def refresh_metric_summary(sender, instance, **kwargs):
+    metric_summaries.schedule_refresh(instance)
+
+
+@receiver(post_init, sender=Notification)
+def snapshot_notification_unread(sender, instance, **kwargs):
+    unread.snapshot(instance)
+
+
+@receiver(post_save, sender=Notification)
+def update_unread_count(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    unread.record_change(instance, created)
+
+
+@receiver(post_delete, sender=Notification)
+def remove_from_unread_count(sender, instance, **kwargs):
+    unread.record_deleted(instance)
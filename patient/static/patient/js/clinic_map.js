@@ -0,0 +1,124 @@
+/*
+ * Nearby clinics map.
+ *
+ * Renders the compact marker feed from patient:nearby_clinics_data into
+ * #clinic-map with Leaflet. The feed is requested for the current zoom and
+ * viewport, so dense areas arrive as server-side clusters that split as the
+ * map zooms in. Clinic names come from the list cards already on the page
+ * (data-clinic-id), so the feed only carries ids and coordinates.
+ */
+(function () {
+    'use strict';
+
+    var COLORS = { current: '#198754', other: '#dc3545', origin: '#0d6efd' };
+
+    function marker(lat, lng, color) {
+        return L.circleMarker([lat, lng], {
+            radius: 8,
+            color: color,
+            weight: 2,
+            fillColor: color,
+            fillOpacity: 0.7
+        });
+    }
+
+    function clusterMarker(map, lat, lng, count) {
+        var size = count < 10 ? 30 : count < 100 ? 38 : 46;
+        var icon = L.divIcon({
+            className: '',
+            html: '<div style="width:' + size + 'px;height:' + size + 'px;line-height:' + size + 'px;' +
+                  'border-radius:50%;background:rgba(220,53,69,0.75);color:#fff;' +
+                  'text-align:center;font-weight:600;">' + count + '</div>',
+            iconSize: [size, size]
+        });
+        return L.marker([lat, lng], { icon: icon }).on('click', function () {
+            map.setView([lat, lng], Math.min(map.getZoom() + 2, map.getMaxZoom()));
+        });
+    }
+
+    function clinicName(id) {
+        var card = document.querySelector('[data-clinic-id="' + id + '"] .clinic-name');
+        return card ? card.textContent.trim() : 'Clinic #' + id;
+    }
+
+    function indexOf(fields) {
+        var idx = {};
+        fields.forEach(function (field, i) { idx[field] = i; });
+        return idx;
+    }
+
+    function draw(map, layer, data) {
+        layer.clearLayers();
+
+        var idx = indexOf(data.fields);
+        data.clinics.forEach(function (row) {
+            marker(row[idx.lat], row[idx.lng], COLORS[row[idx.category]] || COLORS.other)
+                .bindPopup(clinicName(row[idx.id]) + ' - ' + row[idx.distance_km] + ' km')
+                .addTo(layer);
+        });
+
+        var cidx = indexOf(data.cluster_fields || []);
+        (data.clusters || []).forEach(function (row) {
+            clusterMarker(map, row[cidx.lat], row[cidx.lng], row[cidx.count]).addTo(layer);
+        });
+    }
+
+    function fail(container) {
+        container.innerHTML = '<p class="text-muted small p-3 mb-0">' +
+            'Map could not be loaded, showing clinics list only.</p>';
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        var container = document.getElementById('clinic-map');
+        if (!container || typeof L === 'undefined') {
+            return;
+        }
+
+        var baseUrl = container.dataset.url;
+        var map = null;
+        var layer = null;
+        var sequence = 0;
+
+        function load(zoom, bbox) {
+            var url = baseUrl + '&zoom=' + zoom + (bbox ? '&bbox=' + bbox : '');
+            return fetch(url, { credentials: 'same-origin' }).then(function (response) {
+                if (!response.ok) {
+                    throw new Error('HTTP ' + response.status);
+                }
+                return response.json();
+            });
+        }
+
+        function refresh() {
+            var current = ++sequence;
+            load(map.getZoom(), map.getBounds().toBBoxString())
+                .then(function (data) {
+                    // Ignore responses overtaken by a later pan or zoom
+                    if (current === sequence) {
+                        draw(map, layer, data);
+                    }
+                })
+                .catch(function () { fail(container); });
+        }
+
+        load(12).then(function (data) {
+            map = L.map(container).setView(data.origin, 12);
+            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+                maxZoom: 19,
+                attribution: '&copy; OpenStreetMap contributors'
+            }).addTo(map);
+
+            marker(data.origin[0], data.origin[1], COLORS.origin)
+                .bindPopup('Your Current Location')
+                .addTo(map);
+
+            layer = L.layerGroup().addTo(map);
+            draw(map, layer, data);
+            map.on('moveend', refresh);
+
+            if (data.bounds) {
+                map.fitBounds([data.origin, data.bounds[0], data.bounds[1]], { padding: [24, 24], maxZoom: 14 });
+            }
+        }).catch(function () { fail(container); });
+    });
+})();
@@ -0,0 +1,101 @@
+/*
+ * Health metric trend chart.
+ *
+ * Draws one metric from patient:health_metric_series into #metric-chart as
+ * an SVG line. Short ranges use the raw readings; longer ranges ask for
+ * daily or weekly buckets and shade the min-max band behind the average.
+ * The server downsamples either way, so the chart never gets more points
+ * than it has pixels.
+ */
+(function () {
+    'use strict';
+
+    var SVG = 'http://www.w3.org/2000/svg';
+    var PAD = 24;
+
+    // The server answers raw queries over more than 7 days with hourly buckets
+    function bucketFor(days) {
+        if (days <= 7) { return 'raw'; }
+        if (days <= 30) { return 'hour'; }
+        return days <= 365 ? 'day' : 'week';
+    }
+
+    function svgElement(name, attrs) {
+        var el = document.createElementNS(SVG, name);
+        Object.keys(attrs).forEach(function (key) { el.setAttribute(key, attrs[key]); });
+        return el;
+    }
+
+    function draw(container, data) {
+        var width = container.clientWidth;
+        var height = container.clientHeight;
+        var raw = data.bucket === 'raw';
+        var rows = data.points;
+        var low = rows.map(function (r) { return r[1]; });
+        var high = rows.map(function (r) { return raw ? r[1] : r[2]; });
+        var line = rows.map(function (r) { return raw ? r[1] : r[3]; });
+        var minY = Math.min.apply(null, low);
+        var maxY = Math.max.apply(null, high);
+        var spanY = maxY - minY || 1;
+        var spanX = data.to - data.from || 1;
+
+        function x(t) { return PAD + (t - data.from) / spanX * (width - 2 * PAD); }
+        function y(v) { return height - PAD - (v - minY) / spanY * (height - 2 * PAD); }
+
+        var svg = svgElement('svg', { width: width, height: height });
+        if (!raw) {
+            var band = rows.map(function (r, i) { return x(r[0]) + ',' + y(high[i]); })
+                .concat(rows.slice().reverse().map(function (r, i) {
+                    return x(r[0]) + ',' + y(low[rows.length - 1 - i]);
+                }));
+            svg.appendChild(svgElement('polygon', { points: band.join(' '), fill: 'rgba(13,110,253,0.15)' }));
+        }
+        svg.appendChild(svgElement('polyline', {
+            points: rows.map(function (r, i) { return x(r[0]) + ',' + y(line[i]); }).join(' '),
+            fill: 'none', stroke: '#0d6efd', 'stroke-width': 2
+        }));
+        [[maxY, PAD], [minY, height - PAD]].forEach(function (label) {
+            var text = svgElement('text', { x: 2, y: label[1], 'font-size': 11, fill: '#6c757d' });
+            text.textContent = Math.round(label[0] * 10) / 10;
+            svg.appendChild(text);
+        });
+        container.replaceChildren(svg);
+    }
+
+    function load() {
+        var container = document.getElementById('metric-chart');
+        var status = document.getElementById('metric-chart-status');
+        var days = parseInt(document.getElementById('metric-chart-range').value, 10);
+        var from = new Date(Date.now() - days * 86400000);
+        var params = new URLSearchParams({
+            metric_type: document.getElementById('metric-chart-type').value,
+            from: from.toISOString(),
+            bucket: bucketFor(days),
+            points: Math.max(Math.floor(container.clientWidth / 3), 3)
+        });
+
+        fetch(container.dataset.url + '?' + params.toString(), { credentials: 'same-origin' })
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                if (data.error) { throw new Error(data.error); }
+                if (!data.points.length) {
+                    container.replaceChildren();
+                    status.textContent = 'No readings in this range.';
+                    return;
+                }
+                draw(container, data);
+                status.textContent = data.downsampled
+                    ? 'Showing ' + data.points.length + ' of ' + data.total + ' points.' : '';
+            })
+            .catch(function () {
+                status.textContent = 'Could not load the chart.';
+            });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        if (!document.getElementById('metric-chart')) { return; }
+        document.getElementById('metric-chart-type').addEventListener('change', load);
+        document.getElementById('metric-chart-range').addEventListener('change', load);
+        load();
+    });
+})();
@@ -1,7 +1,31 @@
-from django.test import TestCase
-from django.contrib.auth.models import User
+import os
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from clinic.models import ClinicProfile, Disease
+from admin_app import rollup
+from patient import (
+    adherence, anomaly, archive, dispatch, ingest, metric_summaries, nearby, notify, prescriptions, retention, schedule,
+    services, timeseries, unread, views,
+)
 from patient.forms import PatientRegistrationForm
-from patient.models import PatientProfile
+from emergency.models import EmergencyAlert
+from patient.models import (
+    AnomalyScan, Appointment, DailyAdherence, DeviceToken, HealthMetric, MedicationIntake, MedicationReminder,
+    MetricSummary, Notification, PatientProfile, Prescription, TreatmentRecord,
+)
 
 class PatientRegistrationFormTest(TestCase):
     def test_form_valid_data(self):
@@ -78,3 +102,976 @@ class PatientRegistrationFormTest(TestCase):
         form = PatientRegistrationForm(data=form_data)
         self.assertFalse(form.is_valid())
         self.assertIn('consent_given', form.errors)
+
+
+class NearbyClinicsMapDataTest(TestCase):
+    def setUp(self):
+        patient_group = Group.objects.create(name='Patient')
+        self.clinics = []
+        for i in range(3):
+            user = User.objects.create_user(username=f'clinic{i}', password='TestPass123!')
+            self.clinics.append(ClinicProfile.objects.create(
+                user=user,
+                name=f'Clinic {i}',
+                address='Test Street',
+                phone_number='+1234567890',
+                location='Delhi',
+                latitude=28.61 + i * 0.2,
+                longitude=77.20,
+                is_approved=True
+            ))
+        user = User.objects.create_user(username='mappatient', password='TestPass123!')
+        user.groups.add(patient_group)
+        self.patient = PatientProfile.objects.create(
+            user=user,
+            date_of_birth='1990-01-01',
+            phone_number='+1234567890',
+            address='Test Street',
+            current_location='Delhi',
+            current_clinic=self.clinics[0]
+        )
+        self.client.force_login(user)
+
+    def test_map_data_is_compact(self):
+        """Test the feed returns one row per clinic within range"""
+        response = self.client.get(reverse('patient:nearby_clinics_data'), {'lat': 28.61, 'lng': 77.20})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        data = response.json()
+        self.assertEqual(data['fields'], ['id', 'lat', 'lng', 'distance_km', 'category'])
+        self.assertEqual(data['clinics'][0], [self.clinics[0].id, 28.61, 77.2, 0.0, 'current'])
+        # Clinic 2 is ~44 km away; all three are inside the 50 km radius
+        self.assertEqual([row[0] for row in data['clinics']], [c.id for c in self.clinics])
+        self.assertEqual({row[4] for row in data['clinics'][1:]}, {'other'})
+
+    def test_map_data_filters_by_disease(self):
+        """Test clinics treating only other diseases are left out"""
+        malaria = Disease.objects.create(name='Malaria')
+        hiv = Disease.objects.create(name='HIV')
+        self.clinics[1].diseases_treated.add(malaria)
+        self.clinics[2].diseases_treated.add(hiv)
+        response = self.client.get(reverse('patient:nearby_clinics_data'), {'lat': 28.61, 'lng': 77.20})
+        # Patients without treatment records are matched as HIV patients
+        self.assertEqual([row[0] for row in response.json()['clinics']],
+                         [self.clinics[0].id, self.clinics[2].id])
+
+    def test_map_data_clusters_at_coarse_zoom(self):
+        """Test the feed returns clusters when zoomed out"""
+        url = reverse('patient:nearby_clinics_data')
+        data = self.client.get(url, {'lat': 28.61, 'lng': 77.20, 'zoom': 3}).json()
+        self.assertEqual(data['clusters'], [[28.81, 77.2, 3]])
+        self.assertEqual(data['clinics'], [])
+
+        data = self.client.get(url, {'lat': 28.61, 'lng': 77.20, 'zoom': 12}).json()
+        self.assertEqual(data['clusters'], [])
+        self.assertEqual(len(data['clinics']), 3)
+
+    def test_cluster_hierarchy_is_cached_per_region(self):
+        """Test repeated zooms reuse the cached hierarchy"""
+        cache.clear()
+        first = nearby.cluster_index(self.patient, (28.61, 77.20))
+        with self.assertNumQueries(1):  # Only the patient's diseases are read
+            second = nearby.cluster_index(self.patient, (28.6101, 77.2001))
+        self.assertEqual(first.rows, second.rows)
+
+    def test_map_data_requires_coordinates(self):
+        """Test invalid coordinates are rejected"""
+        response = self.client.get(reverse('patient:nearby_clinics_data'), {'lat': 'north'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_defers_map_to_script(self):
+        """Test the page links the feed instead of inlining map HTML"""
+        response = self.client.get(reverse('patient:nearby_clinics'), {'lat': 28.61, 'lng': 77.20})
+        self.assertContains(response, 'id="clinic-map"')
+        self.assertContains(response, 'patient/js/clinic_map.js')
+        self.assertEqual(len(response.context['other_clinics']), 2)
+
+
+class PatientRecordsTestCase(TestCase):
+    """A patient with one medication, appointment, treatment record and notification"""
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='clinic', password='TestPass123!')
+        self.clinic = ClinicProfile.objects.create(user=user, name='Clinic', address='Test Street',
+                                                   phone_number='+1234567890', location='Delhi')
+        user = User.objects.create_user(username='patient', password='TestPass123!')
+        user.groups.add(Group.objects.create(name='Patient'))
+        self.patient = PatientProfile.objects.create(
+            user=user, date_of_birth='1990-01-01', phone_number='+1234567890',
+            address='Test Street', current_location='Delhi', current_clinic=self.clinic
+        )
+        self.prescription = Prescription.objects.create(patient=self.patient, clinic=self.clinic,
+                                                        doctor=user, diagnosis='Test')
+        self.client.force_login(user)
+        self.add_records(1)
+
+    def add_records(self, count):
+        now = timezone.now()
+        for i in range(count):
+            reminder = MedicationReminder.objects.create(
+                prescription=self.prescription, medication_name=f'Drug {i}', dosage='1 tablet',
+                frequency='twice daily', start_date=now.date()
+            )
+            for hour, taken in [(8, True), (20, False)]:
+                MedicationIntake.objects.create(reminder=reminder, intake_time=time(hour), has_taken=taken,
+                                                intake_date=timezone.localdate(now))
+            Appointment.objects.create(patient=self.patient, clinic=self.clinic,
+                                       appointment_date=now + timedelta(days=i + 1))
+            TreatmentRecord.objects.create(patient=self.patient, clinic=self.clinic, details='Checkup')
+            Notification.objects.create(patient=self.patient, notification_type='general',
+                                        title='Hi', message='Hello')
+
+
+class PatientDashboardTest(PatientRecordsTestCase):
+    def dashboard_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('patient:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.context
+
+    def test_context_is_one_query_per_block(self):
+        """Test the service reads each block with a single query, and nothing once cached"""
+        self.patient.refresh_from_db()
+        with self.assertNumQueries(4):
+            context = services.dashboard_context(self.patient)
+        self.assertEqual(context['adherence_percentage'], 50.0)
+        self.assertEqual(context['unread_count'], 1)
+        self.assertEqual(context['medications'][0].reminder.medication_name, 'Drug 0')
+        self.assertEqual(context['upcoming_appointments'][0].clinic, self.clinic)
+
+        with self.assertNumQueries(0):
+            services.dashboard_context(self.patient)
+
+    def test_query_count_does_not_grow_with_records(self):
+        """Test rendering the page costs the same with more medications and appointments"""
+        baseline, _ = self.dashboard_queries()
+        self.add_records(4)
+        queries, context = self.dashboard_queries()
+        self.assertEqual(queries, baseline)
+        self.assertEqual(len(context['medications']), 10)
+        self.assertEqual(len(context['upcoming_appointments']), services.UPCOMING_APPOINTMENTS)
+
+
+    def test_passed_appointments_leave_the_cached_block(self):
+        """Test appointments that pass while the block is cached are no longer shown as upcoming"""
+        self.add_records(4)
+        self.patient.refresh_from_db()
+        now = timezone.now()
+        services.dashboard_context(self.patient)
+        later = now + timedelta(days=1, hours=1)
+        with mock.patch('django.utils.timezone.now', return_value=later), \
+                mock.patch.object(services, 'upcoming_appointments') as query:
+            appointments = services.dashboard_context(self.patient)['upcoming_appointments']
+        query.assert_not_called()
+        self.assertEqual(len(appointments), services.UPCOMING_APPOINTMENTS)
+        self.assertTrue(all(appointment.appointment_date >= later for appointment in appointments))
+
+class DailyAdherenceTest(PatientRecordsTestCase):
+    def stored_rows(self):
+        return {
+            (row.patient_id, row.date): [row.scheduled, row.taken]
+            for row in DailyAdherence.objects.all() if row.scheduled or row.taken
+        }
+
+    def assertRollupMatchesIntakes(self):
+        self.assertEqual(self.stored_rows(), dict(adherence.expected_rows()))
+
+    def test_rollup_follows_intakes_and_reminders(self):
+        """Test the daily rows follow intake saves, deletes and reminder toggles"""
+        self.assertRollupMatchesIntakes()
+        today = timezone.localdate()
+        self.assertEqual(self.stored_rows()[(self.patient.id, today)], [2, 1])
+
+        intake = MedicationIntake.objects.get(has_taken=False)
+        intake.has_taken = True
+        intake.save()
+        MedicationIntake.objects.create(reminder=intake.reminder, intake_time=time(12),
+                                        intake_date=today - timedelta(days=3))
+        self.assertRollupMatchesIntakes()
+        self.assertEqual(self.stored_rows()[(None, today)], [2, 2])
+
+        reminder = MedicationReminder.objects.get()
+        reminder.is_active = False
+        reminder.save()
+        self.assertEqual(self.stored_rows(), {})
+        reminder.is_active = True
+        reminder.save()
+        MedicationIntake.objects.filter(intake_time=time(12)).get().delete()
+        self.assertRollupMatchesIntakes()
+
+    def test_summary_reads_one_row_per_day(self):
+        """Test adherence and its trend come from one query over the daily rows"""
+        MedicationIntake.objects.create(reminder=MedicationReminder.objects.get(), intake_time=time(9),
+                                        intake_date=timezone.localdate() - timedelta(days=1), has_taken=True)
+        with self.assertNumQueries(1):
+            summary = adherence.patient_summary(self.patient, timezone.localdate())
+        self.assertEqual(summary['percentage'], 66.67)
+        self.assertEqual(len(summary['trend']), adherence.TREND_DAYS)
+        self.assertEqual([day['rate'] for day in summary['trend'][-3:]], [None, 100.0, 50.0])
+
+    def test_rebuild_command(self):
+        """Test the rebuild command recounts drifted rows"""
+        DailyAdherence.objects.update(taken=0)
+        call_command('rebuild_daily_adherence', stdout=StringIO())
+        self.assertRollupMatchesIntakes()
+
+
+class LTTBTest(SimpleTestCase):
+    def test_keeps_ends_and_extremes(self):
+        """Test downsampling keeps the endpoints and a spike a stride would miss"""
+        x = np.arange(1000)
+        y = np.sin(x / 50)
+        y[333] = 10
+        keep = timeseries.lttb(x, y, 50)
+        self.assertEqual(len(keep), 50)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertIn(333, keep)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+
+    def test_short_series_unchanged(self):
+        """Test series at or under the threshold are returned whole"""
+        self.assertEqual(list(timeseries.lttb([1, 2, 3], [4, 5, 6], 10)), [0, 1, 2])
+
+
+class HealthMetricSeriesTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        start = timezone.make_aware(datetime(2026, 1, 1))
+        HealthMetric.objects.bulk_create([
+            HealthMetric(patient=self.patient, metric_type='heart_rate', value=60 + i % 24,
+                         recorded_at=start + timedelta(hours=i))
+            for i in range(24 * 14)
+        ] + [HealthMetric(patient=self.patient, metric_type='weight', value=70, recorded_at=start)])
+        self.url = reverse('patient:health_metric_series')
+
+    def test_daily_buckets_from_one_query(self):
+        """Test buckets carry min/max/avg/count and are grouped in the database"""
+        with self.assertNumQueries(1):
+            data = timeseries.series(self.patient, 'heart_rate', timezone.make_aware(datetime(2026, 1, 1)),
+                                     timezone.make_aware(datetime(2026, 1, 7, 23, 59)), 'day')
+        self.assertEqual(data['total'], 7)
+        self.assertEqual(data['points'][0][1:], [60, 83, 71.5, 24])
+
+    def test_raw_points_are_bounded(self):
+        """Test raw readings are downsampled, and long raw ranges are answered with hourly buckets"""
+        response = self.client.get(self.url, {'metric_type': 'heart_rate', 'from': '2026-01-01',
+                                              'to': '2026-01-07', 'points': 100})
+        data = response.json()
+        self.assertEqual(data['bucket'], 'raw')
+        self.assertGreater(data['total'], 100)
+        self.assertEqual(len(data['points']), 100)
+        self.assertTrue(data['downsampled'])
+
+        data = self.client.get(self.url, {'metric_type': 'heart_rate', 'from': '2026-01-01',
+                                          'to': '2026-01-31', 'points': 100}).json()
+        self.assertEqual((data['bucket'], data['total'], len(data['points'])), ('hour', 24 * 14, 100))
+        response = self.client.get(self.url, {'metric_type': 'heart_rate', 'from': '2026-01-01',
+                                              'to': '2026-01-31', 'points': 0})
+        self.assertEqual(response.status_code, 400)
+        data = self.client.get(self.url, {'metric_type': 'heart_rate', 'from': '2026-01-01',
+                                          'to': '2026-01-02', 'points': 0}).json()
+        self.assertEqual((data['bucket'], len(data['points'])), ('raw', data['total']))
+
+        data = self.client.get(self.url, {'metric_type': 'heart_rate', 'from': '2026-01-01',
+                                          'to': '2026-01-31', 'bucket': 'week'}).json()
+        self.assertEqual([row[4] for row in data['points']], [96, 168, 72])
+
+    def test_invalid_query(self):
+        """Test unknown metrics, buckets and ranges are rejected"""
+        for params in [{'metric_type': 'mood'},
+                       {'metric_type': 'weight', 'bucket': 'month'},
+                       {'metric_type': 'weight', 'from': '2026-02-01', 'to': '2026-01-01'}]:
+            self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class HealthMetricArchiveTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(self.settings(HEALTH_METRIC_ARCHIVE_DIR=directory))
+        self.start = timezone.make_aware(datetime(2026, 1, 1))
+        self.end = self.start + timedelta(days=3)
+        self.recent = timezone.now() - timedelta(days=1)
+        HealthMetric.objects.bulk_create([
+            HealthMetric(patient=self.patient, metric_type='heart_rate', value=60 + i % 30 + 0.2, source='device',
+                         recorded_at=self.start + timedelta(minutes=10 * i))
+            for i in range(6 * 24 * 3)
+        ] + [
+            HealthMetric(patient=self.patient, metric_type='heart_rate', value=90,
+                         recorded_at=self.start + timedelta(minutes=5)),
+            HealthMetric(patient=self.patient, metric_type='heart_rate', value=70, source='device',
+                         recorded_at=self.recent),
+        ])
+        rollup.reconcile()
+
+    def series(self, bucket):
+        return timeseries.series(self.patient, 'heart_rate', self.start, self.recent, bucket, points=0)['points']
+
+    def test_old_device_readings_move_to_the_archive(self):
+        """Test archiving shrinks the table without changing any series or statistic"""
+        before = {bucket: self.series(bucket) for bucket in ('raw', 'hour', 'day', 'week')}
+        out = StringIO()
+        call_command('archive_health_metrics', stdout=out)
+        self.assertIn('Archived 432 readings', out.getvalue())
+
+        # The manual reading and the recent one stay in the table
+        self.assertEqual(sorted(HealthMetric.objects.values_list('value', flat=True)), [70, 90])
+        for bucket, points in before.items():
+            self.assertEqual(self.series(bucket), points, bucket)
+        self.assertEqual(rollup.reconcile(apply=False), [])
+
+        segment, = archive.segments(self.patient.pk, 'heart_rate')
+        self.assertEqual(segment['count'], 432)
+        times = np.load(os.path.join(archive.root(), str(self.patient.pk), 'heart_rate',
+                                     f"{segment['name']}.t.npy"), mmap_mode='r')
+        self.assertIsInstance(times, np.memmap)
+
+    def test_interrupted_run_is_not_archived_twice(self):
+        """Test readings already in a segment are only deleted from the table"""
+        old = HealthMetric.objects.filter(archive.ARCHIVABLE, recorded_at__lt=self.end).order_by('recorded_at')
+        times, values = timeseries.readings(self.patient, 'heart_rate', self.start, self.end)
+        manual = times == timeseries._milliseconds(self.start + timedelta(minutes=5))
+        archive._write_segment(self.patient.pk, 'heart_rate', times[~manual][:100], values[~manual][:100])
+        # A partly archived range is read once
+        self.assertEqual(len(timeseries.readings(self.patient, 'heart_rate', self.start, self.end)[0]), 433)
+
+        self.assertEqual(archive.archive(self.patient.pk, 'heart_rate', self.end, dry_run=True), 432)
+        self.assertEqual(archive.archive(self.patient.pk, 'heart_rate', self.end), 432)
+        self.assertFalse(old.exists())
+        self.assertEqual([s['count'] for s in archive.segments(self.patient.pk, 'heart_rate')], [100, 332])
+        times, values = timeseries.readings(self.patient, 'heart_rate', self.start, self.end)
+        self.assertEqual(len(times), 433)
+        self.assertTrue((np.diff(times) > 0).all())
+        self.assertEqual(values[0], 60.2)
+
+
+class AnomalyDetectionTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.start = timezone.now() - timedelta(days=2)
+        rng = np.random.default_rng(7)
+        self.add_metrics('blood_pressure_systolic', list(rng.normal(120, 3, 30).round()) + [200, 121, 150, 122])
+        self.add_metrics('blood_pressure_diastolic', list(rng.normal(80, 2, 34).round()))
+        rollup.reconcile()
+
+    def add_metrics(self, metric_type, values, offset=0):
+        HealthMetric.objects.bulk_create([
+            HealthMetric(patient=self.patient, metric_type=metric_type, value=value, unit='mmHg', source='device',
+                         recorded_at=self.start + timedelta(hours=offset + i))
+            for i, value in enumerate(values)
+        ])
+
+    def test_score_flags_thresholds_and_deviations(self):
+        """Test readings are scored against the limits and their own series' baseline"""
+        values = np.array([100.0] * 20 + [130, 60, 100] + [95.0] * 20)
+        series = np.array([1] * 23 + [2] * 20)
+        codes = np.full(43, anomaly.CODES['blood_pressure_systolic'])
+        severity, z = anomaly.score(series, codes, values)
+        self.assertEqual(list(severity[19:24]), [anomaly.NORMAL, anomaly.DEVIATION, anomaly.CRITICAL,
+                                                 anomaly.NORMAL, anomaly.NORMAL])
+        self.assertEqual(z[20], 6)
+        # A new series starts without a baseline
+        self.assertEqual(z[23], 0)
+
+    def test_scan_notifies_once_per_series(self):
+        """Test a scan sends one notification per abnormal metric and resumes from its mark"""
+        out = StringIO()
+        call_command('detect_health_anomalies', '--emergency-alerts', stdout=out)
+        self.assertIn('68 scanned, 2 flagged, 1 notifications, 1 alerts', out.getvalue())
+
+        notification = Notification.objects.get(notification_type='health_alert')
+        self.assertEqual(notification.title, 'Unusual Blood Pressure Systolic reading')
+        self.assertIn('200 mmHg', notification.message)
+        self.assertIn('was dangerously high (2 unusual readings in all)', notification.message)
+        alert = EmergencyAlert.objects.get(patient=self.patient)
+        self.assertEqual((alert.alert_type, alert.severity_level), ('system_auto', 'critical'))
+        self.assertEqual(rollup.reconcile(apply=False), [])
+        self.assertEqual(unread.repair(apply=False), [])
+
+        self.assertEqual(anomaly.scan(emergency_alerts=True), [])
+        self.add_metrics('blood_pressure_systolic', [210], offset=40)
+        summary, = anomaly.scan(emergency_alerts=True)
+        self.assertEqual((summary['scanned'], summary['notifications'], summary['alerts']), (1, 1, 0))
+        self.assertEqual(AnomalyScan.objects.get().last_metric_id, HealthMetric.objects.latest('pk').pk)
+
+    def test_metrics_keep_their_own_notifications(self):
+        """Test alerts for different metrics are not coalesced and a milder one never replaces a worse one"""
+        anomaly.scan()
+        self.add_metrics('oxygen_saturation', [80], offset=40)
+        self.add_metrics('heart_rate', [135], offset=41)
+        summary, = anomaly.scan()
+        self.assertEqual(summary['notifications'], 2)
+        alerts = {n.coalesce_key: n for n in Notification.objects.filter(notification_type='health_alert')}
+        self.assertEqual(set(alerts), {'blood_pressure_systolic', 'oxygen_saturation', 'heart_rate'})
+        self.assertIn('was dangerously low', alerts['oxygen_saturation'].message)
+        self.assertEqual(alerts['oxygen_saturation'].coalesced_count, 1)
+
+        self.add_metrics('heart_rate', [170], offset=42)
+        anomaly.scan()
+        self.add_metrics('heart_rate', [135], offset=43)
+        anomaly.scan()
+        heart_rate = Notification.objects.get(coalesce_key='heart_rate')
+        self.assertEqual(heart_rate.coalesced_count, 3)
+        self.assertEqual(heart_rate.severity, anomaly.CRITICAL)
+        self.assertIn('170 mmHg', heart_rate.message)
+        self.assertEqual(unread.repair(apply=False), [])
+
+    def test_batches_keep_their_baseline(self):
+        """Test scoring in small batches finds what one batch finds"""
+        summaries = anomaly.scan(batch_size=5)
+        self.assertEqual(len(summaries), 14)
+        self.assertEqual(sum(summary['flagged'] for summary in summaries), 2)
+
+
+class MetricSummaryTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        now = timezone.now()
+        # Weight rising by 0.5 kg a day for 100 days, two readings a day
+        for day in range(100):
+            for hours, offset in [(1, -0.25), (2, 0.25)]:
+                HealthMetric.objects.create(patient=self.patient, metric_type='weight', unit='kg',
+                                            value=50 + 0.5 * (100 - day) + offset,
+                                            recorded_at=now - timedelta(days=day, hours=hours))
+
+    def assertMatchesRecount(self):
+        stored = {s.metric_type: s for s in MetricSummary.objects.filter(patient=self.patient)}
+        for metric_type, summary in stored.items():
+            expected = metric_summaries.compute(self.patient, metric_type)
+            for field in ['count', 'latest_value', 'latest_at', 'min_value', 'max_value', 'unit']:
+                self.assertEqual(getattr(summary, field), getattr(expected, field), field)
+            self.assertAlmostEqual(summary.mean, expected.mean)
+            self.assertAlmostEqual(summary.m2, expected.m2)
+            self.assertEqual(summary.days.keys(), expected.days.keys())
+
+    def test_readings_update_the_summary(self):
+        """Test every saved or ingested reading is counted as it arrives"""
+        self.assertMatchesRecount()
+        lines = ['recorded_at,value'] + [f'{int(timezone.now().timestamp()) - 60 * i},{70 + i}' for i in range(10)]
+        ingest.ingest(self.patient, iter(lines), 'csv', {'metric_type': 'heart_rate'})
+        self.assertMatchesRecount()
+
+        summary, = [s for s in metric_summaries.for_patient(self.patient) if s['metric_type'] == 'heart_rate']
+        self.assertEqual((summary['latest_value'], summary['count'], summary['min'], summary['max']), (70, 10, 70, 79))
+        self.assertEqual(summary['std'], round(float(np.std(np.arange(70, 80))), 2))
+
+    def test_windows_and_trend(self):
+        """Test windowed figures come from the last days only and old days expire"""
+        with self.assertNumQueries(1):
+            summary, = metric_summaries.for_patient(self.patient)
+        self.assertEqual(summary['count'], 200)
+        self.assertEqual(summary['windows'][7], {'count': 14, 'avg': 98.5, 'min': 96.75, 'max': 100.25})
+        self.assertEqual(summary['windows'][90]['count'], 180)
+        self.assertEqual(summary['trend'], 0.5)
+        self.assertEqual(len(MetricSummary.objects.get().days), metric_summaries.WINDOW_DAYS)
+
+    def test_deleted_reading_refreshes_the_series(self):
+        """Test deleting readings recomputes their series once the delete commits"""
+        with self.captureOnCommitCallbacks(execute=True):
+            HealthMetric.objects.filter(patient=self.patient, value__gt=80).delete()
+        summary = MetricSummary.objects.get()
+        self.assertEqual((summary.count, summary.max_value), (119, 79.75))
+        self.assertMatchesRecount()
+
+        metric_summaries.rebuild()
+        self.assertEqual(MetricSummary.objects.get().count, 119)
+
+    def test_clinic_access(self):
+        """Test the patient's clinic can read the summaries and other clinics cannot"""
+        url = reverse('clinic:patient_metric_summaries', args=[self.patient.id])
+        self.client.force_login(self.clinic.user)
+        self.clinic.user.groups.add(Group.objects.create(name='Clinic'))
+        data = self.client.get(url).json()
+        self.assertEqual(data['summaries'][0]['latest_value'], 99.75)
+
+        self.patient.current_clinic = None
+        self.patient.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.patient.user)
+        self.assertContains(self.client.get(reverse('patient:health_metrics')), '<td>98.5</td>')
+
+
+def record_delivery(notifications):
+    record_delivery.batches.append([notification.pk for notification in notifications])
+
+
+def failing_delivery(notifications):
+    raise ConnectionError('push service unavailable')
+
+
+class NotificationDispatchTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.due = [
+            Notification.objects.create(patient=self.patient, notification_type='general', title=f'Due {i}',
+                                        message='Due', scheduled_at=now - timedelta(minutes=i))
+            for i in range(5)
+        ]
+        Notification.objects.create(patient=self.patient, notification_type='general', title='Later',
+                                    message='Later', scheduled_at=now + timedelta(hours=1))
+        record_delivery.batches = []
+
+    def test_scheduled_notifications_are_hidden_until_delivered(self):
+        """Test due notifications are delivered in batches and only then shown and counted"""
+        self.patient.refresh_from_db()
+        self.assertEqual(services.unread_count(self.patient), 1)
+        self.assertEqual(rollup.read().notifications.unread, 1)
+
+        with self.settings(NOTIFICATION_DELIVERY_HANDLERS=['patient.tests.record_delivery']):
+            out = StringIO()
+            call_command('dispatch_notifications', '--batch-size', '2', stdout=out)
+        self.assertIn('Successfully delivered 5 notifications', out.getvalue())
+        # Oldest first
+        self.assertEqual(record_delivery.batches, [[self.due[4].pk, self.due[3].pk], [self.due[2].pk, self.due[1].pk],
+                                                   [self.due[0].pk]])
+        self.patient.refresh_from_db()
+        self.assertEqual(services.unread_count(self.patient), 6)
+        self.assertEqual(unread.repair(apply=False), [])
+        self.assertEqual(rollup.reconcile(apply=False), [])
+        response = self.client.get(reverse('patient:notifications'))
+        self.assertContains(response, 'Due 4')
+        self.assertNotContains(response, 'Later')
+
+        stats = dispatch.stats()
+        self.assertEqual((stats['batches'], stats['delivered'], stats['due']), (3, 5, 0))
+        self.assertGreater(stats['average_lag_seconds'], 60)
+
+    def test_claims_do_not_overlap(self):
+        """Test concurrent claims get different rows and an expired lease is taken over"""
+        first_token, first = dispatch.claim(3)
+        second_token, second = dispatch.claim(3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({n.pk for n in first} & {n.pk for n in second})
+        self.assertEqual(dispatch.claim(3)[1], [])
+
+        # The first worker stalls past its lease; another worker takes over
+        later = timezone.now() + dispatch.lease() + timedelta(seconds=1)
+        third_token, third = dispatch.claim(3, now=later)
+        self.assertEqual({n.pk for n in third}, {n.pk for n in first})
+        self.assertEqual(dispatch.complete(first_token), 0)
+        self.assertEqual(dispatch.complete(third_token), 3)
+        self.assertEqual(dispatch.complete(second_token), 2)
+        self.assertEqual(Notification.objects.filter(delivered_at__isnull=False).count(), 5)
+
+    def test_failed_handler_releases_the_batch(self):
+        """Test a batch goes back to the queue when a handler fails"""
+        with self.settings(NOTIFICATION_DELIVERY_HANDLERS=['patient.tests.failing_delivery']), \
+                self.assertLogs('patient.dispatch', 'ERROR'):
+            self.assertEqual(dispatch.dispatch_batch(), 0)
+        self.assertEqual(dispatch.due(timezone.now()).filter(claim_token='').count(), 5)
+        self.assertEqual(dispatch.stats()['released'], 5)
+
+
+
+class UnreadNotificationCountTest(PatientRecordsTestCase):
+    def stored(self):
+        return PatientProfile.objects.values_list('unread_notifications', flat=True).get(pk=self.patient.pk)
+
+    def test_counter_follows_notifications(self):
+        """Test creating, reading, deleting and bulk-marking notifications keep the counter exact"""
+        self.assertEqual(self.stored(), 1)
+        extra = Notification.objects.create(patient=self.patient, notification_type='general',
+                                            title='Again', message='Hello')
+        Notification.objects.create(patient=self.patient, notification_type='general', title='Later',
+                                    message='Later', scheduled_at=timezone.now() + timedelta(hours=1))
+        self.assertEqual(self.stored(), 2)
+
+        self.client.get(reverse('patient:mark_notification_read', args=[extra.id]))
+        self.assertEqual(self.stored(), 1)
+        extra = Notification.objects.get(pk=extra.pk)
+        extra.save()  # Unchanged
+        extra.delete()
+        self.assertEqual(self.stored(), 1)
+
+        response = self.client.get(reverse('patient:notifications'))
+        self.assertEqual(response.context['unread_count'], 1)
+        self.client.get(reverse('patient:mark_all_notifications_read'))
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(unread.repair(apply=False), [])
+
+    def test_profile_save_keeps_counter(self):
+        """Test the profile form does not write back a count read before a notification arrived"""
+        def notify_meanwhile(profile):
+            Notification.objects.create(patient=self.patient, notification_type='general', title='New',
+                                        message='Hi')
+
+        with mock.patch('core.geocode_queue.mark_pending', side_effect=notify_meanwhile):
+            response = self.client.post(reverse('patient:profile'), {
+                'phone_number': '+1234567890', 'address': 'Test Street', 'current_location': 'Mumbai',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(PatientProfile.objects.get(pk=self.patient.pk).current_location, 'Mumbai')
+        self.assertEqual(self.stored(), 2)
+
+    def test_profile_save_inserts_a_missing_row(self):
+        """Test save() keeps its usual semantics for the profile model"""
+        pk = self.patient.pk
+        PatientProfile.objects.filter(pk=pk).delete()
+        self.patient.save()
+        self.assertTrue(PatientProfile.objects.filter(pk=pk).exists())
+
+    def test_badge_is_a_column_read(self):
+        """Test the notification count costs no query of its own"""
+        response = self.client.get(reverse('patient:dashboard'))
+        self.assertContains(response, 'Notifications (1)')
+        self.patient.refresh_from_db()
+        with self.assertNumQueries(0):
+            self.assertEqual(services.unread_count(self.patient), 1)
+
+    def test_repair_command(self):
+        """Test the repair command reports and fixes drift"""
+        PatientProfile.objects.filter(pk=self.patient.pk).update(unread_notifications=7)
+        out = StringIO()
+        call_command('repair_unread_counts', '--dry-run', stdout=out)
+        self.assertIn('1 patients have drifted counts', out.getvalue())
+        self.assertEqual(self.stored(), 7)
+
+        out = StringIO()
+        call_command('repair_unread_counts', stdout=out)
+        self.assertIn(f'patient {self.patient.pk:>8} stored      7 expected      1 (-6)', out.getvalue())
+        self.assertEqual(self.stored(), 1)
+        self.assertEqual(unread.repair(), [])
+
+    def test_drifted_counter_stops_at_zero(self):
+        """Test a decrement below zero clamps instead of failing the column constraint"""
+        PatientProfile.objects.filter(pk=self.patient.pk).update(unread_notifications=0)
+        Notification.objects.filter(patient=self.patient, is_read=False).first().delete()
+        self.assertEqual(self.stored(), 0)
+        self.assertEqual(unread.repair(apply=False), [])
+
+
+class NotificationRetentionTest(PatientRecordsTestCase):
+    def add_read(self, count, age, notification_type='medication_reminder'):
+        created_at = timezone.now() - age
+        rollup.record_created(Notification.objects.bulk_create([
+            Notification(patient=self.patient, notification_type=notification_type, title='Take your dose',
+                         message='Dose due', is_read=True, created_at=created_at)
+            for _ in range(count)
+        ]))
+
+    def assertCountersConsistent(self):
+        self.assertEqual(rollup.reconcile(apply=False), [])
+        self.assertEqual(unread.repair(apply=False), [])
+
+    def test_bursts_are_coalesced(self):
+        """Test unread notifications of one type within the window merge into one row"""
+        first = notify.send(self.patient, 'medication_reminder', 'Take Drug A', 'Dose due at 08:00')
+        second = notify.send(self.patient, 'medication_reminder', 'Take Drug B', 'Dose due at 08:05')
+        self.assertEqual(second.pk, first.pk)
+        first.refresh_from_db()
+        self.assertEqual((first.coalesced_count, first.title), (2, 'Take Drug B'))
+
+        notify.send(self.patient, 'emergency_alert', 'Alert', 'Help is on the way')
+        notify.send(self.patient, 'emergency_alert', 'Alert', 'Help is on the way')
+        self.assertEqual(Notification.objects.filter(notification_type='emergency_alert').count(), 2)
+
+        # A read notification, or one outside the window, is left alone
+        Notification.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        third = notify.send(self.patient, 'medication_reminder', 'Take Drug C', 'Dose due at 09:00')
+        self.assertNotEqual(third.pk, first.pk)
+        self.assertEqual(PatientProfile.objects.get(pk=self.patient.pk).unread_notifications, 5)
+        self.assertCountersConsistent()
+
+    def test_old_read_notifications_become_daily_digests(self):
+        """Test compaction folds old read notifications per day and keeps unread and recent ones"""
+        self.add_read(14, timedelta(days=40))
+        self.add_read(1, timedelta(days=40), 'appointment_reminder')
+        self.add_read(3, timedelta(days=41))
+        self.add_read(2, timedelta(days=2))
+        Notification.objects.filter(pk=Notification.objects.get(is_read=False).pk).update(
+            created_at=timezone.now() - timedelta(days=60))
+
+        out = StringIO()
+        call_command('compact_notifications', stdout=out)
+        self.assertIn('Compacted 18 notifications of 1 patients into 2 new digests', out.getvalue())
+        digest = Notification.objects.get(notification_type='digest',
+                                          created_at__date=timezone.localdate() - timedelta(days=40))
+        self.assertEqual(digest.message, '14 × Medication Reminder, 1 × Appointment Reminder')
+        self.assertEqual((digest.coalesced_count, digest.is_read), (15, True))
+        self.assertEqual(Notification.objects.filter(is_read=False).count(), 1)
+        self.assertEqual(Notification.objects.count(), 5)
+
+        # A later run adds to the digests of days already compacted
+        self.add_read(2, timedelta(days=40), 'general')
+        self.assertEqual(retention.compact()['digests'], 0)
+        digest.refresh_from_db()
+        self.assertEqual(digest.digest_counts, {'medication_reminder': 14, 'appointment_reminder': 1, 'general': 2})
+        self.assertCountersConsistent()
+
+    def test_rows_per_patient_are_bounded(self):
+        """Test read notifications beyond the per-patient limit are compacted however recent"""
+        self.add_read(10, timedelta(hours=1))
+        with self.settings(NOTIFICATION_MAX_PER_PATIENT=5):
+            self.assertEqual(retention.compact(dry_run=True)['compacted'], 10)
+            summary = retention.compact()
+        self.assertEqual((summary['compacted'], summary['digests']), (10, 1))
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertCountersConsistent()
+
+    def test_expired_digests_are_purged(self):
+        """Test digests older than their retention are deleted"""
+        self.add_read(3, timedelta(days=200))
+        self.assertEqual(retention.compact(), {'patients': 1, 'compacted': 3, 'digests': 1, 'purged': 0})
+        with self.settings(NOTIFICATION_DIGEST_RETENTION=timedelta(days=100)):
+            self.assertEqual(retention.compact()['purged'], 1)
+        self.assertFalse(Notification.objects.filter(notification_type='digest').exists())
+        self.assertCountersConsistent()
+
+    def test_notifications_page_is_paginated(self):
+        """Test the page shows one page of notifications at a time"""
+        self.add_read(25, timedelta(hours=1))
+        response = self.client.get(reverse('patient:notifications'))
+        self.assertEqual(len(response.context['notifications']), views.NOTIFICATIONS_PER_PAGE)
+        response = self.client.get(reverse('patient:notifications'), {'page': 2})
+        self.assertEqual(len(response.context['notifications']), 6)
+        self.assertEqual(response.context['unread_count'], 1)
+
+
+class FrequencyParserTest(SimpleTestCase):
+    def test_common_frequencies(self):
+        """Test the usual ways clinicians write frequencies parse into dose times and intervals"""
+        cases = {
+            'once daily': ((time(9),), 1),
+            'Twice a day': ((time(9), time(21)), 1),
+            'TDS': ((time(8), time(14), time(20)), 1),
+            '4 times per day': ((time(8), time(12), time(16), time(20)), 1),
+            'every 8 hours': ((time(0), time(8), time(16)), 1),
+            'q12h': ((time(8), time(20)), 1),
+            'every other day': ((time(9),), 2),
+            'once a week': ((time(9),), 7),
+            'at bedtime': ((time(21),), 1),
+            'morning and evening': ((time(8), time(19)), 1),
+            '1-0-1': ((time(8), time(21)), 1),
+            '0-0-1': ((time(21),), 1),
+            '1/2-1-1 after meals': ((time(8), time(13), time(21)), 1),
+            '1-0-1-1': ((time(8), time(19), time(21)), 1),
+            'after meals': ((time(8), time(13), time(19)), 1),
+            'twice daily with food': ((time(8), time(19)), 1),
+            'as needed': ((), 1),
+        }
+        for frequency, expected in cases.items():
+            with self.subTest(frequency=frequency):
+                self.assertEqual(tuple(schedule.parse(frequency)), expected)
+
+    def test_entered_times_replace_the_defaults(self):
+        """Test the clinician's dose times win over the frequency's defaults"""
+        times = schedule.parse_times('7:30, 9 pm')
+        self.assertEqual(times, (time(7, 30), time(21)))
+        self.assertEqual(schedule.parse('twice daily', times).times, times)
+        self.assertEqual(schedule.parse('after meals', times), schedule.Rule(times, 1))
+
+    def test_unreadable_frequencies(self):
+        """Test text without a schedule raises FrequencyError"""
+        for frequency in ['whenever', '0-0-0', 'every 5 hours', 'twice weekly', '']:
+            with self.subTest(frequency=frequency), self.assertRaises(schedule.FrequencyError):
+                schedule.parse(frequency)
+        with self.assertRaises(schedule.FrequencyError):
+            schedule.parse_times('25:00')
+
+
+class IntakeScheduleTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+        self.reminder = MedicationReminder.objects.get()
+        self.reminder.dose_times = ['08:00', '20:00']
+        self.reminder.save()
+
+    def add_reminder(self, frequency, **fields):
+        return MedicationReminder.objects.create(prescription=self.prescription, medication_name=frequency,
+                                                 dosage='1 tablet', frequency=frequency,
+                                                 start_date=fields.pop('start_date', self.today), **fields)
+
+    def intakes(self, reminder):
+        return list(MedicationIntake.objects.filter(reminder=reminder).order_by('intake_date', 'intake_time')
+                    .values_list('intake_date', 'intake_time'))
+
+    def test_materializes_the_horizon_once(self):
+        """Test intakes are created for the coming days, skipping the existing ones, and counted"""
+        ended = self.add_reminder('once daily', end_date=self.today + timedelta(days=1))
+        alternate = self.add_reminder('every other day', start_date=self.today - timedelta(days=1))
+        self.add_reminder('as needed')
+        self.add_reminder('whenever')
+        self.add_reminder('once daily', is_active=False)
+
+        out = StringIO()
+        call_command('materialize_intakes', '--days', '3', stdout=out)
+        self.assertIn('Created 7 intakes for 5 reminders', out.getvalue())
+        self.assertIn('Skipped 1 reminders with unreadable frequencies', out.getvalue())
+        self.assertEqual(len(self.intakes(self.reminder)), 6)
+        self.assertEqual(self.intakes(ended), [(self.today, time(9)), (self.today + timedelta(days=1), time(9))])
+        self.assertEqual(self.intakes(alternate), [(self.today + timedelta(days=1), time(9))])
+
+        self.assertEqual(schedule.materialize(days=3)['created'], 0)
+        self.assertEqual(schedule.materialize(today=self.today + timedelta(days=1), days=3)['created'], 3)
+        stored = {(row.patient_id, row.date): [row.scheduled, row.taken] for row in DailyAdherence.objects.all()}
+        self.assertEqual(stored, dict(adherence.expected_rows()))
+
+    def test_dashboard_shows_materialized_doses(self):
+        """Test the cached medications block is dropped when intakes are materialized"""
+        self.reminder.intakes.all().delete()
+        self.assertEqual(len(self.client.get(reverse('patient:dashboard')).context['medications']), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule.materialize()
+        self.assertEqual(len(self.client.get(reverse('patient:dashboard')).context['medications']), 2)
+
+class PrescriptionCreateTest(PatientRecordsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.today = timezone.localdate()
+
+    def parse(self, rows, **dates):
+        names, dosages, frequencies, times = zip(*rows) if rows else ((), (), (), ())
+        return prescriptions.parse('Flu', names, dosages, frequencies, times, today=self.today, **dates)
+
+    def test_reports_every_problem_before_writing(self):
+        """Test the whole medication table is validated and every error is reported"""
+        with self.assertRaises(prescriptions.PrescriptionError) as raised:
+            self.parse([
+                ('Paracetamol', '500 mg', 'twice daily', '08:00, 25:00'),
+                ('', '1 tablet', '', ''),
+                ('Ibuprofen', '200 mg', 'whenever', ''),
+                ('', '', '', ''),
+            ], start_date=str(self.today), end_date=str(self.today - timedelta(days=1)))
+        errors = raised.exception.errors
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(errors[0].startswith('Medication 1: invalid time'))
+        self.assertEqual(errors[1], 'Medication 2: enter the medication name')
+        self.assertTrue(errors[2].startswith('Medication 3: unrecognized frequency'))
+        self.assertEqual(errors[3], 'The end date is before the start date')
+
+        with self.assertRaises(prescriptions.PrescriptionError):
+            prescriptions.parse('', ['Paracetamol'], [], [], [])
+
+    def test_creates_reminders_and_intakes_in_batches(self):
+        """Test each row keeps its own frequency and times, and the doses are counted"""
+        plan = self.parse([
+            ('Paracetamol', '500 mg', 'twice daily', '07:30, 19:30'),
+            ('Ibuprofen', '200 mg', '', ''),
+            ('Cetirizine', '10 mg', 'as needed', ''),
+        ])
+        self.assertEqual(plan.start_date, self.today)
+
+        # The same number of queries for any number of medications
+        with self.assertNumQueries(16):
+            prescription = prescriptions.create(self.patient, self.clinic, self.clinic.user, plan, today=self.today)
+        self.assertEqual([medication['name'] for medication in prescription.medications],
+                         ['Paracetamol', 'Ibuprofen', 'Cetirizine'])
+        reminders = {reminder.medication_name: reminder for reminder in prescription.medication_reminders.all()}
+        self.assertEqual(reminders['Paracetamol'].dose_times, ['07:30', '19:30'])
+        self.assertEqual(reminders['Ibuprofen'].frequency, 'once daily')
+
+        intakes = MedicationIntake.objects.filter(reminder__prescription=prescription)
+        self.assertEqual(intakes.count(), 3 * schedule.HORIZON_DAYS)
+        self.assertEqual(sorted(intakes.filter(intake_date=self.today).values_list('intake_time', flat=True)),
+                         [time(7, 30), time(9), time(19, 30)])
+        self.assertFalse(intakes.filter(reminder=reminders['Cetirizine']).exists())
+        stored = {(row.patient_id, row.date): [row.scheduled, row.taken] for row in DailyAdherence.objects.all()}
+        self.assertEqual(stored, dict(adherence.expected_rows()))
+
+
+class HealthMetricIngestTest(PatientRecordsTestCase):
+    url = reverse_lazy('patient:ingest_health_metrics')
+
+    def post(self, body, content_type, **params):
+        url = f"{self.url}?{'&'.join(f'{k}={v}' for k, v in params.items())}"
+        return self.client.post(url, data=body, content_type=content_type)
+
+    def test_ndjson_rows_are_validated_and_deduplicated(self):
+        """Test good rows are stored once and bad rows are reported by line"""
+        HealthMetric.objects.create(patient=self.patient, metric_type='heart_rate', value=70,
+                                    recorded_at=timezone.make_aware(datetime(2026, 1, 1, 8)))
+        lines = [
+            '{"metric_type": "heart_rate", "recorded_at": "2026-01-01T08:00:00+00:00", "value": 71}',
+            '{"metric_type": "heart_rate", "recorded_at": "2026-01-01T08:01:00Z", "value": 72, "unit": "bpm"}',
+            '{"metric_type": "heart_rate", "recorded_at": 1767254460, "value": 73}',
+            'not json',
+            '{"metric_type": "mood", "recorded_at": 1767254520, "value": 5}',
+            '{"metric_type": "weight", "recorded_at": 1767254520000, "value": "heavy"}',
+            '',
+            '{"metric_type": "weight", "recorded_at": 1767254520000, "value": 70.5}',
+        ]
+        report = ingest.ingest(self.patient, iter(lines), 'ndjson', batch_size=4)
+        self.assertEqual((report['accepted'], report['duplicates'], report['rejected']), (2, 2, 3))
+        self.assertEqual(report['batches'], [
+            {'rows': 4, 'accepted': 1, 'duplicates': 2, 'rejected': 1},
+            {'rows': 3, 'accepted': 1, 'duplicates': 0, 'rejected': 2},
+        ])
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5, 6])
+        self.assertEqual(HealthMetric.objects.get(value=72).source, 'device')
+        self.assertEqual(HealthMetric.objects.count(), 3)
+        self.assertEqual(rollup.read().health_metrics.total, 3)
+
+    def test_devices_authenticate_with_a_token(self):
+        """Test a device posts with its API key and no CSRF token, while session posts keep the CSRF check"""
+        client = Client(enforce_csrf_checks=True)
+        out = StringIO()
+        call_command('issue_device_token', 'patient', '--name', 'Watch', stdout=out)
+        key = out.getvalue().split('Authorization: Token ')[1].strip()
+        body = 'recorded_at,value\n1767225600,61'
+
+        response = client.post(f'{self.url}?metric_type=heart_rate', data=body, content_type='text/csv',
+                               headers={'Authorization': f'Token {key}'})
+        self.assertEqual(response.json()['accepted'], 1)
+        token = DeviceToken.objects.get()
+        self.assertEqual((token.patient, token.name), (self.patient, 'Watch'))
+        self.assertIsNotNone(token.last_used_at)
+        self.assertNotEqual(token.key_digest, key)
+
+        response = client.post(self.url, data=body, content_type='text/csv', headers={'Authorization': 'Token nope'})
+        self.assertEqual(response.status_code, 401)
+        token.is_active = False
+        token.save()
+        response = client.post(self.url, data=body, content_type='text/csv', headers={'Authorization': f'Token {key}'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(client.post(self.url, data=body, content_type='text/csv').status_code, 401)
+
+        client.force_login(self.patient.user)
+        self.assertEqual(client.post(self.url, data=body, content_type='text/csv').status_code, 403)
+
+    def test_rows_lost_to_a_concurrent_sync_are_not_counted(self):
+        """Test only the rows actually written are counted when another sync stores some of them first"""
+        start = timezone.make_aware(datetime(2026, 1, 1, 8))
+        rows = [('heart_rate', start + timedelta(minutes=i), 60 + i, 'bpm') for i in range(10)]
+        insert = ingest._insert
+
+        def concurrent_sync(fields, keys, params):
+            # Stored by another request after store_batch() read the existing rows
+            HealthMetric.objects.bulk_create([
+                HealthMetric(patient=self.patient, metric_type='heart_rate', recorded_at=recorded_at, value=value)
+                for _, recorded_at, value, _ in rows[:3]
+            ])
+            return insert(fields, keys, params)
+
+        for returning in (True, False):
+            HealthMetric.objects.filter(metric_type='heart_rate').delete()
+            MetricSummary.objects.filter(metric_type='heart_rate').delete()
+            rollup.reconcile()
+            with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', returning), \
+                    mock.patch.object(ingest, '_insert', concurrent_sync):
+                self.assertEqual(ingest.store_batch(self.patient, rows), (7, 3))
+            self.assertEqual(MetricSummary.objects.get(metric_type='heart_rate').count, 7)
+            self.assertEqual(rollup.read().health_metrics.total, HealthMetric.objects.count() - 3)
+
+    def test_compact_csv_upload(self):
+        """Test a CSV stream takes the metric type from the request and can be resent safely"""
+        body = 'recorded_at,value\n' + '\n'.join(f'{1767225600 + i * 60},{60 + i}' for i in range(100))
+        data = self.post(body, 'text/csv', metric_type='heart_rate', unit='bpm').json()
+        self.assertEqual(data['accepted'], 100)
+        self.assertEqual(HealthMetric.objects.filter(metric_type='heart_rate', unit='bpm').count(), 100)
+
+        data = self.post(body, 'text/csv', metric_type='heart_rate').json()
+        self.assertEqual((data['accepted'], data['duplicates']), (0, 100))
+
+    def test_rejects_unknown_formats(self):
+        """Test the endpoint needs a POST with a supported content type"""
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertEqual(self.post('<readings/>', 'application/xml').status_code, 415)
+        data = self.post('time,bpm\n1,2', 'text/csv').json()
+        self.assertEqual((data['accepted'], data['rejected']), (0, 1))
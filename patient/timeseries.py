@@ -0,0 +1,241 @@
+"""
+Time series of a patient's health metrics for charts.
+
+series() answers (patient, metric_type, from, to, bucket) queries:
+
+* bucket 'raw' returns the readings themselves;
+* 'hour', 'day' and 'week' return min/max/avg/count per bucket, grouped
+  in the database with Trunc over the (patient, metric_type, recorded_at)
+  index.
+
+Raw readings are loaded into memory before they are downsampled, so
+requests (parse_query) only get them for ranges up to MAX_RAW_RANGE; longer
+raw queries are answered with hourly buckets, and turning downsampling off
+(points=0) is refused for them.
+
+Old device readings live in the cold archive instead of the table (see
+archive.py); both are read for the requested range and merged, archived
+buckets being grouped with NumPy on the same boundaries Trunc uses.
+
+Either way the result can be reduced to a bounded number of points with
+Largest-Triangle-Three-Buckets (LTTB), which keeps the points that shape the
+curve (peaks, dips) instead of every n-th one, so a chart of any range stays
+small. Timestamps are milliseconds since the epoch.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db.models import Avg, Count, Max, Min
+from django.db.models.functions import TruncDay, TruncHour, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import archive
+from .models import HealthMetric
+
+BUCKETS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+}
+DEFAULT_RANGE = timedelta(days=30)
+MAX_RAW_RANGE = timedelta(days=7)
+DEFAULT_POINTS = 500
+MAX_POINTS = 2000
+
+
+def lttb(x, y, threshold):
+    """
+    Indices of the points Largest-Triangle-Three-Buckets keeps to draw the
+    (x, y) curve, x ascending, with threshold points. The first and last
+    points are always kept.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket i covers [edges[i], edges[i + 1]) of the points between the ends
+    edges = (np.floor(np.arange(threshold - 1) * (n - 2) / (threshold - 2)) + 1).astype(np.intp)
+    edges[-1] = n - 1
+    keep = np.empty(threshold, dtype=np.intp)
+    keep[0], keep[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # The third corner is the average of the next bucket (the last point
+        # after the final bucket)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def _milliseconds(moment):
+    return int(moment.timestamp() * 1000)
+
+
+def readings(patient, metric_type, start, end):
+    """(timestamps in ms, values) of the readings in [start, end], oldest first"""
+    rows = list(
+        HealthMetric.objects.filter(patient=patient, metric_type=metric_type, recorded_at__range=(start, end))
+        .order_by('recorded_at').values_list('recorded_at', 'value')
+    )
+    times = np.fromiter((_milliseconds(moment) for moment, _ in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((value for _, value in rows), dtype=float, count=len(rows))
+
+    archived_times, archived_values = archive.load_range(
+        patient.pk, metric_type, _milliseconds(start), _milliseconds(end))
+    if len(archived_times):
+        # Live readings come first, so they win over an archived copy
+        times, first = np.unique(np.concatenate([times, archived_times]), return_index=True)
+        values = np.concatenate([values, archived_values])[first]
+    return times, values
+
+
+def bucket_starts(first, last, bucket):
+    """
+    Start of every bucket from the one holding `first` to the one holding
+    `last`, in ms, as Trunc computes them in the current time zone
+    """
+    tz = timezone.get_current_timezone()
+    local = timezone.localtime(first, tz)
+    starts = []
+    if bucket == 'hour':
+        # Time zone offsets are whole quarter hours and DST moves by whole
+        # hours, so local hours are an hour apart in absolute time too
+        moment = local.replace(minute=0, second=0, microsecond=0)
+        while moment <= last:
+            starts.append(_milliseconds(moment))
+            moment += timedelta(hours=1)
+    else:
+        day = local.date()
+        step = timedelta(days=1)
+        if bucket == 'week':
+            day -= timedelta(days=day.weekday())  # Weeks start on Monday
+            step = timedelta(days=7)
+        moment = timezone.make_aware(datetime.combine(day, time.min), tz)
+        while moment <= last:
+            starts.append(_milliseconds(moment))
+            day += step
+            moment = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return np.array(starts, dtype=np.int64)
+
+
+def _archived_buckets(patient, metric_type, start, end, bucket):
+    """{bucket start in ms: [min, max, sum, count]} of the archived readings in [start, end]"""
+    times, values = archive.load_range(patient.pk, metric_type, _milliseconds(start), _milliseconds(end))
+    if not len(times):
+        return {}
+    edges = bucket_starts(datetime.fromtimestamp(times[0] / 1000, tz=dt_timezone.utc),
+                          datetime.fromtimestamp(times[-1] / 1000, tz=dt_timezone.utc), bucket)
+    index = np.searchsorted(edges, times, side='right') - 1
+    # times are sorted, so each bucket is one run of equal indices
+    runs = np.concatenate([[0], np.flatnonzero(np.diff(index)) + 1])
+    counts = np.diff(np.append(runs, len(times)))
+    return {
+        int(key): [float(low), float(high), float(total), int(count)]
+        for key, low, high, total, count in zip(
+            edges[index[runs]], np.minimum.reduceat(values, runs), np.maximum.reduceat(values, runs),
+            np.add.reduceat(values, runs), counts)
+    }
+
+
+def buckets(patient, metric_type, start, end, bucket):
+    """[bucket start in ms, min, max, avg, count] rows for [start, end], oldest first"""
+    trunc = BUCKETS[bucket]('recorded_at', tzinfo=timezone.get_current_timezone())
+    rows = (
+        HealthMetric.objects.filter(patient=patient, metric_type=metric_type, recorded_at__range=(start, end))
+        .annotate(bucket=trunc).values('bucket')
+        .annotate(low=Min('value'), high=Max('value'), mean=Avg('value'), count=Count('pk'))
+        .order_by('bucket')
+    )
+    merged = _archived_buckets(patient, metric_type, start, end, bucket)
+    for row in rows:
+        key = _milliseconds(row['bucket'])
+        low, high, total, count = row['low'], row['high'], row['mean'] * row['count'], row['count']
+        if key in merged:
+            archived = merged[key]
+            low, high = min(low, archived[0]), max(high, archived[1])
+            total, count = total + archived[2], count + archived[3]
+        merged[key] = [low, high, total, count]
+    return [
+        [key, low, high, round(total / count, 2), count]
+        for key, (low, high, total, count) in sorted(merged.items())
+    ]
+
+
+def series(patient, metric_type, start, end, bucket='raw', points=DEFAULT_POINTS):
+    """
+    Chart payload for one metric; points=0 disables downsampling. Raw
+    series load every reading of the range: bound it (see parse_query).
+    """
+    if bucket == 'raw':
+        times, values = readings(patient, metric_type, start, end)
+        total = len(times)
+        keep = lttb(times, values, points) if points else np.arange(total)
+        rows = [[int(times[i]), float(values[i])] for i in keep]
+    else:
+        rows = buckets(patient, metric_type, start, end, bucket)
+        total = len(rows)
+        if points:
+            keep = lttb([row[0] for row in rows], [row[3] for row in rows], points)
+            rows = [rows[i] for i in keep]
+
+    return {
+        'metric_type': metric_type,
+        'bucket': bucket,
+        'from': _milliseconds(start),
+        'to': _milliseconds(end),
+        'total': total,
+        'downsampled': len(rows) < total,
+        'columns': ['t', 'value'] if bucket == 'raw' else ['t', 'min', 'max', 'avg', 'count'],
+        'points': rows,
+    }
+
+
+def _parse_moment(value, end_of_day=False):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f'Invalid date: {value}')
+        moment = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def parse_query(params, now=None):
+    """
+    (metric_type, start, end, bucket, points) from request parameters
+    metric_type, from, to (ISO dates or datetimes), bucket and points.
+    Raw ranges longer than MAX_RAW_RANGE get hourly buckets instead.
+    Raises ValueError for invalid input.
+    """
+    metric_type = params.get('metric_type', '')
+    if metric_type not in dict(HealthMetric.METRIC_TYPES):
+        raise ValueError('Unknown metric_type')
+
+    now = now or timezone.now()
+    end = _parse_moment(params['to'], end_of_day=True) if params.get('to') else now
+    start = _parse_moment(params['from']) if params.get('from') else end - DEFAULT_RANGE
+    if start > end:
+        raise ValueError('from must not be after to')
+
+    bucket = params.get('bucket') or 'raw'
+    if bucket != 'raw' and bucket not in BUCKETS:
+        raise ValueError('bucket must be raw, hour, day or week')
+
+    points = int(params.get('points') or DEFAULT_POINTS)
+    if points != 0 and not 3 <= points <= MAX_POINTS:
+        raise ValueError(f'points must be 0 or between 3 and {MAX_POINTS}')
+    if bucket == 'raw' and end - start > MAX_RAW_RANGE:
+        if points == 0:
+            raise ValueError(f'points=0 needs a range of at most {MAX_RAW_RANGE.days} days')
+        bucket = 'hour'
+    return metric_type, start, end, bucket, points
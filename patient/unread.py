@@ -0,0 +1,109 @@
+"""
+Unread notification counter per patient.
+
+The dashboard badge and the notifications page used to count the patient's
+unread notifications on every render. PatientProfile.unread_notifications
+keeps the count of notifications the patient can see (Notification.DELIVERED)
+and has not read instead, so showing it is a column read on the profile the
+view already loaded.
+
+Signal handlers (patient/signals.py) keep the counter current:
+
+* post_init remembers whether a notification counts, without touching the
+  database;
+* post_save and post_delete apply the difference with an F() update, so a
+  save that does not change is_read or delivery costs nothing.
+
+Code that bypasses signals (bulk_create, QuerySet.update) must call
+record_created() or adjust(). The repair_unread_counts command recounts
+every patient and fixes drift.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Notification, PatientProfile
+
+SNAPSHOT_ATTR = '_unread_snapshot'
+TRACKED_FIELDS = {'is_read', 'scheduled_at', 'delivered_at'}
+
+
+def counts(notification):
+    """Whether a notification counts as unread: delivered and not read"""
+    return not notification.is_read and (notification.scheduled_at is None or notification.delivered_at is not None)
+
+
+def snapshot(notification):
+    """Remember whether a notification counts; None when unknown (new or partly loaded)"""
+    if notification.pk is None or TRACKED_FIELDS & notification.get_deferred_fields():
+        counted = None
+    else:
+        counted = counts(notification)
+    setattr(notification, SNAPSHOT_ATTR, counted)
+
+
+def adjust(patient_id, delta):
+    """
+    Add delta to a patient's counter; a patient deleted meanwhile is skipped.
+    A counter that has drifted low stops at 0 rather than failing the
+    positive CHECK constraint; the repair command recounts it.
+    """
+    if delta:
+        PatientProfile.objects.filter(pk=patient_id).update(
+            unread_notifications=Greatest(F('unread_notifications') + delta, 0)
+        )
+
+
+def record_change(notification, created):
+    old = False if created else getattr(notification, SNAPSHOT_ATTR, None)
+    if old is None:
+        # Loaded with deferred fields: post_save runs after the UPDATE, so
+        # the previous state is gone. Counted as unchanged; the repair
+        # command picks up any difference.
+        old = counts(notification)
+    new = counts(notification)
+    adjust(notification.patient_id, int(new) - int(old))
+    setattr(notification, SNAPSHOT_ATTR, new)
+
+
+def record_deleted(notification):
+    if getattr(notification, SNAPSHOT_ATTR, None):
+        adjust(notification.patient_id, -1)
+
+
+def record_created(notifications):
+    """Count notifications inserted without signals, e.g. by bulk_create: one UPDATE per patient"""
+    for patient_id, unread in Counter(n.patient_id for n in notifications if counts(n)).items():
+        adjust(patient_id, unread)
+    for notification in notifications:
+        setattr(notification, SNAPSHOT_ATTR, counts(notification))
+
+
+def expected_counts():
+    """Recount every patient's unread notifications: {patient id: count}"""
+    return dict(
+        Notification.objects.filter(Notification.DELIVERED, is_read=False)
+        .values_list('patient_id').annotate(unread=Count('pk')).order_by()
+    )
+
+
+def repair(apply=True):
+    """
+    Compare the stored counters with a full recount. Returns the drift as
+    [(patient id, stored, expected)]; with apply the drifted counters are
+    replaced by the recount.
+    """
+    expected = expected_counts()
+    drift = sorted(
+        (patient_id, stored, expected.get(patient_id, 0))
+        for patient_id, stored in PatientProfile.objects.values_list('pk', 'unread_notifications')
+        if stored != expected.get(patient_id, 0)
+    )
+
+    if apply:
+        with transaction.atomic():
+            for patient_id, _, count in drift:
+                PatientProfile.objects.filter(pk=patient_id).update(unread_notifications=count)
+    return drift
@@ -9,6 +9,7 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('transfer_request/', views.transfer_request, name='transfer_request'),
     path('nearby_clinics/', views.nearby_clinics, name='nearby_clinics'),
+    path('nearby_clinics/data/', views.nearby_clinics_data, name='nearby_clinics_data'),
     path('clinic/<int:clinic_id>/', views.clinic_detail, name='clinic_detail'),
     path('emergency_trigger/', views.emergency_trigger, name='emergency_trigger'),
     path('book_appointment/', views.book_appointment, name='book_appointment'),
@@ -20,6 +21,8 @@ urlpatterns = [
     path('telemedicine_sessions/', views.telemedicine_sessions, name='telemedicine_sessions'),
     path('book_telemedicine/', views.book_telemedicine_session, name='book_telemedicine'),
     path('health_metrics/', views.health_metrics, name='health_metrics'),
+    path('health_metrics/series/', views.health_metric_series, name='health_metric_series'),
+    path('health_metrics/ingest/', views.ingest_health_metrics, name='ingest_health_metrics'),
     path('add_health_metric/', views.add_health_metric, name='add_health_metric'),
     path('notifications/', views.notifications, name='notifications'),
     path('notifications/<int:notification_id>/read/', views.mark_notification_read, name='mark_notification_read'),
@@ -5,95 +5,36 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from django.contrib import messages
 from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
 from django.db import IntegrityError, transaction
-from django.http import Http404, HttpResponseBadRequest
+from django.db.models import prefetch_related_objects
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
 from .models import MedicationIntake, PatientProfile, TransferRequest, TreatmentRecord, Appointment, CounsellingSession, ExternalConsultation, MedicalDataRequest, Prescription, MedicationReminder, TelemedicineSession, HealthMetric, Notification
-from emergency.models import EmergencyAccess, EmergencyAlert
+from emergency import fanout
+from emergency.models import EmergencyAlert
 from .forms import PatientRegistrationForm, TransferRequestForm, AppointmentBookingForm
+from . import device_auth, ingest, metric_summaries, nearby, services, timeseries, unread
 from clinic.models import ClinicProfile
-from geopy.geocoders import Nominatim
+from admin_app import rollup
+from core import geocoding, geocode_queue
 from geopy.distance import geodesic
-import folium
 from safar_saathi.utils import is_patient
 import logging
-from datetime import date, timedelta, datetime
 
 logger = logging.getLogger(__name__)
 
+NOTIFICATIONS_PER_PAGE = 20
+
 
 @login_required
 @user_passes_test(is_patient)
 def dashboard(request):
     try:
         patient = request.user.patientprofile
-        transfer_requests = TransferRequest.objects.filter(patient=patient)
-        treatment_records = TreatmentRecord.objects.filter(
-            patient=patient).order_by('-record_date')[:5]
-        unread_notifications = Notification.objects.filter(
-            patient=patient, is_read=False).count()
-        
-        # # Calculate medication adherence for the last 30 days
-        # from datetime import datetime, timedelta
-        # thirty_days_ago = datetime.now() - timedelta(days=30)
-        # medication_logs = MedicationIntake.objects.filter(
-        #     reminder__prescription__patient=patient,
-        #     scheduled_time__gte=thirty_days_ago
-        # )
-        
-        # total_doses = medication_logs.count()
-        # taken_doses = medication_logs.filter(was_taken=True).count()
-        # adherence_percentage = (taken_doses / total_doses * 100) if total_doses > 0 else 100
-        
-       
-
-        # Last 30 days range
-        thirty_days_ago = date.today() - timedelta(days=30)
-
-        medication_intakes = MedicationIntake.objects.filter(
-            reminder__prescription__patient=patient,
-            intake_date__gte=thirty_days_ago,
-            reminder__is_active=True
-        )
-
-        total_doses = medication_intakes.count()
-        taken_doses = medication_intakes.filter(has_taken=True).count()
-
-        adherence_percentage = (
-            round((taken_doses / total_doses) * 100, 2)
-            if total_doses > 0
-            else 100
-        )
-
-        
-        # Get upcoming appointments
-        upcoming_appointments = Appointment.objects.filter(
-            patient=patient,
-            appointment_date__gte=datetime.now(),
-            status__in=['scheduled', 'confirmed']
-        ).order_by('appointment_date')[:3]
-        
-        # Get recent prescriptions
-        # recent_prescriptions = Prescription.objects.filter(
-        #     patient=patient,
-        #     is_active=True
-        # ).order_by('-prescription_date')[:3]
-        # prescription = Prescription.objects.filter(patient=patient, is_active=True).order_by('-prescription_date')
-        
-        medications = MedicationIntake.objects.filter(
-            reminder__prescription__patient=patient,
-            intake_date = timezone.now().date(),
-            reminder__is_active=True
-        ).order_by('-intake_date')
-        
-        context = {
-            'patient': patient,
-            'transfer_requests': transfer_requests,
-            'treatment_records': treatment_records,
-            'unread_count': unread_notifications,
-            'adherence_percentage': round(adherence_percentage, 1),
-            'upcoming_appointments': upcoming_appointments,
-            'medications': medications,
-        }
+        context = services.dashboard_context(patient)
         return render(request, 'patient/dashboard.html', context)
     except PatientProfile.DoesNotExist:
         logger.error(f"Patient profile not found for user: {request.user.username}")
@@ -123,11 +64,17 @@ def profile(request):
         request.user.save()
 
         # Update patient profile fields
+        address = request.POST.get('address', '').strip()
+        current_location = request.POST.get('current_location', '').strip()
+        if address != patient.address or current_location != patient.current_location:
+            geocode_queue.mark_pending(patient)
         patient.phone_number = request.POST.get('phone_number', '').strip()
-        patient.address = request.POST.get('address', '').strip()
-        patient.current_location = request.POST.get('current_location', '').strip()
+        patient.address = address
+        patient.current_location = current_location
         patient.consent_given = request.POST.get('consent_given') == 'on'
-        patient.save()
+        # Not a full save: that would write back a stale unread notification count
+        patient.save(update_fields=['phone_number', 'address', 'current_location', 'consent_given',
+                                    *geocode_queue.GEOCODE_FIELDS])
 
         messages.success(request, 'Profile updated successfully.')
         return redirect('patient:profile')
@@ -198,6 +145,17 @@ def transfer_request(request):
     return render(request, 'patient/transfer_request.html', context)
 
 
+def _parse_location(lat, lng):
+    """Return a (lat, lng) tuple from query parameters, or None if invalid"""
+    try:
+        location = (float(lat), float(lng))
+    except (ValueError, TypeError):
+        return None
+    if not (-90 <= location[0] <= 90) or not (-180 <= location[1] <= 180):
+        return None
+    return location
+
+
 @login_required
 @user_passes_test(is_patient)
 def nearby_clinics(request):
@@ -220,123 +178,34 @@ def nearby_clinics(request):
             f"Patient {request.user.username} searching nearby clinics "
             f"lat={patient_lat}, lng={patient_lng}"
         )
-    
-        # Fetch clinics safely
-        clinics = ClinicProfile.objects.filter(
-            is_approved=True,
-            is_active=True,
-            latitude__isnull=False,
-            longitude__isnull=False
-        )
-
-        logger.info(
-            f"Found {clinics.count()} approved clinics with location data {clinics}"
-        )
 
-        # Get patient diseases
-        try:
-            patient_diseases = set(
-                TreatmentRecord.objects.filter(patient=patient)
-                .values_list('disease', flat=True)
-            )
-            logger.info(
-                f"Patient {request.user.username} has diseases: {patient_diseases}"
-            )
-        except Exception as e:
-            logger.warning(f"Error fetching diseases: {e}")
-            patient_diseases = set()
-
-        if not patient_diseases:
-            patient_diseases = {'HIV'}
-
-        # Filter clinics by disease
-        relevant_clinics = []
-        logger.info(f"{clinics[0].name} treats diseases: {[d.name for d in clinics[0].diseases_treated.all()]}")
-        for clinic in clinics:
-            clinic_diseases = set(d.name for d in clinic.diseases_treated.all())
-            # logger.debug(f"Clinic {clinic.name} treats diseases: {clinic_diseases}")
-            if patient_diseases & clinic_diseases or not clinic_diseases:
-                relevant_clinics.append(clinic)
-        logger.info(
-            f"Found {len(relevant_clinics)} relevant clinics for patient {request.user.username}"
-        )
-        current_clinic_list = []
-        other_clinics = []
-
-        map_html = None
-
-        # Validate coordinates
+        patient_loc = None
         if patient_lat and patient_lng:
-            try:
-                patient_loc = (float(patient_lat), float(patient_lng))
-            except (ValueError, TypeError):
+            patient_loc = _parse_location(patient_lat, patient_lng)
+            if patient_loc is None:
                 logger.warning("Invalid latitude or longitude received")
                 messages.warning(request, "Invalid location coordinates.")
-                patient_loc = None
-
-            if patient_loc:
-                for clinic in relevant_clinics:
-                    try:
-                        clinic_loc = (clinic.latitude, clinic.longitude)
-                        distance = geodesic(patient_loc, clinic_loc).km
-
-                        if distance <= 50:
-                            clinic.distance = round(distance, 2)
-                            if patient.current_clinic and clinic.id == patient.current_clinic.id:
-                                current_clinic_list.append(clinic)
-                            else:
-                                other_clinics.append(clinic)
-
-                    except Exception as e:
-                        logger.warning(
-                            f"Distance calculation failed for clinic {clinic.id}: {e}"
-                        )
-
-                # Create map safely
-                try:
-                    
-
-                    m = folium.Map(
-                        location=[patient_loc[0], patient_loc[1]],
-                        zoom_start=12
-                    )
 
-                    folium.Marker(
-                        [patient_loc[0], patient_loc[1]],
-                        popup='Your Current Location',
-                        icon=folium.Icon(color='blue')
-                    ).add_to(m)
-
-                    for clinic in current_clinic_list + other_clinics:
-                        color = 'green' if clinic in current_clinic_list else 'red'
-                        folium.Marker(
-                            [clinic.latitude, clinic.longitude],
-                            popup=f"{clinic.name} - {clinic.distance} km",
-                            icon=folium.Icon(color=color)
-                        ).add_to(m)
-
-                    map_html = m._repr_html_()
-
-                except Exception as e:
-                    logger.error(f"Map generation failed: {e}")
-                    messages.warning(
-                        request,
-                        "Map could not be loaded, showing clinics list only."
-                    )
+        current_clinic_list, other_clinics = nearby.search(patient, patient_loc)
+        prefetch_related_objects(current_clinic_list + other_clinics, 'diseases_treated')
+        logger.info(
+            f"Found {len(current_clinic_list) + len(other_clinics)} relevant clinics "
+            f"for patient {request.user.username}"
+        )
 
-        else:
-            # No location → list clinics only
-            for clinic in relevant_clinics:
-                if patient.current_clinic and clinic.id == patient.current_clinic.id:
-                    current_clinic_list.append(clinic)
-                else:
-                    other_clinics.append(clinic)
+        # The map itself is drawn in the browser from nearby_clinics_data
+        map_data_url = None
+        if patient_loc:
+            map_data_url = (
+                f"{reverse('patient:nearby_clinics_data')}"
+                f"?lat={patient_loc[0]}&lng={patient_loc[1]}"
+            )
 
         context = {
             'current_clinics': current_clinic_list,
             'other_clinics': other_clinics,
             'patient': patient,
-            'map_html': map_html,
+            'map_data_url': map_data_url,
         }
 
         return render(request, 'patient/nearby_clinics.html', context)
@@ -350,6 +219,43 @@ def nearby_clinics(request):
         return redirect('patient:dashboard')
 
 
+@login_required
+@user_passes_test(is_patient)
+@cache_control(private=True, max_age=60)
+def nearby_clinics_data(request):
+    """
+    Compact JSON marker feed for the nearby clinics map. With a zoom
+    parameter (and optionally the visible bbox) dense areas come back as
+    cluster markers.
+    """
+    location = _parse_location(request.GET.get('lat'), request.GET.get('lng'))
+    if location is None:
+        return JsonResponse({'error': 'Valid lat and lng parameters are required.'}, status=400)
+
+    zoom = request.GET.get('zoom')
+    bbox = request.GET.get('bbox')
+    try:
+        zoom = int(zoom) if zoom else None
+        if bbox:
+            # Leaflet's toBBoxString(): west,south,east,north
+            west, south, east, north = (float(v) for v in bbox.split(','))
+            bbox = (south, west, north, east)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid zoom or bbox parameter.'}, status=400)
+
+    try:
+        patient = request.user.patientprofile
+        if zoom is None:
+            current_clinic_list, other_clinics = nearby.search(patient, location)
+            return JsonResponse(nearby.map_payload(location, current_clinic_list, other_clinics))
+
+        index = nearby.cluster_index(patient, location)
+        return JsonResponse(nearby.clustered_payload(location, index, zoom, bbox or None))
+    except Exception as e:
+        logger.error(f"Error building nearby clinics map data: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'Could not load nearby clinics.'}, status=500)
+
+
 @login_required
 @user_passes_test(is_patient)
 def clinic_detail(request, clinic_id):
@@ -396,13 +302,8 @@ def emergency_trigger(request):
         # Create emergency access
         
         clinic = get_object_or_404(ClinicProfile, id=clinic_id)
-        EmergencyAccess.objects.create(
-            patient=request.user.patientprofile,
-            clinic=clinic,
-            requested_by=request.user,
-            reason=reason,
-            is_active=True
-        )
+        # Reuses the clinic's active grant if it already has one
+        fanout.grant_access(request.user.patientprofile, {clinic.id: reason}, request.user)
         EmergencyAlert.objects.create(
             patient=request.user.patientprofile,
             alert_type='patient_triggered',
@@ -443,21 +344,8 @@ def register(request):
                     patient_group, created = Group.objects.get_or_create(name='Patient')
                     user.groups.add(patient_group)
 
-                    # Geocode the address with error handling
-                    lat, lng = None, None
-                    try:
-                        geolocator = Nominatim(user_agent="safar_saathi", timeout=10)
-                        full_address = f"{form.cleaned_data['address']}, {form.cleaned_data['current_location']}"
-                        location_obj = geolocator.geocode(full_address)
-                        if location_obj:
-                            lat, lng = location_obj.latitude, location_obj.longitude
-                        else:
-                            messages.warning(request, 'Could not geocode your address. You can update it later.')
-                    except Exception as e:
-                        logger.warning(f"Geocoding failed for address: {full_address} - {str(e)}")
-                        messages.warning(request, 'Could not geocode your address. You can update it later.')
-
-                    # Create patient profile
+                    # Create patient profile; the address is geocoded in the
+                    # background by the geocode_pending worker
                     PatientProfile.objects.create(
                         user=user,
                         date_of_birth=form.cleaned_data['date_of_birth'],
@@ -465,8 +353,7 @@ def register(request):
                         address=form.cleaned_data['address'],
                         current_location=form.cleaned_data['current_location'],
                         current_clinic=form.cleaned_data['current_clinic'],
-                        latitude=lat,
-                        longitude=lng,
+                        geocode_status='pending',
                         consent_given=form.cleaned_data['consent_given']
                     )
 
@@ -580,10 +467,9 @@ def book_external_consultation(request):
         current_location = request.POST.get('current_location', '')
         stay_type = request.POST['stay_type']
 
-        geolocator = Nominatim(user_agent="safar_saathi", timeout=10)
+        parent_clinic = patient.current_clinic
         try:
-            patient_location = geolocator.geocode(current_location)
-            parent_clinic = patient.current_clinic
+            patient_location = geocoding.geocode(current_location)
             if patient_location and parent_clinic.latitude and parent_clinic.longitude:
                 patient_coords = (patient_location.latitude, patient_location.longitude)
                 clinic_coords = (parent_clinic.latitude, parent_clinic.longitude)
@@ -695,10 +581,75 @@ def health_metrics(request):
     metrics = HealthMetric.objects.filter(patient=patient).order_by('-recorded_at')[:50]
     context = {
         'metrics': metrics,
+        'summaries': metric_summaries.for_patient(patient),
+        'metric_types': HealthMetric.METRIC_TYPES,
+        'series_url': reverse('patient:health_metric_series'),
     }
     return render(request, 'patient/health_metrics.html', context)
 
 
+@login_required
+@user_passes_test(is_patient)
+def health_metric_series(request):
+    """
+    JSON time series of one metric for charts: raw readings or
+    min/max/avg/count per hour, day or week, downsampled to a bounded number
+    of points (see timeseries.py).
+    """
+    try:
+        metric_type, start, end, bucket, points = timeseries.parse_query(request.GET)
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        patient = request.user.patientprofile
+        return JsonResponse(timeseries.series(patient, metric_type, start, end, bucket, points))
+    except Exception as e:
+        logger.error(f"Error building health metric series: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'Could not load health metrics.'}, status=500)
+
+
+@csrf_exempt
+def ingest_health_metrics(request):
+    """
+    Bulk upload of device readings as an NDJSON or CSV request body (see
+    ingest.py). Devices authenticate with an 'Authorization: Token <key>'
+    header (see device_auth.py); without one the patient's session is used,
+    with the usual CSRF check. Optional parameters: format, and
+    metric_type/unit for rows that leave them out. Responds with accepted,
+    duplicate and rejected counts per batch.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST an NDJSON or CSV body.'}, status=405)
+
+    key = device_auth.presented_key(request)
+    if key is not None:
+        patient = device_auth.authenticate(key)
+        if patient is None:
+            return JsonResponse({'error': 'Invalid or revoked device token.'}, status=401)
+    elif is_patient(request.user):
+        rejected = device_auth.csrf_failure(request)
+        if rejected is not None:
+            return rejected
+        patient = request.user.patientprofile
+    else:
+        return JsonResponse({'error': 'Send an Authorization: Token header or log in as a patient.'}, status=401)
+
+    fmt = ingest.detect_format(request.content_type, request.GET.get('format'))
+    if fmt is None:
+        return JsonResponse({'error': 'Send Content-Type application/x-ndjson or text/csv.'}, status=415)
+
+    try:
+        defaults = {name: request.GET[name] for name in ('metric_type', 'unit') if request.GET.get(name)}
+        report = ingest.ingest(patient, request, fmt, defaults)
+        logger.info(f"Patient {patient.user.username} uploaded {report['accepted']} health metrics "
+                    f"({report['duplicates']} duplicates, {report['rejected']} rejected)")
+        return JsonResponse(report)
+    except Exception as e:
+        logger.error(f"Error ingesting health metrics: {str(e)}", exc_info=True)
+        return JsonResponse({'error': 'Could not store the health metrics.'}, status=500)
+
+
 @login_required
 @user_passes_test(is_patient)
 def add_health_metric(request):
@@ -732,12 +683,14 @@ def add_health_metric(request):
 def notifications(request):
     try:
         patient = request.user.patientprofile
-        notifications = Notification.objects.filter(patient=patient).order_by('-created_at')
-        unread_count = notifications.filter(is_read=False).count()
-        
+        notifications = (Notification.objects.filter(Notification.DELIVERED, patient=patient)
+                         .order_by('-created_at', '-pk'))
+        page_obj = Paginator(notifications, NOTIFICATIONS_PER_PAGE).get_page(request.GET.get('page'))
+
         context = {
-            'notifications': notifications,
-            'unread_count': unread_count,
+            'notifications': page_obj,
+            'page_obj': page_obj,
+            'unread_count': services.unread_count(patient),
         }
         return render(request, 'patient/notifications.html', context)
     except PatientProfile.DoesNotExist:
@@ -771,7 +724,9 @@ def mark_notification_read(request, notification_id):
 def mark_all_notifications_read(request):
     try:
         patient = request.user.patientprofile
-        Notification.objects.filter(patient=patient, is_read=False).update(is_read=True)
+        marked = Notification.objects.filter(Notification.DELIVERED, patient=patient, is_read=False).update(is_read=True)
+        rollup.adjust('notifications', 'unread', -marked)
+        unread.adjust(patient.id, -marked)
         messages.success(request, 'All notifications marked as read.')
     except Exception as e:
         logger.error(f"Error marking all notifications as read: {str(e)}", exc_info=True)
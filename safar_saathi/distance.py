@@ -0,0 +1,49 @@
+"""
+Batch distance calculations from one origin to many coordinates.
+
+All distances are computed in a single NumPy haversine pass. Haversine
+assumes a spherical earth and differs from the WGS-84 geodesic by up to
+about 0.56% (north-south paths near the equator), so only points within a
+1% margin of a radius edge are re-measured with geopy's exact geodesic.
+"""
+import numpy as np
+from geopy.distance import geodesic
+
+# Mean earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+# Upper bound on the relative error of haversine against the geodesic
+HAVERSINE_MAX_ERROR = 0.01
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Return an array of great-circle distances in km from (lat, lng)"""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    lat0 = np.radians(lat)
+    lng0 = np.radians(lng)
+
+    a = (np.sin((lats - lat0) / 2.0) ** 2
+         + np.cos(lat0) * np.cos(lats) * np.sin((lngs - lng0) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def within_radius(lat, lng, lats, lngs, radius_km, refine=True):
+    """
+    Return (mask, distances) for the points within radius_km of (lat, lng).
+
+    With refine=True, points whose haversine distance falls inside the error
+    margin around the radius are re-measured with the exact geodesic, so the
+    membership test matches geopy. Their distances are replaced by the exact
+    values as well.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    distances = haversine_km(lat, lng, lats, lngs)
+
+    if refine and distances.size:
+        margin = radius_km * HAVERSINE_MAX_ERROR
+        for i in np.flatnonzero(np.abs(distances - radius_km) <= margin):
+            distances[i] = geodesic((lat, lng), (lats[i], lngs[i])).km
+
+    return distances <= radius_km, distances
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -102,6 +104,26 @@ DATABASES = {
 }
 
 
+# Cache
+# The dashboard blocks and their invalidation versions (core/dashboard_cache.py)
+# and the dashboard and notification dispatch counters live in the default
+# cache, so every web server process and worker must share it: a change
+# handled by one process only reaches the blocks cached by the others
+# through the shared versions. The local-memory fallback is per process and
+# only fits a single-process development server; set CACHE_REDIS_URL (e.g.
+# redis://localhost:6379/1, needs the redis package) everywhere else.
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    } if CACHE_REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -198,3 +220,58 @@ LOGGING = {
         },
     },
 }
+
+# Geocoding (see core/geocoding.py)
+GEOCODE_TIMEOUT = 5  # seconds per Nominatim request
+GEOCODE_BACKOFF_SECONDS = 300  # skip Nominatim this long after a failure
+GEOCODE_CACHE_TTL = timedelta(days=30)
+GEOCODE_NEGATIVE_TTL = timedelta(days=1)  # addresses Nominatim could not resolve
+GEOCODE_MEMORY_TTL = 3600  # seconds an entry stays in the process cache
+GEOCODE_CACHE_MAX_ENTRIES = 50000
+GEOCODE_MAX_ATTEMPTS = 6  # background geocoding retries (see core/geocode_queue.py)
+GEOCODE_RETRY_BASE_SECONDS = 60
+GEOCODE_RETRY_MAX_SECONDS = 24 * 3600
+GEOCODE_CLAIM_LEASE_SECONDS = 600  # a worker's hold on the profiles of its batch
+
+# Seconds a nearby-clinics cluster hierarchy stays cached (see patient/nearby.py)
+CLINIC_CLUSTER_CACHE_TTL = 300
+
+# Per-block TTL overrides in seconds for the cached dashboard blocks, e.g.
+# {'admin.stats': 120}; defaults and block names are in core/dashboard_cache.py.
+# Without a shared cache (see CACHES) a process can serve a stale block for
+# up to its TTL after another process changed the data behind it.
+DASHBOARD_CACHE_TTLS = {}
+
+# Most readings accepted by one bulk health metric upload (see patient/ingest.py)
+HEALTH_METRIC_INGEST_MAX_ROWS = 500000
+
+# Cold archive of old device health metric readings (see patient/archive.py):
+# readings older than HEALTH_METRIC_ARCHIVE_AGE are moved to column files
+# under HEALTH_METRIC_ARCHIVE_DIR by the archive_health_metrics command
+HEALTH_METRIC_ARCHIVE_DIR = BASE_DIR / 'archive' / 'health_metrics'
+HEALTH_METRIC_ARCHIVE_AGE = timedelta(days=180)
+
+# Scheduled notification delivery (see patient/dispatch.py). A claimed batch
+# goes back to the queue if its worker has not delivered it within the
+# lease. Handlers are dotted paths to callables that receive each batch,
+# e.g. to send e-mail or push messages.
+NOTIFICATION_DISPATCH_LEASE_SECONDS = 60
+NOTIFICATION_DELIVERY_HANDLERS = []
+
+# Notification volume (see patient/notify.py and patient/retention.py).
+# Unread notifications of the same type sent within the coalesce window
+# merge into one row. The compact_notifications command folds read
+# notifications older than the retention, or beyond the newest
+# NOTIFICATION_MAX_PER_PATIENT rows of a patient, into daily digests, and
+# purges digests older than their own retention.
+NOTIFICATION_COALESCE_WINDOW = timedelta(minutes=30)
+NOTIFICATION_RETENTION = timedelta(days=30)
+NOTIFICATION_DIGEST_RETENTION = timedelta(days=365)
+NOTIFICATION_MAX_PER_PATIENT = 500
+
+# Fan-out of live emergency alert events to clinic consoles. The default
+# in-process broker only reaches consoles on the same server process; use
+# emergency.broker.RedisBroker (OPTIONS: {'url': ...}) with several nodes.
+EMERGENCY_BROKER = {
+    'BACKEND': 'emergency.broker.InProcessBroker',
+}